@@ -0,0 +1,143 @@
+import asyncio
+import io
+from datetime import date
+
+try:
+    import numpy as np  # Необязательная зависимость: нужна только для аналитики склада
+except ImportError:
+    np = None
+
+NUMPY_AVAILABLE = np is not None
+
+# Вся номенклатура одной выборкой: остаток, средняя цена склада, цена каталога и
+# средневзвешенная цена приходов за последние recent_days дней (NaN — приходов не было).
+# Только числовые колонки: названия берутся из кеша справочников
+CATALOG_ANALYTICS_QUERY = """
+SELECT n.id, COALESCE(n.поставщик_id, 0),
+       COALESCE(o.количество_на_складе, 0)::float8,
+       COALESCE(o.середня_ціна_закупівлі, 0)::float8,
+       COALESCE(n.текущая_цена_закупки, 0)::float8,
+       COALESCE(r.цена, 'NaN')::float8
+FROM Номенклатура n
+LEFT JOIN ОстаткиСклада o ON o.номенклатура_id = n.id
+LEFT JOIN (
+    SELECT s.номенклатура_id, sum(s.количество * s.цена_закупки) / NULLIF(sum(s.количество), 0) AS цена
+    FROM СтрокиПрихода s
+    JOIN Приходы p ON p.id = s.приход_id
+    WHERE p.создано >= now() - make_interval(days => %(recent_days)s)
+    GROUP BY s.номенклатура_id
+) r ON r.номенклатура_id = n.id
+"""
+
+# Колонки выборки
+ITEM_ID, SUPPLIER_ID, QUANTITY, AVERAGE, CATALOG_PRICE, RECENT_PRICE = range(6)
+
+
+def load_catalog_arrays(db, recent_days):
+    """Выборка CATALOG_ANALYTICS_QUERY в массив (строка — товар, колонки — см. ITEM_ID..RECENT_PRICE).
+
+    db — синхронная Database (вызывается как `await db.load_catalog_arrays(...)` в пуле
+    потоков БД); строки приходят через COPY и разбираются NumPy целиком,
+    без построчной работы в Python.
+    """
+    buffer = io.BytesIO()
+    db.copy_query_csv(CATALOG_ANALYTICS_QUERY, {'recent_days': recent_days}, buffer)
+    body = buffer.getvalue().partition(b'\n')[2]  # без заголовка
+    if not body.strip():
+        return np.empty((0, 6))
+    return np.loadtxt(io.StringIO(body.decode('utf-8')), delimiter=';', ndmin=2)
+
+
+def compute(data, drift_threshold, top=10):
+    """Оценка склада, отклонения цен и свёртка по поставщикам над массивом load_catalog_arrays.
+
+    Отклонение — относительная разница средней цены склада и средней цены
+    недавних приходов с текущей ценой каталога. Позиция отмечается, если
+    любое из них больше drift_threshold. Возвращает словарь:
+    итоги, suppliers — [(поставщик_id, позиций на складе, стоимость,
+    стоимость по цене каталога, отмечено)] по убыванию стоимости и deviations —
+    top отмеченных позиций [(номенклатура_id, количество, средняя цена,
+    цена каталога, цена недавних приходов, отклонение)] по убыванию суммы расхождения.
+    """
+    item_ids = data[:, ITEM_ID].astype(np.int64)
+    supplier_ids = data[:, SUPPLIER_ID].astype(np.int64)
+    quantity = data[:, QUANTITY]
+    average = data[:, AVERAGE]
+    catalog_price = data[:, CATALOG_PRICE]
+    recent_price = data[:, RECENT_PRICE]
+
+    in_stock = quantity > 0
+    stock_quantity = np.where(in_stock, quantity, 0.0)
+    value = stock_quantity * average
+    catalog_value = stock_quantity * catalog_price
+
+    priced = catalog_price > 0
+    drift = np.full(len(data), np.nan)
+    np.divide(average - catalog_price, catalog_price, out=drift, where=priced & in_stock)
+    recent_drift = np.full(len(data), np.nan)
+    np.divide(recent_price - catalog_price, catalog_price, out=recent_drift, where=priced & ~np.isnan(recent_price))
+    flagged = (np.abs(np.nan_to_num(drift)) > drift_threshold) | (np.abs(np.nan_to_num(recent_drift)) > drift_threshold)
+
+    suppliers, inverse = np.unique(supplier_ids, return_inverse=True)
+    rollup = [
+        np.bincount(inverse, weights=weights, minlength=len(suppliers))
+        for weights in (in_stock, value, catalog_value, flagged)
+    ]
+    order = np.argsort(-rollup[1], kind='stable')
+
+    # Сумма расхождения: на сколько стоимость остатка по цене каталога отличается от складской
+    # (отмеченные позиции без остатка — в конце списка)
+    impact = np.where(flagged, np.abs(catalog_value - value), -1.0)
+    count = min(top, int(flagged.sum()))
+    worst = np.argpartition(-impact, count - 1)[:count] if count else np.empty(0, dtype=np.int64)
+    worst = worst[np.argsort(-impact[worst], kind='stable')]
+    # Из двух отклонений показывается большее по модулю
+    deviation = np.where(np.abs(np.nan_to_num(recent_drift)) > np.abs(np.nan_to_num(drift)), recent_drift, drift)
+
+    return {
+        'items': len(data),
+        'in_stock': int(in_stock.sum()),
+        'value': float(value.sum()),
+        'catalog_value': float(catalog_value.sum()),
+        'flagged': int(flagged.sum()),
+        'suppliers': [
+            (int(suppliers[i]), int(rollup[0][i]), float(rollup[1][i]), float(rollup[2][i]), int(rollup[3][i]))
+            for i in order
+        ],
+        'deviations': [
+            (int(item_ids[i]), float(quantity[i]), float(average[i]), float(catalog_price[i]),
+             None if np.isnan(recent_price[i]) else float(recent_price[i]), float(deviation[i]))
+            for i in worst
+        ],
+    }
+
+
+class CatalogAnalytics:
+    """Аналитика склада по всей номенклатуре с кешем по версии данных.
+
+    Версия — последнее движение склада, версия кеша справочников (цены
+    каталога) и текущая дата (окно недавних приходов). Пока она не изменилась,
+    повторные запросы отчёта отдают готовый результат без обращения к данным.
+    """
+
+    def __init__(self, db, catalog, recent_days=90, drift_threshold=0.15, top=10):
+        self.db = db
+        self.catalog = catalog
+        self.recent_days = recent_days
+        self.drift_threshold = drift_threshold
+        self.top = top
+        self._cached = None  # (версия, результат)
+        self._lock = asyncio.Lock()
+
+    async def summary(self):
+        """Результат compute для текущих данных или None при ошибке БД."""
+        head = await self.db.stock_journal_head()
+        if head is None:
+            return None
+        stamp = (head, self.catalog.version, date.today())
+        async with self._lock:
+            if self._cached is None or self._cached[0] != stamp:
+                data = await self.db.load_catalog_arrays(self.recent_days)
+                result = await asyncio.to_thread(compute, data, self.drift_threshold, self.top)
+                self._cached = (stamp, result)
+            return self._cached[1]
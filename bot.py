@@ -1,40 +1,192 @@
 import logging
 import asyncio
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
-from database import Database
+import metrics
+from analytics import NUMPY_AVAILABLE, CatalogAnalytics
+from breaker import STATE_CODES
+from catalog import CatalogCache
+from config import (
+    ANALYTICS_DRIFT_THRESHOLD,
+    ANALYTICS_RECENT_DAYS,
+    BACKGROUND_JOBS,
+    BOT_MODE,
+    BOT_TOKEN,
+    CATALOG_FULL_REFRESH_INTERVAL,
+    DB_RECONNECT_DELAY,
+    FSM_FLUSH_INTERVAL,
+    FSM_SESSION_TTL,
+    FSM_STORAGE,
+    IDEMPOTENCY_CACHE_SIZE,
+    IDEMPOTENCY_CLEANUP_INTERVAL,
+    IDEMPOTENCY_KEY_TTL,
+    LEDGER_COMPACT_INTERVAL,
+    METRICS_HOST,
+    METRICS_PORT,
+    ORDER_RESERVATION_TTL,
+    ORDER_SWEEP_INTERVAL,
+    SEND_QUEUE_ENABLED,
+    STOCK_SNAPSHOT_INTERVAL,
+    TELEGRAM_API_URL,
+)
+from database import create_database
+from idempotency import IdempotencyStore
+from ledger import LedgerCompactor
+from middlewares import IdempotencyMiddleware, ReadSessionMiddleware
+from reservations import ReservationSweeper
+from sender import SendQueue
+from storage import PostgresStorage
+from valuation import StockSnapshotter
 # Импорт функции регистрации роутеров
 from handlers import register_all_routers 
+from handlers.keyboards import cache_stats as keyboard_cache_stats
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
 # Инициализация бота и БД
-bot = Bot(token=BOT_TOKEN)
-db = Database()
-# Инициализация хранилища FSM (используем MemoryStorage для начала)
-storage = MemoryStorage()
+# Bot API можно подменить локальным мок-сервером (scripts/mock_telegram.py)
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else AiohttpSession()
+# Исходящие запросы — через очередь с ограничением частоты: хэндлеры не ждут сети
+sender = SendQueue() if SEND_QUEUE_ENABLED else None
+if sender is not None:
+    session.middleware(sender)
+bot = Bot(token=BOT_TOKEN, session=session)
+db = create_database()
+# Общий кеш справочников (поставщики, номенклатура)
+catalog = CatalogCache(db, full_refresh_interval=CATALOG_FULL_REFRESH_INTERVAL)
+# Инициализация хранилища FSM (Postgres — переживает перезапуск и общий для нескольких процессов)
+if FSM_STORAGE == 'postgres':
+    storage = PostgresStorage(db, flush_interval=FSM_FLUSH_INTERVAL, ttl=FSM_SESSION_TTL)
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+# Свёртка журнала расчётов в балансы поставщиков
+ledger_compactor = LedgerCompactor(db, interval=LEDGER_COMPACT_INTERVAL)
+# Отмена заказов, резерв по которым не подтвердили вовремя
+reservation_sweeper = ReservationSweeper(db, ttl=ORDER_RESERVATION_TTL, interval=ORDER_SWEEP_INTERVAL)
+# Снимки остатков по журналу движений склада (остаток на дату без полного пересчёта)
+stock_snapshotter = StockSnapshotter(db, interval=STOCK_SNAPSHOT_INTERVAL)
+# Повторы нажатий кнопок, меняющих данные (запись строки, оформление заказа и т.п.)
+idempotency = IdempotencyStore(db, maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_KEY_TTL,
+                               interval=IDEMPOTENCY_CLEANUP_INTERVAL)
 
 # --- Регистрация модулей ---
 
+# Регистрация всех роутеров из папки handlers
+register_all_routers(dp)
+# Повторное нажатие отсекается на уровне диспетчера — один раз на обновление, до роутеров
+dp.callback_query.outer_middleware(IdempotencyMiddleware(idempotency))
+# Чтения с реплик видят записи того же пользователя (read-your-writes)
+dp.update.outer_middleware(ReadSessionMiddleware())
+
+# Передача объекта БД во все хэндлеры через контекст Dispatcher
+dp['db'] = db 
+dp['catalog'] = catalog
+# Аналитика склада в отчётах — только если установлен numpy
+if NUMPY_AVAILABLE:
+    dp['analytics'] = CatalogAnalytics(db, catalog, recent_days=ANALYTICS_RECENT_DAYS,
+                                       drift_threshold=ANALYTICS_DRIFT_THRESHOLD)
+
+# Метрики кешей: видно, что запросы ролей и построение клавиатур ушли из горячего пути
+metrics.register_collector(lambda: {f"crm_role_cache_{key}": value for key, value in db.role_cache.stats().items()})
+metrics.register_collector(lambda: {f"crm_keyboard_cache_{key}": value for key, value in keyboard_cache_stats().items()})
+metrics.register_collector(lambda: {"crm_catalog_version": catalog.version})
+metrics.register_collector(lambda: {f"crm_idempotency_{key}": value for key, value in idempotency.stats().items()})
+
+
+def database_health_metrics():
+    """Состояние соединения с БД: автомат (0 — работает, 1 — проба, 2 — недоступна), сбои подряд."""
+    health = db.sync.health()
+    return {
+        "crm_db_breaker_state": STATE_CODES[health['state']],
+        "crm_db_failures": health['failures'],
+        "crm_db_connected": int(health['connected']),
+    }
+
+
+metrics.register_collector(database_health_metrics)
+if db.replicas is not None:
+    metrics.register_collector(lambda: {f"crm_db_{key}": value for key, value in db.replicas.stats().items()})
+
+metrics_runner = None
+
+
+async def on_startup():
+    """Открытие ресурсов до начала приёма обновлений."""
+    global metrics_runner
+    if metrics.ENABLED:
+        metrics_runner = await metrics.start_http_server(METRICS_HOST, METRICS_PORT)
+    await db.open()
+    # Без БД не применить миграции и не загрузить справочники: ждём её до приёма обновлений
+    while not await db.ping():
+        health = db.sync.health()
+        logging.warning("БД недоступна, ожидание запуска: %s", health['last_error'])
+        await asyncio.sleep(max(health['retry_in'], DB_RECONNECT_DELAY))
+    # Базовые таблицы и индексы — до схем модулей, которые на них опираются
+    if await db.migrate() is None:
+        raise RuntimeError("Миграции схемы не применены, запуск остановлен")
+    # Без таблиц модуля его хэндлеры падали бы на каждом обновлении — не запускаемся
+    schema_steps = [db.ensure_catalog_schema, db.ensure_ledger_schema, db.ensure_orders_schema,
+                    db.ensure_stock_schema, db.ensure_reports_schema]
+    if isinstance(storage, PostgresStorage):
+        schema_steps.insert(0, db.ensure_fsm_schema)
+    for ensure_schema in schema_steps:
+        if not await ensure_schema():
+            raise RuntimeError(f"{ensure_schema.__name__} не выполнено, запуск остановлен")
+    if isinstance(storage, PostgresStorage):
+        await storage.start()
+    await catalog.start()
+    # В режиме 'sharded' фоновые задачи выполняет один воркер
+    if BACKGROUND_JOBS:
+        await ledger_compactor.start()
+        await reservation_sweeper.start()
+        await idempotency.start()
+        await stock_snapshotter.start()
+
+
+async def on_shutdown():
+    """Закрытие ресурсов после остановки приёма обновлений."""
+    logging.info("Кеш ролей: %s", db.role_cache.stats())
+    await catalog.stop()
+    await ledger_compactor.stop()
+    await reservation_sweeper.stop()
+    await idempotency.stop()
+    await stock_snapshotter.stop()
+    # Сначала сбрасываем отложенные состояния FSM, потом закрываем пул
+    await storage.close()
+    await db.close()
+    if sender is not None:
+        await sender.drain()
+    await bot.session.close() # Закрываем сессию бота
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
 async def main():
     """Главная функция для запуска бота."""
-    
-    # Регистрация всех роутеров из папки handlers
-    register_all_routers(dp)
-    
-    # Передача объекта БД во все хэндлеры через контекст Dispatcher
-    dp['db'] = db 
-    
+    if BOT_MODE == 'sharded':
+        # Супервизор сам не обрабатывает обновления: БД и фоновые задачи — в воркерах
+        from supervisor import run_supervisor
+        try:
+            await run_supervisor(bot, allowed_updates=dp.resolve_used_update_types())
+        finally:
+            await bot.session.close()
+        return
+
+    await on_startup()
     try:
-        print("INFO:aiogram.dispatcher:Start polling")
-        await dp.start_polling(bot) 
+        if BOT_MODE == 'webhook':
+            from webhook import run_webhook
+            await run_webhook(dp, bot)
+        else:
+            print("INFO:aiogram.dispatcher:Start polling")
+            await dp.start_polling(bot) 
     finally:
-        db.close()
-        await bot.session.close() # Закрываем сессию бота
+        await on_shutdown()
 
 if __name__ == '__main__':
     try:
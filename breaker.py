@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+
+# Состояния автомата
+CLOSED = 'closed'  # БД работает, запросы идут как обычно
+OPEN = 'open'  # БД недоступна, запросы отклоняются сразу до следующей пробы
+HALF_OPEN = 'half_open'  # идёт пробное подключение, остальные запросы отклоняются
+
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class DatabaseUnavailable(Exception):
+    """БД недоступна: подключиться не удалось или автомат разомкнут.
+
+    Не наследует psycopg2.Error, поэтому не гасится обработчиками ошибок
+    запросов в Database и доходит до обработчика ошибок диспетчера, который
+    отвечает пользователю.
+    """
+
+
+class CircuitBreaker:
+    """Автомат защиты БД от повторных подключений, пока она недоступна.
+
+    После failure_threshold сбоев подряд (неудачное подключение, разорванное
+    соединение) автомат размыкается: запросы отклоняются без обращения к БД.
+    По истечении паузы пропускается одна проба; при успехе автомат замыкается,
+    при неудаче пауза удваивается от reset_timeout до max_reset_timeout.
+    Методы потокобезопасны: запросы выполняются в пуле потоков.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=1.0, max_reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = CLOSED
+        self.failures = 0  # сбоев подряд
+        self.opened = 0  # размыканий подряд без успешной пробы
+        self.delay = 0.0  # текущая пауза до пробы
+        self.retry_at = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Можно ли обращаться к БД. В разомкнутом состоянии пропускает одну пробу после паузы."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if now < self.retry_at:
+                return False
+            # Пауза истекла (или проба зависла дольше паузы) — пропускаем следующую пробу
+            self.state = HALF_OPEN
+            self.retry_at = now + self.delay
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.warning("Соединение с БД восстановлено")
+            self.state = CLOSED
+            self.failures = 0
+            self.opened = 0
+            self.delay = 0.0
+            self.last_error = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error).strip() if error else self.last_error
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened += 1
+                self.delay = min(self.max_reset_timeout, self.reset_timeout * 2 ** (self.opened - 1))
+                self.retry_at = time.monotonic() + self.delay
+                if self.state != OPEN:
+                    logging.warning("БД недоступна, следующая попытка через %.1f с: %s", self.delay, self.last_error)
+                self.state = OPEN
+
+    def stats(self):
+        """Состояние для /health и метрик."""
+        with self._lock:
+            retry_in = max(0.0, self.retry_at - time.monotonic()) if self.state != CLOSED else 0.0
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'retry_in': round(retry_in, 3),
+                'last_error': self.last_error,
+            }
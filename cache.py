@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Маркер отсутствия значения (None — допустимое закешированное значение)
+MISSING = object()
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кеш с ограничением времени жизни записей.
+
+    Хранит не более maxsize записей, вытесняя давно не использованные.
+    Записи старше ttl секунд считаются промахом (ttl=None — без срока жизни).
+    Считает попадания и промахи, чтобы можно было проверить эффективность кеша.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # ключ -> (значение, момент истечения)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        """Возвращает значение по ключу или default при промахе."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Сохраняет значение, при переполнении вытесняет самую старую запись."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Удаляет запись (например, после изменения данных в БД)."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Полная очистка кеша."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Счётчики кеша: попадания, промахи, доля попаданий и текущий размер."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            'size': len(self._data),
+        }
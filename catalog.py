@@ -0,0 +1,222 @@
+import asyncio
+import logging
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from replicas import primary_reads
+from search import ItemSearchIndex
+
+# Канал уведомлений об изменении справочников (см. Database.CATALOG_SCHEMA)
+CATALOG_CHANNEL = 'catalog_changed'
+
+
+class CatalogCache:
+    """Общий для процесса кеш справочников Поставщики и Номенклатура.
+
+    Справочники загружаются один раз при старте и индексируются по поставщику
+    и по названию. Дальше кеш обновляется точечно по уведомлениям Postgres
+    (LISTEN/NOTIFY): 'suppliers' — перечитать поставщиков, 'items:<id>' —
+    перечитать номенклатуру одного поставщика. Раз в full_refresh_interval
+    секунд выполняется полная перезагрузка на случай пропущенных уведомлений.
+
+    Хэндлеры читают данные отсюда и хранят в FSM только id.
+    """
+
+    def __init__(self, db, full_refresh_interval=3600, debounce=0.2):
+        self.db = db
+        self.full_refresh_interval = full_refresh_interval
+        self.debounce = debounce
+
+        self.version = 0  # растёт при любом изменении справочников
+        self.suppliers_version = 0
+        self._suppliers = []  # [(id, название)] по алфавиту
+        self._supplier_by_name = {}
+        self._supplier_names = {}
+        self._items = {}  # поставщик_id -> [(id, название, цена)] по алфавиту
+        self._item_by_name = {}  # поставщик_id -> {название: (id, название, цена)}
+        self._item_by_id = {}  # id -> (id, название, цена, поставщик_id)
+        self._supplier_versions = {}
+        self._search = {}  # поставщик_id -> (версия, ItemSearchIndex)
+
+        self._listen_conn = None
+        self._pending = set()
+        self._apply_task = None
+        self._refresh_task = None
+
+    # ------------------------------------------------------------------
+    # --- Чтение ---
+
+    def suppliers(self):
+        """Список поставщиков [(id, название)]."""
+        return self._suppliers
+
+    def supplier_id(self, name):
+        """id поставщика по названию (None, если нет)."""
+        return self._supplier_by_name.get(name)
+
+    def supplier_name(self, supplier_id):
+        return self._supplier_names.get(supplier_id)
+
+    def items(self, supplier_id):
+        """Номенклатура поставщика [(id, название, цена)]."""
+        return self._items.get(supplier_id, [])
+
+    def item_by_name(self, supplier_id, name):
+        """Товар поставщика по точному названию: (id, название, цена) или None."""
+        return self._item_by_name.get(supplier_id, {}).get(name)
+
+    def item(self, item_id):
+        """Товар по id: (id, название, цена, поставщик_id) или None."""
+        return self._item_by_id.get(item_id)
+
+    async def search_items(self, supplier_id, text, limit=10):
+        """Поиск товаров поставщика по части названия: [(id, название, цена)].
+
+        Индекс строится при первом поиске (в отдельном потоке — на больших каталогах
+        это секунды) и перестраивается после изменения номенклатуры поставщика.
+        """
+        version = self.supplier_version(supplier_id)
+        cached = self._search.get(supplier_id)
+        if cached is None or cached[0] != version:
+            index = await asyncio.to_thread(ItemSearchIndex, self.items(supplier_id))
+            cached = (version, index)
+            self._search[supplier_id] = cached
+        return cached[1].search(text, limit=limit)
+
+    def supplier_version(self, supplier_id):
+        """Версия номенклатуры поставщика (для кеширования производных данных)."""
+        return self._supplier_versions.get(supplier_id, 0)
+
+    # ------------------------------------------------------------------
+    # --- Загрузка ---
+
+    async def reload_all(self):
+        """Полная загрузка обоих справочников."""
+        suppliers = await self.db.get_suppliers()
+        items = await self.db.get_all_items()
+        if suppliers is None or items is None:
+            logging.warning("Справочники не загружены: ошибка БД, оставляем прежние данные")
+            return
+
+        by_supplier = {}
+        for item_id, name, price, supplier_id in items:
+            by_supplier.setdefault(supplier_id, []).append((item_id, name, price))
+
+        self._set_suppliers(suppliers)
+        for supplier_id in set(self._items) - set(by_supplier):
+            self._set_items(supplier_id, [])
+        for supplier_id, supplier_items in by_supplier.items():
+            self._set_items(supplier_id, supplier_items)
+        logging.info("Справочники загружены: поставщиков %s, товаров %s", len(suppliers), len(items))
+
+    async def reload_suppliers(self):
+        suppliers = await self.db.get_suppliers()
+        if suppliers is not None:
+            self._set_suppliers(suppliers)
+
+    async def reload_supplier_items(self, supplier_id):
+        items = await self.db.get_items_by_supplier(supplier_id)
+        if items is not None:
+            self._set_items(supplier_id, items)
+
+    def _set_suppliers(self, suppliers):
+        self._suppliers = [(supplier_id, name) for supplier_id, name in suppliers]
+        self._supplier_by_name = {name: supplier_id for supplier_id, name in self._suppliers}
+        self._supplier_names = dict(self._suppliers)
+        self.suppliers_version += 1
+        self.version += 1
+
+    def _set_items(self, supplier_id, items):
+        items = sorted(((item_id, name, price) for item_id, name, price in items), key=lambda item: item[1])
+        for item_id, *_ in self._items.get(supplier_id, []):
+            self._item_by_id.pop(item_id, None)
+        self._items[supplier_id] = items
+        self._item_by_name[supplier_id] = {item[1]: item for item in items}
+        for item_id, name, price in items:
+            self._item_by_id[item_id] = (item_id, name, price, supplier_id)
+        self._supplier_versions[supplier_id] = self._supplier_versions.get(supplier_id, 0) + 1
+        self.version += 1
+
+    # ------------------------------------------------------------------
+    # --- Обновление по LISTEN/NOTIFY ---
+
+    async def start(self):
+        """Первичная загрузка, подписка на уведомления и периодическая полная перезагрузка."""
+        await self._listen()
+        await self.reload_all()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._refresh_task, self._apply_task):
+            if task:
+                task.cancel()
+        self._close_listener()
+
+    def _connect_listener(self):
+        conn = psycopg2.connect(self.db.dsn)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CATALOG_CHANNEL}")
+        return conn
+
+    async def _listen(self):
+        try:
+            self._listen_conn = await asyncio.to_thread(self._connect_listener)
+        except psycopg2.Error as e:
+            logging.warning("Подписка на изменения справочников не удалась: %s", e)
+            self._listen_conn = None
+            return
+        asyncio.get_running_loop().add_reader(self._listen_conn.fileno(), self._on_notify)
+
+    def _close_listener(self):
+        if self._listen_conn is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._listen_conn.fileno())
+            except (ValueError, OSError):
+                pass
+            self._listen_conn.close()
+            self._listen_conn = None
+
+    def _on_notify(self):
+        try:
+            self._listen_conn.poll()
+        except psycopg2.Error as e:
+            logging.warning("Соединение LISTEN разорвано: %s", e)
+            self._close_listener()
+            asyncio.create_task(self._reconnect())
+            return
+
+        while self._listen_conn.notifies:
+            self._pending.add(self._listen_conn.notifies.pop(0).payload)
+        if self._pending and (self._apply_task is None or self._apply_task.done()):
+            self._apply_task = asyncio.create_task(self._apply_pending())
+
+    async def _apply_pending(self):
+        # Небольшая задержка собирает пачку уведомлений (массовое изменение справочника)
+        while self._pending:
+            await asyncio.sleep(self.debounce)
+            pending, self._pending = self._pending, set()
+            # Уведомление пришло после фиксации в основной БД, реплика могла её ещё не применить
+            with primary_reads():
+                if 'suppliers' in pending:
+                    await self.reload_suppliers()
+                for payload in pending:
+                    if payload.startswith('items:'):
+                        await self.reload_supplier_items(int(payload.split(':', 1)[1]))
+
+    async def _reconnect(self, delay=5):
+        while self._listen_conn is None:
+            await asyncio.sleep(delay)
+            await self._listen()
+        # Пока подписки не было, уведомления могли потеряться
+        with primary_reads():
+            await self.reload_all()
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.full_refresh_interval)
+            try:
+                await self.reload_all()
+            except Exception:
+                logging.exception("Ошибка перезагрузки справочников")
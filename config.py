@@ -19,6 +19,138 @@ DB_CONNECTION_STRING = (
     f"host='{DB_HOST}' dbname='{DB_NAME}' user='{DB_USER}' password='{DB_PASSWORD}'"
 )
 
+# Режим работы с БД: 'pool' — асинхронный доступ через пул соединений,
+# 'single' — одно общее соединение (прежнее поведение)
+DB_BACKEND = os.getenv("DB_BACKEND", "pool")
+
+# Параметры пула соединений
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 5))  # секунд ожидания свободного соединения
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", 30))  # проверка простаивавших соединений, сек
+
+# Восстановление соединения с БД. После DB_BREAKER_FAILURES сбоев подряд запросы
+# отклоняются сразу («БД недоступна»), переподключение пробуется через паузу,
+# которая удваивается от DB_RECONNECT_DELAY до DB_RECONNECT_MAX_DELAY секунд
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 5))  # таймаут одного подключения, сек
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", 3))
+DB_RECONNECT_DELAY = float(os.getenv("DB_RECONNECT_DELAY", 1))
+DB_RECONNECT_MAX_DELAY = float(os.getenv("DB_RECONNECT_MAX_DELAY", 30))
+# Повторы чтения (SELECT) на новом соединении, если старое разорвалось во время запроса
+DB_READ_RETRIES = int(os.getenv("DB_READ_RETRIES", 1))
+
+# Реплики для чтения ролей и справочников: хосты через запятую ("host" или "host:port"),
+# база, пользователь и пароль — как у основной БД. Пусто — всё читается из основной
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+DB_REPLICA_CONNECTION_STRINGS = [
+    f"host='{host}' port='{port or 5432}' dbname='{DB_NAME}' user='{DB_USER}' password='{DB_PASSWORD}'"
+    for host, _, port in (item.partition(':') for item in DB_REPLICA_HOSTS)
+]
+DB_REPLICA_POOL_SIZE = int(os.getenv("DB_REPLICA_POOL_SIZE", 5))  # соединений на реплику
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", 5))  # реплика с большим отставанием не используется, сек
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", 2))  # проверка отставания, сек
+# Сколько секунд после записи чтения пользователя ждут её на реплике (read-your-writes)
+DB_READ_SESSION_TTL = int(os.getenv("DB_READ_SESSION_TTL", 600))
+
+# Серверная подготовка запросов (PREPARE/EXECUTE). Отключить, если между ботом
+# и Postgres стоит pgbouncer в режиме transaction pooling
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "true").lower() in ("1", "true", "yes")
+
+# Кеш ролей пользователей (get_user_role)
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", 10000))
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", 300))  # секунд
+
+# Режим черновика прихода: строки копятся в FSM и записываются одной
+# транзакцией по кнопке "✅ Завершити Прихід"
+RECEIPT_DRAFT_MODE = os.getenv("RECEIPT_DRAFT_MODE", "false").lower() in ("1", "true", "yes")
+
+# Хранилище состояний FSM: 'postgres' — таблица СессииFSM в той же БД,
+# 'memory' — в памяти процесса (теряется при перезапуске)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 0.5))  # период пакетной записи, сек
+FSM_SESSION_TTL = int(os.getenv("FSM_SESSION_TTL", 86400))  # брошенные сессии удаляются через, сек
+
+# Полная перезагрузка кеша справочников (страховка к LISTEN/NOTIFY), сек
+CATALOG_FULL_REFRESH_INTERVAL = float(os.getenv("CATALOG_FULL_REFRESH_INTERVAL", 3600))
+
+# Клавиатуры товаров: размер страницы и число закешированных разметок
+KEYBOARD_PAGE_SIZE = int(os.getenv("KEYBOARD_PAGE_SIZE", 20))
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", 2000))
+
+# Сколько товаров показывать в результатах поиска по части названия
+SEARCH_RESULTS_LIMIT = int(os.getenv("SEARCH_RESULTS_LIMIT", 8))
+
+# Импорт накладных (CSV/XLSX): максимум строк в одном файле
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", 50000))
+
+# Заказы: неподтверждённый заказ держит резерв не дольше ORDER_RESERVATION_TTL сек (0 — бессрочно)
+ORDER_RESERVATION_TTL = int(os.getenv("ORDER_RESERVATION_TTL", 172800))
+ORDER_SWEEP_INTERVAL = float(os.getenv("ORDER_SWEEP_INTERVAL", 300))
+
+# Идемпотентность нажатий инлайн-кнопок: недавние токены держатся в памяти,
+# все — в таблице КлючиИдемпотентности не дольше IDEMPOTENCY_KEY_TTL сек
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", 604800))
+IDEMPOTENCY_CLEANUP_INTERVAL = float(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL", 3600))
+
+# Журнал движений склада: снимки остатков для расчёта остатка на дату, сек;
+# оценка остатка по умолчанию — 'average' (средневзвешенная) или 'fifo'
+STOCK_SNAPSHOT_INTERVAL = float(os.getenv("STOCK_SNAPSHOT_INTERVAL", 3600))
+STOCK_VALUATION_METHOD = os.getenv("STOCK_VALUATION_METHOD", "average")
+
+# Аналитика склада (analytics.py, нужен numpy): окно недавних приходов, дней,
+# и порог отклонения цены от цены каталога (0.15 — 15%)
+ANALYTICS_RECENT_DAYS = int(os.getenv("ANALYTICS_RECENT_DAYS", 90))
+ANALYTICS_DRIFT_THRESHOLD = float(os.getenv("ANALYTICS_DRIFT_THRESHOLD", 0.15))
+
+# Свёртка журнала расчётов с поставщиками в балансы, сек
+LEDGER_COMPACT_INTERVAL = float(os.getenv("LEDGER_COMPACT_INTERVAL", 60))
+
+# Исходящие запросы к Bot API: очередь с ограничением частоты (лимиты Telegram —
+# около 30 сообщений в секунду на бота и около 1 в секунду в один чат)
+SEND_QUEUE_ENABLED = os.getenv("SEND_QUEUE_ENABLED", "true").lower() in ("1", "true", "yes")
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))  # запросов/с на бота
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))  # сообщений/с в чат
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", 3))  # короткий всплеск в чат без ожидания
+SEND_CHAT_MAX_PENDING = int(os.getenv("SEND_CHAT_MAX_PENDING", 20))  # длиннее — хэндлер ждёт отправки
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 5))  # повторов после ответа 429
+SEND_DRAIN_TIMEOUT = float(os.getenv("SEND_DRAIN_TIMEOUT", 10))  # отправка очереди при остановке, сек
+# Адрес Bot API (пусто — api.telegram.org); для локального мок-сервера: http://127.0.0.1:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Режим получения обновлений: 'polling', 'webhook' или 'sharded' (супервизор,
+# распределяющий обновления по процессам-воркерам, см. supervisor.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Режим 'sharded': обновления чата всегда попадают в один и тот же воркер
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", os.cpu_count() or 2))
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", 8090))  # воркер i слушает 127.0.0.1:SHARD_BASE_PORT+i
+SHARD_MAX_QUEUE = int(os.getenv("SHARD_MAX_QUEUE", 10000))  # ещё не переданных воркеру обновлений на шард
+SHARD_START_TIMEOUT = float(os.getenv("SHARD_START_TIMEOUT", 60))  # запуск воркера до готовности, сек
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", 60))  # плавная остановка воркера, сек
+
+# Номер воркера (задаёт супервизор). Фоновые задачи (свёртка журнала, отмена
+# резервов, очистка ключей идемпотентности, снимки остатков) в режиме 'sharded'
+# выполняет только воркер 0
+WORKER_ID = int(os.getenv("WORKER_ID", 0))
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "true").lower() in ("1", "true", "yes")
+
+# Настройки webhook (aiohttp-сервер)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный URL; пусто — set_webhook не вызывается (локальные тесты)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", 32))  # одновременно обрабатываемых чатов
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", 10000))  # принятых, но не обработанных обновлений
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 30))  # ожидание очереди при остановке, сек
+
+# Метрики (формат Prometheus на http://METRICS_HOST:METRICS_PORT/metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", 0.2))  # запросы дольше, сек, пишутся в лог
+
 # Проверка, что токен и данные БД загружены
 if not all([BOT_TOKEN, DB_HOST, DB_NAME, DB_USER, DB_PASSWORD]):
     raise EnvironmentError("Не все необходимые переменные окружения загружены из .env!")
\ No newline at end of file
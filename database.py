@@ -1,153 +1,1422 @@
+import asyncio
+import contextvars
+import functools
+import io
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
 import psycopg2
-from config import DB_CONNECTION_STRING
+import psycopg2.extensions
+from psycopg2 import pool as pg_pool
+from psycopg2.errorcodes import INVALID_SQL_STATEMENT_NAME
+from psycopg2.extras import Json, execute_values
+
+import analytics
+import metrics
+import migrate
+import reports
+from breaker import CLOSED, CircuitBreaker, DatabaseUnavailable
+from cache import MISSING, TTLCache
+from config import (
+    DB_BACKEND,
+    DB_BREAKER_FAILURES,
+    DB_CONNECT_TIMEOUT,
+    DB_CONNECTION_STRING,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_HEALTH_CHECK_INTERVAL,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_PREPARED_STATEMENTS,
+    DB_READ_RETRIES,
+    DB_RECONNECT_DELAY,
+    DB_RECONNECT_MAX_DELAY,
+    DB_REPLICA_CHECK_INTERVAL,
+    DB_REPLICA_CONNECTION_STRINGS,
+    DB_REPLICA_MAX_LAG,
+    DB_REPLICA_POOL_SIZE,
+    DB_READ_SESSION_TTL,
+    ROLE_CACHE_SIZE,
+    ROLE_CACHE_TTL,
+    STOCK_VALUATION_METHOD,
+)
+from replicas import Replica, ReplicaSet, parse_lsn, session
+from statements import READ, RECEIPT_MOVEMENT, RETURNING, STATEMENTS, UPSERT_INVENTORY, PreparingConnection, classify
+from valuation import ItemValuation, replay
 
 class Database:
     """Класс для взаимодействия с базой данных PostgreSQL."""
     
-    def __init__(self):
-        # Автоматическое подключение
-        try:
-            self.conn = psycopg2.connect(DB_CONNECTION_STRING)
-            print("Успешное подключение к PostgreSQL.")
-        except Exception as e:
-            print(f"Ошибка подключения к БД: {e}")
-            self.conn = None
-            
+    def __init__(self, dsn=DB_CONNECTION_STRING, prepare_statements=DB_PREPARED_STATEMENTS,
+                 read_retries=DB_READ_RETRIES, replicas=None):
+        self.dsn = dsn
+        # Кеш ролей по telegram_id: роль проверяется на каждое сообщение
+        self.role_cache = TTLCache(maxsize=ROLE_CACHE_SIZE, ttl=ROLE_CACHE_TTL)
+        # Запросы реестра statements готовятся на сервере один раз на соединение
+        self.prepare_statements = prepare_statements
+        # Переподключение с паузами после сбоев (breaker.CircuitBreaker)
+        self.breaker = CircuitBreaker(DB_BREAKER_FAILURES, DB_RECONNECT_DELAY, DB_RECONNECT_MAX_DELAY)
+        self.read_retries = read_retries
+        self._closed = False
+        # Реплики для чтения (replicas.ReplicaSet) или None — всё читается отсюда
+        self.replicas = replicas
+        # Автоматическое подключение (при неудаче — повтор при первом запросе)
+        self.conn = None
+        self.open()
+
+    def open(self):
+        """Подключение к БД, если соединения нет или оно разорвано."""
+        self._closed = False
+        if self.conn is None or self.conn.closed:
+            try:
+                self.conn = psycopg2.connect(self.dsn, connection_factory=PreparingConnection,
+                                             connect_timeout=DB_CONNECT_TIMEOUT)
+                print("Успешное подключение к PostgreSQL.")
+            except psycopg2.Error as e:
+                print(f"Ошибка подключения к БД: {e}")
+                self.conn = None
+                self.breaker.record_failure(e)
+        if self.replicas is not None:
+            self.replicas.open()
+        return self
+
     def close(self):
         """Закрытие соединения с БД."""
+        self._closed = True
         if self.conn:
             self.conn.close()
             print("Соединение с PostgreSQL закрыто.")
+        if self.replicas is not None:
+            self.replicas.close()
+
+    @property
+    def connected(self):
+        return self.conn is not None and not self.conn.closed
+
+    def health(self):
+        """Состояние соединения с БД: автомат переподключения и наличие соединения."""
+        health = {**self.breaker.stats(), 'connected': self.connected}
+        if self.replicas is not None:
+            health['replicas'] = self.replicas.health()
+        return health
+
+    def ping(self):
+        """True, если БД отвечает на SELECT 1 (False — в том числе пока автомат разомкнут)."""
+        try:
+            return self.execute_query("SELECT 1", fetch_one=True, name='ping') is not None
+        except DatabaseUnavailable:
+            return False
 
-    def execute_query(self, query, params=None, fetch_one=False, fetch_all=False):
-        """Общая функция для выполнения запросов (SELECT, INSERT, UPDATE, DELETE)."""
-        if not self.conn:
+    def _check_available(self):
+        """DatabaseUnavailable, если автомат разомкнут и время следующей пробы не пришло."""
+        if not self.breaker.allow():
+            stats = self.breaker.stats()
+            raise DatabaseUnavailable(f"БД недоступна, повтор через {stats['retry_in']} с: {stats['last_error']}")
+
+    def _acquire(self):
+        """Возвращает соединение для одного запроса; разорванное переподключается.
+
+        DatabaseUnavailable — подключиться не удалось или автомат разомкнут;
+        None — соединение закрыто вызовом close().
+        """
+        if self.connected:
+            return self.conn
+        if self._closed:
             return None
+        self._check_available()
+        self.open()
+        if self.conn is None:
+            raise DatabaseUnavailable(f"Нет соединения с БД: {self.breaker.last_error}")
+        return self.conn
+
+    def _release(self, conn, discard=False):
+        """Возвращает соединение после запроса. Для одиночного соединения ничего не делает."""
 
+    @contextmanager
+    def connection(self):
+        """Контекст для работы с одним соединением: берёт его и гарантированно возвращает."""
+        conn = self._acquire()
         try:
-            with self.conn.cursor() as cur:
-                cur.execute(query, params)
-                
-                if query.strip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
-                    self.conn.commit()
-                    # Возвращаем ID для INSERT или количество строк для UPDATE/DELETE
-                    if query.strip().upper().startswith('INSERT') and cur.description is not None:
-                         # Попытка получить ID, если это INSERT с RETURNING
-                         # Это будет работать, если вы используете RETURNING id в INSERT запросе.
-                         try:
-                             return cur.fetchone()[0]
-                         except TypeError:
-                             return cur.rowcount # Если RETURNING не использовался
-                    return cur.rowcount
-                
-                if fetch_one:
-                    return cur.fetchone()
-                if fetch_all:
-                    # Возвращает список кортежей с результатами
-                    return cur.fetchall()
-                    
-                return None
-                
+            yield conn
+        finally:
+            if conn is not None:
+                # Разорванное соединение (conn.closed) — сбой для автомата, в пул оно не возвращается
+                lost = bool(conn.closed)
+                if lost:
+                    self.breaker.record_failure("соединение разорвано")
+                else:
+                    self.breaker.record_success()
+                self._release(conn, discard=lost)
+
+    @contextmanager
+    def transaction(self, name='transaction'):
+        """Курсор в одной транзакции: COMMIT при успехе, ROLLBACK при любой ошибке.
+
+        name — имя для метрик (время всей транзакции).
+        """
+        with metrics.timed_query(name), self.connection() as conn:
+            if not conn:
+                raise psycopg2.OperationalError("Нет соединения с БД")
+            try:
+                with conn.cursor() as cur:
+                    yield cur
+                conn.commit()
+                self._note_write(conn)
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+
+    def execute_query(self, query, params=None, fetch_one=False, fetch_all=False, commit=False, name='query'):
+        """Общая функция для выполнения запросов (SELECT, INSERT, UPDATE, DELETE).
+
+        commit=True — явная фиксация для запросов, которые не начинаются с
+        INSERT/UPDATE/DELETE (например, WITH ... INSERT); результат выбирается по fetch_one/fetch_all.
+        name — имя запроса для метрик (обычно имя метода Database).
+        """
+        if not metrics.ENABLED:
+            return self._execute_query(query, params, fetch_one, fetch_all, commit, name)
+
+        started = time.perf_counter()
+        result = self._execute_query(query, params, fetch_one, fetch_all, commit, name)
+        metrics.observe_query(name, time.perf_counter() - started, result, query)
+        return result
+
+    def _execute_query(self, query, params, fetch_one, fetch_all, commit, name):
+        kind = classify(query)
+        # Чтение повторяется на новом соединении, если старое разорвалось во время запроса
+        retries = self.read_retries if kind == READ and not commit else 0
+        while True:
+            with self.connection() as conn:
+                if not conn:
+                    return None
+
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(query, params)
+
+                        if commit:
+                            if fetch_one:
+                                result = cur.fetchone()
+                            elif fetch_all:
+                                result = cur.fetchall()
+                            else:
+                                result = cur.rowcount
+                            conn.commit()
+                            self._note_write(conn)
+                            return result
+
+                        if kind != READ:
+                            conn.commit()
+                            self._note_write(conn)
+                            # Возвращаем ID для INSERT ... RETURNING или количество строк для UPDATE/DELETE
+                            if kind == RETURNING and cur.description is not None:
+                                 try:
+                                     return cur.fetchone()[0]
+                                 except TypeError:
+                                     return cur.rowcount # Если RETURNING ничего не вернул
+                            return cur.rowcount
+
+                        if fetch_one:
+                            return cur.fetchone()
+                        if fetch_all:
+                            # Возвращает список кортежей с результатами
+                            return cur.fetchall()
+
+                        return None
+
+                except psycopg2.Error as e:
+                    if conn.closed and retries:
+                        retries -= 1
+                        print(f"Соединение разорвано, повтор запроса {name}: {e}")
+                        continue
+                    if not conn.closed:
+                        conn.rollback()
+                    if metrics.ENABLED:
+                        metrics.DB_QUERY_ERRORS.inc(name)
+                    print(f"Ошибка выполнения SQL-запроса: {e}")
+                    return None
+
+    def run(self, name, params=None):
+        """Выполнение запроса из реестра statements по имени.
+
+        Запрос готовится на сервере (PREPARE) при первом использовании на
+        соединении, дальше выполняется через EXECUTE без повторного разбора и
+        планирования. Фиксация и форма результата заданы видом запроса.
+        Возвращает результат или None при ошибке; DatabaseUnavailable, если к БД
+        не удалось подключиться.
+        """
+        statement = STATEMENTS[name]
+        if not metrics.ENABLED:
+            return self._run_statement(statement, params)
+
+        started = time.perf_counter()
+        result = self._run_statement(statement, params)
+        metrics.observe_query(name, time.perf_counter() - started, result, statement.sql)
+        return result
+
+    def _run_statement(self, statement, params):
+        if statement.replica and self.replicas is not None:
+            result = self.replicas.run(statement, params, self._execute_statement)
+            if result is not MISSING:
+                return result
+
+        # Чтение повторяется на новом соединении, если старое разорвалось во время запроса
+        retries = self.read_retries if statement.kind == READ else 0
+        while True:
+            with self.connection() as conn:
+                if not conn:
+                    return None
+
+                try:
+                    result = self._execute_statement(conn, statement, params)
+                    if statement.commit:
+                        conn.commit()
+                        self._note_write(conn)
+                    return result
+
+                except psycopg2.Error as e:
+                    if conn.closed and retries:
+                        retries -= 1
+                        print(f"Соединение разорвано, повтор запроса {statement.name}: {e}")
+                        continue
+                    if not conn.closed:
+                        conn.rollback()
+                    if metrics.ENABLED:
+                        metrics.DB_QUERY_ERRORS.inc(statement.name)
+                    print(f"Ошибка выполнения SQL-запроса {statement.name}: {e}")
+                    return None
+
+    def _execute_statement(self, conn, statement, params):
+        """Выполнение запроса реестра на соединении (без фиксации); ошибки psycopg2 пробрасываются."""
+        prepared = getattr(conn, 'prepared', None) if self.prepare_statements else None
+        try:
+            with conn.cursor() as cur:
+                if prepared is None:
+                    cur.execute(statement.sql, params)
+                else:
+                    if statement.name not in prepared:
+                        cur.execute(statement.prepare_sql)
+                        prepared.add(statement.name)
+                    cur.execute(statement.execute_sql, statement.args(params))
+                return statement.result(cur)
         except psycopg2.Error as e:
-            self.conn.rollback()
-            print(f"Ошибка выполнения SQL-запроса: {e}")
-            return None
+            if prepared is not None and e.pgcode == INVALID_SQL_STATEMENT_NAME:
+                # Сессия сброшена (DISCARD ALL и т.п.) — подготовим заново при следующем вызове
+                prepared.clear()
+            raise
+
+    def _note_write(self, conn):
+        """Позиция WAL после зафиксированной записи — для чтений этой сессии с реплик (read-your-writes)."""
+        if self.replicas is None or not self.replicas.tracking():
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_current_wal_insert_lsn()::text")
+                lsn = parse_lsn(cur.fetchone()[0])
+            conn.rollback()
+        except psycopg2.Error as e:
+            # Позиция неизвестна — чтения сессии пойдут в основную БД
+            print(f"Ошибка чтения позиции WAL: {e}")
+            lsn = None
+        self.replicas.note_write(lsn)
+
+    # ------------------------------------------------------------------
+    # --- Схема БД (migrate.py, migrations/) ---
+
+    def migrate(self):
+        """Применение новых миграций схемы. Возвращает список применённых версий или None при ошибке."""
+        return migrate.apply_migrations(self)
 
     # ------------------------------------------------------------------
     # --- Базовые Функции CRM ---
     
     def get_user_role(self, telegram_id):
-        """Получение роли пользователя для авторизации."""
-        query = "SELECT роль, имя FROM Пользователи WHERE telegram_id = %s"
-        result = self.execute_query(query, (telegram_id,), fetch_one=True)
-        
+        """Получение роли пользователя для авторизации (через кеш ролей)."""
+        cached = self.role_cache.get(telegram_id)
+        if cached is not MISSING:
+            return cached
+        return self._load_user_role(telegram_id)
+
+    def _load_user_role(self, telegram_id):
+        """Чтение роли из БД с сохранением в кеш."""
+        result = self.run('get_user_role', (telegram_id,))
+
         if result:
+            # Кешируем только найденных пользователей: None может означать и ошибку БД
+            result = tuple(result)
+            self.role_cache.set(telegram_id, result)
             # Возвращает (роль, имя)
             return result
         return None, None # Если пользователь не найден
 
     def add_new_user(self, telegram_id, role, name, code=None):
         """Добавление нового пользователя (только для админа, но базовый метод)."""
-        query = """
-        INSERT INTO Пользователи (telegram_id, роль, имя, код_менеджера)
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (telegram_id) DO NOTHING;
-        """
-        return self.execute_query(query, (telegram_id, role, name, code))
+        # Запись относится к сессии нового пользователя: его следующее чтение роли её увидит
+        with session(telegram_id):
+            result = self.run('add_new_user', (telegram_id, role, name, code))
+        self.role_cache.invalidate(telegram_id)
+        return result
+
+    def update_user_role(self, telegram_id, role):
+        """Изменение роли пользователя со сбросом закешированной роли."""
+        with session(telegram_id):
+            result = self.run('update_user_role', (role, telegram_id))
+        self.role_cache.invalidate(telegram_id)
+        return result
         
     # ------------------------------------------------------------------
     # --- Функции Справочников для модуля Прихода ---
     
     def get_suppliers(self):
         """Получает список всех поставщиков."""
-        query = "SELECT id, название FROM Поставщики ORDER BY название"
         # Возвращает список кортежей: [(id, название), ...]
-        return self.execute_query(query, fetch_all=True)
+        return self.run('get_suppliers')
 
     def get_items_by_supplier(self, supplier_id):
         """Получает номенклатуру, соответствующую поставщику."""
-        query = """
-        SELECT id, название_товара, текущая_цена_закупки 
-        FROM Номенклатура 
-        WHERE поставщик_id = %s 
-        ORDER BY название_товара
-        """
         # Возвращает список: [(id, название_товара, цена), ...]
-        return self.execute_query(query, (supplier_id,), fetch_all=True)
+        return self.run('get_items_by_supplier', (supplier_id,))
+
+    def get_all_items(self):
+        """Вся номенклатура одним запросом (для кеша справочников)."""
+        # Возвращает список: [(id, название_товара, цена, поставщик_id), ...]
+        return self.run('get_all_items')
     
     def create_new_receipt(self, supplier_id, user_id):
         """Создание заголовка нового документа Прихода."""
-        query = """
-        INSERT INTO Приходы (поставщик_id, завсклада_id)
-        VALUES (%s, %s)
-        RETURNING id;
-        """
         # Используем RETURNING id, чтобы получить ID созданного документа
-        return self.execute_query(query, (supplier_id, user_id), fetch_one=True)
+        return self.run('create_new_receipt', (supplier_id, user_id))
 
 
     def add_receipt_line(self, receipt_id, item_id, quantity, price):
         """Добавление строки в документ Прихода."""
-        query = """
-        INSERT INTO СтрокиПрихода (приход_id, номенклатура_id, количество, цена_закупки)
-        VALUES (%s, %s, %s, %s);
-        """
-        return self.execute_query(query, (receipt_id, item_id, quantity, price))
+        return self.run('add_receipt_line', (receipt_id, item_id, quantity, price))
 
     def update_inventory(self, item_id, quantity, price):
-        
-        # Використовуємо коректну назву стовпця "середня_ціна_закупівлі"
-        update_query = """
-        UPDATE ОстаткиСклада 
-        SET количество_на_складе = количество_на_складе + %s,
-            середня_ціна_закупівлі = ((середня_ціна_закупівлі * количество_на_складе) + (%s * %s)) / (количество_на_складе + %s)
-        WHERE номенклатура_id = %s;
-        """
-        rows_updated = self.execute_query(update_query, (quantity, price, quantity, quantity, item_id))
-        
-        # Вставка нової номенклатури
-        if rows_updated == 0:
-            insert_query = """
-            INSERT INTO ОстаткиСклада (номенклатура_id, количество_на_складе, середня_ціна_закупівлі)
-            VALUES (%s, %s, %s);
-            """
-            self.execute_query(insert_query, (item_id, quantity, price))
-        
-        return True
+        """Оприходование товара на склад с пересчётом средневзвешенной цены (UPSERT)."""
+        result = self.run('update_inventory', {'item_id': item_id, 'quantity': quantity, 'price': price})
+        return result is not None
     
     def register_initial_debt(self, receipt_id): # <--- Прибираємо supplier_id з параметрів
-        query = """
-        INSERT INTO ЗадолженностиПоставщикам (приход_id, сумма_задолженности, сумма_оплачено, статус)
-        VALUES (%s, 0, 0, 'не оплачено')
-        """
         # Зверніть увагу: використовуємо лише receipt_id для вставки
-        self.execute_query(query, (receipt_id,))
+        self.run('register_initial_debt', (receipt_id,))
 
     def update_debt_amount(self, receipt_id, line_amount):
         """Збільшує суму заборгованості на суму нового рядка."""
-        query = """
-        UPDATE ЗадолженностиПоставщикам
-        SET сумма_задолженности = сумма_задолженности + %s
-        WHERE приход_id = %s
+        self.run('update_debt_amount', (line_amount, receipt_id))
+
+    def save_receipt_line(self, receipt_id, supplier_id, user_id, item_id, quantity, price):
+        """Запись строки прихода одной транзакцией за один запрос.
+
+        Если receipt_id пуст, создаёт заголовок прихода и запись задолженности.
+        Добавляет строку, оприходует товар (средневзвешенная цена) и увеличивает долг.
+        Возвращает (receipt_id, новый остаток, сумма долга по приходу) или None при ошибке.
+        """
+        params = {
+            'receipt_id': receipt_id,
+            'supplier_id': supplier_id,
+            'user_id': user_id,
+            'item_id': item_id,
+            'quantity': quantity,
+            'price': price,
+            'line_total': round(quantity * price, 2),
+        }
+
+        # Два подготовленных варианта: первая строка создаёт приход и долг, следующие — дополняют
+        return self.run('save_receipt_line' if receipt_id else 'save_receipt_line_new', params)
+
+
+    # С какого числа строк прихода они загружаются через COPY, а не INSERT ... VALUES
+    COPY_THRESHOLD = 500
+
+    def commit_receipt_draft(self, supplier_id, user_id, lines, name='commit_receipt_draft'):
+        """Запись черновика прихода целиком в одной транзакции.
+
+        lines — список [номенклатура_id, количество, цена] из FSM или из импорта накладной.
+        Строки вставляются пачкой (большие приходы — через COPY), остатки обновляются
+        одним UPSERT на каждый товар (с суммарным количеством и средней ценой партии),
+        движения склада — по строкам, долг — одной записью журнала расчётов.
+        Возвращает (receipt_id, сумма прихода) или None при ошибке.
+        """
+        # Decimal, чтобы средневзвешенная цена партии считалась без погрешности float
+        lines = [(item_id, Decimal(str(quantity)), Decimal(str(price))) for item_id, quantity, price in lines]
+        totals = defaultdict(lambda: [Decimal(0), Decimal(0)])  # item_id -> [количество, стоимость]
+        for item_id, quantity, price in lines:
+            totals[item_id][0] += quantity
+            totals[item_id][1] += quantity * price
+        # Сортировка по id — одинаковый порядок блокировок строк остатков во всех транзакциях
+        stock_rows = [(item_id, qty, cost / qty) for item_id, (qty, cost) in sorted(totals.items())]
+        receipt_total = sum(round(quantity * price, 2) for _, quantity, price in lines)
+
+        try:
+            with self.transaction(name) as cur:
+                cur.execute(
+                    "INSERT INTO Приходы (поставщик_id, завсклада_id) VALUES (%s, %s) RETURNING id",
+                    (supplier_id, user_id)
+                )
+                receipt_id = cur.fetchone()[0]
+
+                if len(lines) >= self.COPY_THRESHOLD:
+                    buffer = io.StringIO(''.join(
+                        f"{receipt_id}\t{item_id}\t{quantity}\t{price}\n" for item_id, quantity, price in lines
+                    ))
+                    cur.copy_expert(
+                        "COPY СтрокиПрихода (приход_id, номенклатура_id, количество, цена_закупки) FROM STDIN",
+                        buffer
+                    )
+                else:
+                    execute_values(
+                        cur,
+                        "INSERT INTO СтрокиПрихода (приход_id, номенклатура_id, количество, цена_закупки) VALUES %s",
+                        [(receipt_id, item_id, quantity, price) for item_id, quantity, price in lines]
+                    )
+                execute_values(cur, UPSERT_INVENTORY.format(values='%s'), stock_rows)
+                # Движения — по строкам (каждая строка — своя партия FIFO), одним запросом на сервере
+                cur.execute(
+                    RECEIPT_MOVEMENT.format(values="""
+                    SELECT номенклатура_id, 'приход', количество, цена_закупки, приход_id, %s
+                    FROM СтрокиПрихода WHERE приход_id = %s
+                    """),
+                    (user_id, receipt_id)
+                )
+                cur.execute(
+                    """
+                    INSERT INTO ЖурналРасчётов (поставщик_id, приход_id, вид, сумма, пользователь_id)
+                    VALUES (%s, %s, 'приход', %s, %s)
+                    """,
+                    (supplier_id, receipt_id, receipt_total, user_id)
+                )
+            return receipt_id, receipt_total
+        except psycopg2.Error as e:
+            print(f"Ошибка записи прихода ({name}): {e}")
+            return None
+
+
+    # ------------------------------------------------------------------
+    # --- Журнал расчётов с поставщиками (handlers/finance.py) ---
+
+    # Журнал только дописывается: начисления по приходам (+) и оплаты (-).
+    # БалансыПоставщиков — свёрнутые суммы журнала до записи до_записи;
+    # баланс = свёрнутая часть + короткий хвост журнала (см. statements.SUPPLIER_BALANCE)
+    LEDGER_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS ЖурналРасчётов (
+        id BIGSERIAL PRIMARY KEY,
+        поставщик_id INTEGER NOT NULL,
+        приход_id INTEGER,
+        вид TEXT NOT NULL CHECK (вид IN ('приход', 'оплата', 'корректировка')),
+        сумма NUMERIC(14, 2) NOT NULL,
+        создано TIMESTAMPTZ NOT NULL DEFAULT now(),
+        пользователь_id BIGINT,
+        комментарий TEXT
+    );
+    CREATE INDEX IF NOT EXISTS журналрасчётов_поставщик_idx ON ЖурналРасчётов (поставщик_id, id);
+
+    CREATE TABLE IF NOT EXISTS БалансыПоставщиков (
+        поставщик_id INTEGER PRIMARY KEY,
+        начислено NUMERIC(14, 2) NOT NULL DEFAULT 0,
+        оплачено NUMERIC(14, 2) NOT NULL DEFAULT 0,
+        до_записи BIGINT NOT NULL DEFAULT 0,
+        обновлено TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """
+
+    # Начальные начисления: неоплаченный остаток долга по каждому приходу из
+    # ЗадолженностиПоставщикам (дата прихода — для расчёта сроков долга)
+    LEDGER_BACKFILL = """
+    INSERT INTO ЖурналРасчётов (поставщик_id, приход_id, вид, сумма, создано, комментарий)
+    SELECT p.поставщик_id, z.приход_id, 'приход', z.сумма_задолженности - z.сумма_оплачено, p.создано,
+           'долг до журнала расчётов'
+    FROM ЗадолженностиПоставщикам z
+    JOIN Приходы p ON p.id = z.приход_id
+    WHERE z.сумма_задолженности - z.сумма_оплачено <> 0
+    ORDER BY p.создано, z.приход_id
+    """
+
+    def ensure_ledger_schema(self):
+        """Создание таблиц журнала расчётов, если их ещё нет.
+
+        Если журнала ещё нет, он начинается с открытых долгов из
+        ЗадолженностиПоставщикам; SHARE-блокировка не даёт изменить их между
+        чтением и созданием журнала.
+        """
+        try:
+            with self.transaction('ensure_ledger_schema') as cur:
+                cur.execute("SELECT to_regclass('ЖурналРасчётов') IS NULL")
+                created = cur.fetchone()[0]
+                if created:
+                    cur.execute("LOCK TABLE ЗадолженностиПоставщикам IN SHARE MODE")
+                cur.execute(self.LEDGER_SCHEMA)
+                if created:
+                    cur.execute(self.LEDGER_BACKFILL)
+                    print(f"Журнал ЖурналРасчётов начат с открытых долгов: {cur.rowcount} приходов.")
+            return True
+        except psycopg2.Error as e:
+            print(f"Ошибка создания таблиц журнала расчётов: {e}")
+            return False
+
+    def supplier_balance(self, supplier_id):
+        """Текущий долг перед поставщиком (отрицательный — переплата)."""
+        return self.run('supplier_balance', {'supplier_id': supplier_id})
+
+    def supplier_balances(self):
+        """Поставщики с ненулевым балансом: [(id, название, баланс), ...], крупные долги первыми."""
+        return self.run('supplier_balances')
+
+    def supplier_aging(self, supplier_id):
+        """Непогашенный долг по давности: [(корзина, сумма), ...].
+
+        Корзины: 0 — до AGING_BUCKETS[0] дней, 1, 2 — следующие интервалы, 3 — старше.
+        """
+        return self.run('supplier_aging', {'supplier_id': supplier_id})
+
+    def record_payment(self, supplier_id, amount, user_id, comment=None):
+        """Запись оплаты поставщику. Возвращает (id записи, новый баланс) или None при ошибке."""
+        params = {'supplier_id': supplier_id, 'amount': amount, 'user_id': user_id, 'comment': comment}
+        return self.run('record_payment', params)
+
+    def ledger_compact(self):
+        """Свёртка хвоста журнала в БалансыПоставщиков. Возвращает число обновлённых поставщиков.
+
+        SHARE-блокировка журнала дожидается транзакций, уже получивших id записи,
+        и задерживает новые записи до конца свёртки, поэтому после неё в журнале
+        не появится записей с id меньше свёрнутого.
+        """
+        try:
+            with self.transaction('ledger_compact') as cur:
+                cur.execute("LOCK TABLE ЖурналРасчётов IN SHARE MODE")
+                cur.execute(
+                    """
+                    INSERT INTO БалансыПоставщиков AS b (поставщик_id, начислено, оплачено, до_записи)
+                    SELECT поставщик_id,
+                           COALESCE(sum(сумма) FILTER (WHERE сумма > 0), 0),
+                           COALESCE(-sum(сумма) FILTER (WHERE сумма < 0), 0),
+                           max(id)
+                    FROM ЖурналРасчётов
+                    WHERE id > (SELECT COALESCE(max(до_записи), 0) FROM БалансыПоставщиков)
+                    GROUP BY поставщик_id
+                    ON CONFLICT (поставщик_id) DO UPDATE
+                    SET начислено = b.начислено + EXCLUDED.начислено,
+                        оплачено = b.оплачено + EXCLUDED.оплачено,
+                        до_записи = EXCLUDED.до_записи,
+                        обновлено = now()
+                    """
+                )
+                return cur.rowcount
+        except psycopg2.Error as e:
+            print(f"Ошибка свёртки журнала расчётов: {e}")
+            return 0
+
+
+    # ------------------------------------------------------------------
+    # --- Заказы и резервирование остатков (handlers/order.py) ---
+
+    # Резерв хранится прямо в строке остатка, поэтому доступное к обещанию
+    # количество (ATP) = количество_на_складе - зарезервировано читается по ключу,
+    # без обхода открытых заказов
+    ORDERS_SCHEMA = """
+    ALTER TABLE ОстаткиСклада ADD COLUMN IF NOT EXISTS зарезервировано NUMERIC NOT NULL DEFAULT 0;
+
+    CREATE TABLE IF NOT EXISTS Заказы (
+        id SERIAL PRIMARY KEY,
+        менеджер_id BIGINT NOT NULL,
+        статус TEXT NOT NULL DEFAULT 'ожидает' CHECK (статус IN ('ожидает', 'подтвержден', 'отменен')),
+        создано TIMESTAMPTZ NOT NULL DEFAULT now(),
+        закрыто TIMESTAMPTZ
+    );
+    CREATE INDEX IF NOT EXISTS заказы_ожидают_idx ON Заказы (создано) WHERE статус = 'ожидает';
+
+    CREATE TABLE IF NOT EXISTS СтрокиЗаказа (
+        заказ_id INTEGER NOT NULL REFERENCES Заказы (id),
+        номенклатура_id INTEGER NOT NULL,
+        количество NUMERIC NOT NULL CHECK (количество > 0)
+    );
+    CREATE INDEX IF NOT EXISTS строкизаказа_заказ_idx ON СтрокиЗаказа (заказ_id);
+    """
+
+    def ensure_orders_schema(self):
+        """Создание таблиц заказов и колонки резерва, если их ещё нет."""
+        try:
+            with self.transaction('ensure_orders_schema') as cur:
+                cur.execute(self.ORDERS_SCHEMA)
+            return True
+        except psycopg2.Error as e:
+            print(f"Ошибка создания таблиц заказов: {e}")
+            return False
+
+    def available_to_promise(self, item_ids):
+        """Доступное к заказу количество {номенклатура_id: количество} (нет остатка — 0)."""
+        rows = self.run('available_to_promise', (list(item_ids),))
+        if rows is None:
+            return None
+        available = dict.fromkeys(item_ids, Decimal(0))
+        available.update(rows)
+        return available
+
+    def place_order(self, manager_id, lines):
+        """Создание заказа с резервированием остатков в одной транзакции.
+
+        lines — [[номенклатура_id, количество], ...]. Строки остатков блокируются
+        (FOR UPDATE) в порядке id, поэтому параллельные заказы одного товара
+        выстраиваются в очередь и не уходят в минус, а взаимных блокировок нет.
+        Возвращает (id заказа, []) или (None, [(номенклатура_id, нужно, доступно), ...])
+        при нехватке; None при ошибке БД.
+        """
+        totals = defaultdict(Decimal)
+        for item_id, quantity in lines:
+            totals[int(item_id)] += Decimal(str(quantity))
+        item_ids = sorted(totals)
+
+        try:
+            with self.transaction('place_order') as cur:
+                cur.execute(
+                    """
+                    SELECT номенклатура_id, количество_на_складе - зарезервировано
+                    FROM ОстаткиСклада
+                    WHERE номенклатура_id = ANY(%s)
+                    ORDER BY номенклатура_id
+                    FOR UPDATE
+                    """,
+                    (item_ids,)
+                )
+                available = dict(cur.fetchall())
+                shortages = [
+                    (item_id, totals[item_id], available.get(item_id, Decimal(0)))
+                    for item_id in item_ids
+                    if totals[item_id] > available.get(item_id, Decimal(0))
+                ]
+                if shortages:
+                    return None, shortages
+
+                cur.execute("INSERT INTO Заказы (менеджер_id) VALUES (%s) RETURNING id", (manager_id,))
+                order_id = cur.fetchone()[0]
+                execute_values(
+                    cur,
+                    "INSERT INTO СтрокиЗаказа (заказ_id, номенклатура_id, количество) VALUES %s",
+                    [(order_id, item_id, totals[item_id]) for item_id in item_ids]
+                )
+                execute_values(
+                    cur,
+                    """
+                    UPDATE ОстаткиСклада o SET зарезервировано = o.зарезервировано + v.количество
+                    FROM (VALUES %s) AS v (номенклатура_id, количество)
+                    WHERE o.номенклатура_id = v.номенклатура_id
+                    """,
+                    [(item_id, totals[item_id]) for item_id in item_ids]
+                )
+            return order_id, []
+        except psycopg2.Error as e:
+            print(f"Ошибка создания заказа: {e}")
+            return None
+
+    def pending_orders(self, limit=20):
+        """Неподтверждённые заказы, старые первыми: [(id, имя менеджера, создано, [[номенклатура_id, количество], ...])]."""
+        return self.run('pending_orders', (limit,))
+
+    def confirm_orders(self, order_ids):
+        """Подтверждение заказов пачкой: резерв списывается вместе с остатком. Возвращает id подтверждённых."""
+        return self._close_orders(order_ids, 'подтвержден', 'confirm_orders')
+
+    def release_orders(self, order_ids):
+        """Отмена заказов пачкой с освобождением резерва. Возвращает id отменённых."""
+        return self._close_orders(order_ids, 'отменен', 'release_orders')
+
+    def release_expired_orders(self, ttl_seconds):
+        """Отмена заказов, не подтверждённых за ttl_seconds. Возвращает id отменённых."""
+        rows = self.run('expired_orders', (ttl_seconds,))
+        if not rows:
+            return []
+        return self._close_orders([row[0] for row in rows], 'отменен', 'release_expired_orders')
+
+    def _close_orders(self, order_ids, status, name):
+        """Закрытие ожидающих заказов одной транзакцией.
+
+        Сначала блокируются сами заказы (повторное подтверждение того же заказа
+        из другого окна ничего не сделает), затем строки остатков — в порядке id,
+        как при резервировании. Резерв по всем заказам пачки снимается одним UPDATE.
+        """
+        try:
+            with self.transaction(name) as cur:
+                cur.execute(
+                    """
+                    SELECT id FROM Заказы
+                    WHERE id = ANY(%s) AND статус = 'ожидает'
+                    ORDER BY id
+                    FOR UPDATE
+                    """,
+                    (list(order_ids),)
+                )
+                closed = [row[0] for row in cur.fetchall()]
+                if not closed:
+                    return []
+
+                cur.execute(
+                    """
+                    SELECT номенклатура_id, sum(количество) FROM СтрокиЗаказа
+                    WHERE заказ_id = ANY(%s)
+                    GROUP BY номенклатура_id
+                    ORDER BY номенклатура_id
+                    """,
+                    (closed,)
+                )
+                totals = cur.fetchall()
+                cur.execute(
+                    "SELECT 1 FROM ОстаткиСклада WHERE номенклатура_id = ANY(%s) ORDER BY номенклатура_id FOR UPDATE",
+                    ([item_id for item_id, _ in totals],)
+                )
+                # Подтверждённый заказ отгружается: уходит и из резерва, и из остатка
+                shipped = "o.количество_на_складе - v.количество" if status == 'подтвержден' else "o.количество_на_складе"
+                execute_values(
+                    cur,
+                    f"""
+                    UPDATE ОстаткиСклада o
+                    SET зарезервировано = o.зарезервировано - v.количество,
+                        количество_на_складе = {shipped}
+                    FROM (VALUES %s) AS v (номенклатура_id, количество)
+                    WHERE o.номенклатура_id = v.номенклатура_id
+                    """,
+                    totals
+                )
+                if status == 'подтвержден':
+                    cur.execute(
+                        """
+                        INSERT INTO ДвиженияСклада (номенклатура_id, вид, количество, заказ_id)
+                        SELECT номенклатура_id, 'отгрузка', -количество, заказ_id
+                        FROM СтрокиЗаказа WHERE заказ_id = ANY(%s)
+                        """,
+                        (closed,)
+                    )
+                cur.execute(
+                    "UPDATE Заказы SET статус = %s, закрыто = now() WHERE id = ANY(%s)",
+                    (status, closed)
+                )
+            return closed
+        except psycopg2.Error as e:
+            print(f"Ошибка закрытия заказов ({name}): {e}")
+            return None
+
+
+    # ------------------------------------------------------------------
+    # --- Журнал движений склада (valuation.py) ---
+
+    # Журнал только дописывается: приходы, корректировки и отгрузки по заказам
+    # (количество со знаком, цена — только у приходов). ОстаткиСклада — его
+    # проекция: каждая запись остатка делается в той же транзакции, что и движение.
+    # СнимкиОстатков — состояние товара (количество, средняя цена, партии FIFO)
+    # после движения до_движения; остаток на дату = снимок + хвост движений.
+    STOCK_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS ДвиженияСклада (
+        id BIGSERIAL PRIMARY KEY,
+        номенклатура_id INTEGER NOT NULL,
+        вид TEXT NOT NULL CHECK (вид IN ('начальный', 'приход', 'корректировка', 'отгрузка')),
+        количество NUMERIC NOT NULL,
+        цена NUMERIC,
+        приход_id INTEGER,
+        заказ_id INTEGER,
+        создано TIMESTAMPTZ NOT NULL DEFAULT now(),
+        пользователь_id BIGINT,
+        комментарий TEXT
+    );
+    CREATE INDEX IF NOT EXISTS движениясклада_номенклатура_idx ON ДвиженияСклада (номенклатура_id, id);
+
+    CREATE TABLE IF NOT EXISTS СнимкиОстатков (
+        номенклатура_id INTEGER NOT NULL,
+        до_движения BIGINT NOT NULL,
+        на_момент TIMESTAMPTZ NOT NULL,
+        количество NUMERIC NOT NULL,
+        средняя_цена NUMERIC NOT NULL,
+        слои_fifo JSONB NOT NULL DEFAULT '[]'::jsonb,
+        PRIMARY KEY (номенклатура_id, до_движения)
+    );
+    CREATE INDEX IF NOT EXISTS снимкиостатков_до_движения_idx ON СнимкиОстатков (до_движения);
+    """
+
+    # Начальные остатки: история до появления журнала неизвестна, поэтому
+    # текущий остаток по средней цене становится первым движением товара
+    STOCK_BACKFILL = """
+    INSERT INTO ДвиженияСклада (номенклатура_id, вид, количество, цена, комментарий)
+    SELECT номенклатура_id, 'начальный', количество_на_складе, середня_ціна_закупівлі, 'остаток до журнала движений'
+    FROM ОстаткиСклада
+    WHERE количество_на_складе <> 0
+    ORDER BY номенклатура_id
+    """
+
+    def ensure_stock_schema(self):
+        """Создание журнала движений и снимков остатков.
+
+        Если журнала ещё нет, он начинается с текущих остатков; SHARE-блокировка
+        не даёт изменить остатки между их чтением и созданием журнала.
+        """
+        try:
+            with self.transaction('ensure_stock_schema') as cur:
+                cur.execute("SELECT to_regclass('ДвиженияСклада') IS NULL")
+                created = cur.fetchone()[0]
+                if created:
+                    cur.execute("LOCK TABLE ОстаткиСклада IN SHARE MODE")
+                cur.execute(self.STOCK_SCHEMA)
+                if created:
+                    cur.execute(self.STOCK_BACKFILL)
+                    print(f"Журнал ДвиженияСклада начат с остатков: {cur.rowcount} товаров.")
+            return True
+        except psycopg2.Error as e:
+            print(f"Ошибка создания журнала движений склада: {e}")
+            return False
+
+    def adjust_stock(self, item_id, actual_quantity, user_id, comment=None):
+        """Корректировка остатка до фактического количества (инвентаризация).
+
+        Разница записывается движением 'корректировка' без цены (оценивается по
+        средней); строка остатка блокируется, поэтому одновременный приход не
+        потеряется. Возвращает (разница, новый остаток) или None при ошибке.
+        """
+        actual = Decimal(str(actual_quantity))
+        try:
+            with self.transaction('adjust_stock') as cur:
+                cur.execute(
+                    """
+                    INSERT INTO ОстаткиСклада (номенклатура_id, количество_на_складе, середня_ціна_закупівлі)
+                    VALUES (%s, 0, 0)
+                    ON CONFLICT (номенклатура_id) DO NOTHING
+                    """,
+                    (item_id,)
+                )
+                cur.execute(
+                    "SELECT количество_на_складе FROM ОстаткиСклада WHERE номенклатура_id = %s FOR UPDATE",
+                    (item_id,)
+                )
+                delta = actual - cur.fetchone()[0]
+                if delta:
+                    cur.execute(
+                        """
+                        INSERT INTO ДвиженияСклада (номенклатура_id, вид, количество, пользователь_id, комментарий)
+                        VALUES (%s, 'корректировка', %s, %s, %s)
+                        """,
+                        (item_id, delta, user_id, comment)
+                    )
+                    cur.execute(
+                        "UPDATE ОстаткиСклада SET количество_на_складе = %s WHERE номенклатура_id = %s",
+                        (actual, item_id)
+                    )
+            return delta, actual
+        except psycopg2.Error as e:
+            print(f"Ошибка корректировки остатка: {e}")
+            return None
+
+    def snapshot_stock(self):
+        """Снимки товаров, у которых появились движения после последнего снимка.
+
+        Хвост журнала после последнего учтённого движения применяется к прежнему
+        снимку товара (valuation.ItemValuation). SHARE-блокировка журнала, как в
+        ledger_compact, гарантирует, что после снимка не появится движений с
+        меньшим id. Возвращает число товаров с новым снимком.
+        """
+        try:
+            with self.transaction('snapshot_stock') as cur:
+                cur.execute("LOCK TABLE ДвиженияСклада IN SHARE MODE")
+                cur.execute(
+                    """
+                    WITH tail AS (
+                        SELECT номенклатура_id, array_agg(ARRAY[количество, цена] ORDER BY id) AS движения,
+                               max(id) AS до_движения, max(создано) AS на_момент
+                        FROM ДвиженияСклада
+                        WHERE id > (SELECT COALESCE(max(до_движения), 0) FROM СнимкиОстатков)
+                        GROUP BY номенклатура_id
+                    )
+                    SELECT t.номенклатура_id, s.количество, s.средняя_цена, s.слои_fifo, t.движения,
+                           t.до_движения, GREATEST(t.на_момент, s.на_момент)
+                    FROM tail t
+                    LEFT JOIN LATERAL (
+                        SELECT количество, средняя_цена, слои_fifo, на_момент
+                        FROM СнимкиОстатков
+                        WHERE номенклатура_id = t.номенклатура_id
+                        ORDER BY до_движения DESC
+                        LIMIT 1
+                    ) s ON true
+                    """
+                )
+                snapshots = []
+                for item_id, quantity, average, layers, movements, last_id, moment in cur.fetchall():
+                    state = replay(ItemValuation.from_snapshot(quantity, average, layers), movements)
+                    quantity, average, layers = state.to_snapshot()
+                    snapshots.append((item_id, last_id, moment, quantity, average, Json(layers)))
+                if snapshots:
+                    execute_values(
+                        cur,
+                        """
+                        INSERT INTO СнимкиОстатков
+                            (номенклатура_id, до_движения, на_момент, количество, средняя_цена, слои_fifo)
+                        VALUES %s
+                        """,
+                        snapshots
+                    )
+                return len(snapshots)
+        except psycopg2.Error as e:
+            print(f"Ошибка создания снимков остатков: {e}")
+            return 0
+
+    def stock_journal_head(self):
+        """id последнего движения склада (0 — журнал пуст) или None при ошибке."""
+        return self.run('stock_journal_head')
+
+    def stock_as_of(self, moment, item_ids=None, method=STOCK_VALUATION_METHOD):
+        """Остатки на момент moment: [(номенклатура_id, количество, стоимость)] или None при ошибке.
+
+        Для каждого товара берётся ближайший снимок не позже moment и применяется
+        хвост движений после него. method — valuation.AVERAGE или valuation.FIFO.
+        item_ids=None — все товары (с ненулевым остатком на момент).
+        """
+        params = {'moment': moment, 'item_ids': list(item_ids) if item_ids is not None else None}
+        rows = self.run('stock_as_of', params)
+        if rows is None:
+            return None
+        stock = []
+        for item_id, quantity, average, layers, movements in rows:
+            state = replay(ItemValuation.from_snapshot(quantity, average, layers), movements)
+            if state.quantity:
+                stock.append((item_id, state.quantity, state.value(method)))
+        return stock
+
+    # ------------------------------------------------------------------
+    # --- Отчёты (handlers/admin.py, reports.py) ---
+
+    # Агрегат приходов по дням и поставщикам поддерживается триггером уровня
+    # оператора: каждая пачка строк (INSERT, execute_values, COPY) добавляется
+    # в ОтчетПриходы одним UPSERT, поэтому отчёты не сканируют СтрокиПрихода.
+    # Дата прихода — Приходы.создано (migrations/0004_receipt_created_at.sql).
+    REPORTS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS ОтчетПриходы (
+        день DATE NOT NULL,
+        поставщик_id INTEGER NOT NULL,
+        строк INTEGER NOT NULL DEFAULT 0,
+        количество NUMERIC NOT NULL DEFAULT 0,
+        сумма NUMERIC(16, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (день, поставщик_id)
+    );
+
+    CREATE OR REPLACE FUNCTION refresh_receipt_report() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO ОтчетПриходы AS r (день, поставщик_id, строк, количество, сумма)
+        SELECT p.создано::date, p.поставщик_id, count(*), sum(n.количество), sum(n.количество * n.цена_закупки)
+        FROM new_lines n
+        JOIN Приходы p ON p.id = n.приход_id
+        GROUP BY 1, 2
+        ON CONFLICT (день, поставщик_id) DO UPDATE
+        SET строк = r.строк + EXCLUDED.строк,
+            количество = r.количество + EXCLUDED.количество,
+            сумма = r.сумма + EXCLUDED.сумма;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS строкиприхода_report ON СтрокиПрихода;
+    CREATE TRIGGER строкиприхода_report
+        AFTER INSERT ON СтрокиПрихода
+        REFERENCING NEW TABLE AS new_lines
+        FOR EACH STATEMENT EXECUTE FUNCTION refresh_receipt_report();
+    """
+
+    # Первичное заполнение агрегата из уже записанных строк прихода
+    REPORTS_BACKFILL = """
+    INSERT INTO ОтчетПриходы (день, поставщик_id, строк, количество, сумма)
+    SELECT p.создано::date, p.поставщик_id, count(*), sum(n.количество), sum(n.количество * n.цена_закупки)
+    FROM СтрокиПрихода n
+    JOIN Приходы p ON p.id = n.приход_id
+    GROUP BY 1, 2
+    """
+
+    def ensure_reports_schema(self):
+        """Создание агрегатов отчётов и триггера их обновления.
+
+        Если агрегата ещё нет, он заполняется из СтрокиПрихода в той же транзакции;
+        SHARE-блокировка не даёт записать строки между заполнением и установкой триггера.
+        """
+        try:
+            with self.transaction('ensure_reports_schema') as cur:
+                cur.execute("SELECT to_regclass('ОтчетПриходы') IS NULL")
+                created = cur.fetchone()[0]
+                if created:
+                    cur.execute("LOCK TABLE СтрокиПрихода IN SHARE MODE")
+                cur.execute(self.REPORTS_SCHEMA)
+                if created:
+                    cur.execute(self.REPORTS_BACKFILL)
+                    print(f"Агрегат ОтчетПриходы заполнен: {cur.rowcount} строк.")
+            return True
+        except psycopg2.Error as e:
+            print(f"Ошибка создания агрегатов отчётов: {e}")
+            return False
+
+    def report_stock_value(self):
+        """Оценка склада по поставщикам: [(поставщик, товаров, количество, сумма)]."""
+        return self.run('report_stock_value')
+
+    def report_receipts(self, date_from, date_to):
+        """Приходы за период [date_from, date_to) по поставщикам: [(поставщик, строк, количество, сумма)]."""
+        return self.run('report_receipts', {'date_from': date_from, 'date_to': date_to})
+
+    def report_debt_aging(self):
+        """Долги поставщикам по давности: [(поставщик, баланс, корзина0, корзина1, корзина2, корзина3)]."""
+        return self.run('report_debt_aging')
+
+    def copy_query_csv(self, query, params, file, delimiter=';'):
+        """Выгрузка результата запроса в CSV через COPY TO STDOUT (строки не проходят через Python)."""
+        with self.connection() as conn:
+            if not conn:
+                raise psycopg2.OperationalError("Нет соединения с БД")
+            try:
+                with conn.cursor() as cur:
+                    select = cur.mogrify(query, params).decode(psycopg2.extensions.encodings[conn.encoding])
+                    cur.copy_expert(f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER, DELIMITER '{delimiter}')", file)
+            finally:
+                conn.rollback()
+
+    def iter_query(self, query, params=None, itersize=2000):
+        """Построчное чтение большого результата серверным курсором (порциями по itersize).
+
+        Первым отдаёт список названий колонок, затем строки. Генератор держит
+        соединение до конца перебора — вызывать из рабочего потока.
+        """
+        with self.connection() as conn:
+            if not conn:
+                raise psycopg2.OperationalError("Нет соединения с БД")
+            try:
+                with conn.cursor(name='report_export') as cur:
+                    cur.execute(query, params)
+                    rows = cur.fetchmany(itersize)
+                    # У серверного курсора описание колонок появляется после первой выборки
+                    yield [column[0] for column in cur.description]
+                    while rows:
+                        yield from rows
+                        rows = cur.fetchmany(itersize)
+            finally:
+                conn.rollback()
+
+    # Выгрузки читают через copy_query_csv/iter_query, которые в конце откатывают
+    # транзакцию соединения. Поэтому из хэндлеров они вызываются только как
+    # `await db.метод(...)` — в пуле потоков БД, а не в общем пуле asyncio:
+    # при DB_BACKEND='single' иначе можно откатить чужую незавершённую транзакцию
+
+    def export_report(self, report, params=None, fmt='csv'):
+        """Выгрузка отчёта во временный файл (reports.export_report); возвращает путь."""
+        return reports.export_report(self, report, params, fmt)
+
+    def load_catalog_arrays(self, recent_days):
+        """Номенклатура для аналитики склада массивом NumPy (analytics.load_catalog_arrays)."""
+        return analytics.load_catalog_arrays(self, recent_days)
+
+    # ------------------------------------------------------------------
+    # --- Хранилище состояний FSM (storage.PostgresStorage) ---
+
+    FSM_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS СессииFSM (
+        ключ TEXT PRIMARY KEY,
+        состояние TEXT,
+        данные JSONB NOT NULL DEFAULT '{}'::jsonb,
+        обновлено TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS сессииfsm_обновлено_idx ON СессииFSM (обновлено);
+    """
+
+    def ensure_fsm_schema(self):
+        """Создание таблицы сессий FSM, если её ещё нет."""
+        try:
+            with self.transaction('ensure_fsm_schema') as cur:
+                cur.execute(self.FSM_SCHEMA)
+            return True
+        except psycopg2.Error as e:
+            print(f"Ошибка создания таблицы СессииFSM: {e}")
+            return False
+
+    def fsm_load(self, key):
+        """Состояние и данные сессии: (состояние, данные) или None."""
+        return self.run('fsm_load', (key,))
+
+    def fsm_save_batch(self, rows):
+        """Пакетная запись сессий [(ключ, состояние, данные), ...].
+
+        Пустые сессии (без состояния и данных) удаляются. Возвращает True при успехе.
         """
-        self.execute_query(query, (line_amount, receipt_id))
\ No newline at end of file
+        upserts = [(key, state, Json(data)) for key, state, data in rows if state is not None or data]
+        deletes = [key for key, state, data in rows if state is None and not data]
+        try:
+            with self.transaction('fsm_save_batch') as cur:
+                if upserts:
+                    execute_values(
+                        cur,
+                        """
+                        INSERT INTO СессииFSM (ключ, состояние, данные) VALUES %s
+                        ON CONFLICT (ключ) DO UPDATE
+                        SET состояние = EXCLUDED.состояние, данные = EXCLUDED.данные, обновлено = now()
+                        """,
+                        upserts
+                    )
+                if deletes:
+                    cur.execute("DELETE FROM СессииFSM WHERE ключ = ANY(%s)", (deletes,))
+            return True
+        except (psycopg2.Error, DatabaseUnavailable) as e:
+            # БД недоступна — сессии остаются в очереди PostgresStorage до следующей попытки
+            print(f"Ошибка записи сессий FSM: {e}")
+            return False
+
+    def fsm_delete_expired(self, ttl_seconds):
+        """Удаление сессий, не менявшихся дольше ttl_seconds. Возвращает число удалённых."""
+        return self.run('fsm_delete_expired', (ttl_seconds,))
+
+    # ------------------------------------------------------------------
+    # --- Ключи идемпотентности нажатий кнопок (idempotency.py) ---
+
+    def claim_idempotency_key(self, key):
+        """Запись ключа нажатия. True — ключ новый, False — уже был, None — ошибка БД."""
+        claimed = self.run('claim_idempotency_key', (key,))
+        return None if claimed is None else claimed == 1
+
+    def delete_expired_idempotency_keys(self, ttl_seconds):
+        """Удаление ключей старше ttl_seconds. Возвращает число удалённых."""
+        return self.run('idempotency_delete_expired', (ttl_seconds,))
+
+
+    # ------------------------------------------------------------------
+    # --- Уведомления об изменении справочников (catalog.CatalogCache) ---
+
+    # Триггеры шлют в канал catalog_changed: 'suppliers' или 'items:<поставщик_id>'.
+    # Одинаковые уведомления в одной транзакции Postgres объединяет сам.
+    CATALOG_SCHEMA = """
+    CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_ARGV[0] = 'suppliers' THEN
+            PERFORM pg_notify('catalog_changed', 'suppliers');
+        ELSE
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_notify('catalog_changed', 'items:' || NEW.поставщик_id);
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM pg_notify('catalog_changed', 'items:' || OLD.поставщик_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS поставщики_catalog_notify ON Поставщики;
+    CREATE TRIGGER поставщики_catalog_notify
+        AFTER INSERT OR UPDATE OR DELETE ON Поставщики
+        FOR EACH ROW EXECUTE FUNCTION notify_catalog_changed('suppliers');
+
+    DROP TRIGGER IF EXISTS номенклатура_catalog_notify ON Номенклатура;
+    CREATE TRIGGER номенклатура_catalog_notify
+        AFTER INSERT OR UPDATE OR DELETE ON Номенклатура
+        FOR EACH ROW EXECUTE FUNCTION notify_catalog_changed('items');
+    """
+
+    def ensure_catalog_schema(self):
+        """Установка триггеров уведомлений об изменении справочников."""
+        try:
+            with self.transaction('ensure_catalog_schema') as cur:
+                cur.execute(self.CATALOG_SCHEMA)
+            return True
+        except psycopg2.Error as e:
+            print(f"Ошибка установки триггеров справочников: {e}")
+            return False
+
+
+class PooledDatabase(Database):
+    """Database поверх ограниченного пула соединений psycopg2.
+
+    Каждый запрос берёт своё соединение из пула, поэтому запросы из разных потоков
+    не мешают друг другу. Размер пула ограничен (min/max), ожидание свободного
+    соединения ограничено таймаутом, а простаивавшие соединения проверяются перед выдачей.
+    """
+
+    def __init__(self, dsn=DB_CONNECTION_STRING, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT, health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+                 prepare_statements=DB_PREPARED_STATEMENTS, read_retries=DB_READ_RETRIES, replicas=None):
+        self.dsn = dsn
+        self.role_cache = TTLCache(maxsize=ROLE_CACHE_SIZE, ttl=ROLE_CACHE_TTL)
+        self.prepare_statements = prepare_statements
+        self.conn = None  # Общего соединения нет — всё идёт через пул
+        self.breaker = CircuitBreaker(DB_BREAKER_FAILURES, DB_RECONNECT_DELAY, DB_RECONNECT_MAX_DELAY)
+        self.read_retries = read_retries
+        self._closed = False
+        self.replicas = replicas
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.pool = None
+        # ThreadedConnectionPool не умеет ждать свободное соединение, поэтому
+        # ограничиваем число одновременных выдач семафором с таймаутом
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._last_used = {}
+
+    def open(self):
+        """Создание пула и первых min_size соединений."""
+        self._closed = False
+        if self.pool is None:
+            try:
+                self.pool = pg_pool.ThreadedConnectionPool(
+                    self.min_size, self.max_size, self.dsn, connection_factory=PreparingConnection,
+                    connect_timeout=DB_CONNECT_TIMEOUT,
+                )
+                print(f"Пул соединений PostgreSQL открыт ({self.min_size}..{self.max_size}).")
+            except psycopg2.Error as e:
+                print(f"Ошибка подключения к БД: {e}")
+                self.pool = None
+                self.breaker.record_failure(e)
+        if self.replicas is not None:
+            self.replicas.open()
+        return self
+
+    def close(self):
+        """Закрытие всех соединений пула."""
+        self._closed = True
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+            self._last_used.clear()
+            print("Пул соединений PostgreSQL закрыт.")
+        if self.replicas is not None:
+            self.replicas.close()
+
+    @property
+    def connected(self):
+        return self.pool is not None
+
+    def _is_healthy(self, conn, ping=False):
+        """Проверка соединения: закрытые отбрасываем, долго простаивавшие (или все при ping) пингуем."""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn), 0)
+        if not ping and time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _acquire(self):
+        if self._closed:
+            return None
+        # После сбоев первое соединение — проба: простаивавшие соединения пула могли разорваться
+        probe = self.breaker.state != CLOSED
+        self._check_available()
+        if self.pool is None:
+            self.open()
+            if self.pool is None:
+                raise DatabaseUnavailable(f"Нет соединения с БД: {self.breaker.last_error}")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            print(f"Нет свободных соединений в пуле за {self.acquire_timeout} с.")
+            return None
+        try:
+            conn = self.pool.getconn()
+            if not self._is_healthy(conn, ping=probe):
+                self._last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+            return conn
+        except psycopg2.Error as e:
+            # Новое соединение пула не открылось — БД недоступна
+            self._slots.release()
+            print(f"Ошибка получения соединения из пула: {e}")
+            self.breaker.record_failure(e)
+            raise DatabaseUnavailable(f"Нет соединения с БД: {e}") from e
+
+    def _release(self, conn, discard=False):
+        try:
+            if self.pool is not None:
+                if discard or conn.closed:
+                    self._last_used.pop(id(conn), None)
+                    self.pool.putconn(conn, close=True)
+                else:
+                    self._last_used[id(conn)] = time.monotonic()
+                    self.pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database с тем же набором методов.
+
+    Любой метод синхронной Database (get_user_role, get_suppliers, add_receipt_line, ...)
+    вызывается как `await db.метод(...)` и выполняется в отдельном пуле потоков,
+    поэтому медленный запрос не блокирует цикл событий aiogram.
+    """
+
+    def __init__(self, db, max_workers=None):
+        self._db = db
+        self._max_workers = max_workers or getattr(db, 'max_size', 1)
+        self._executor = None
+
+    @property
+    def sync(self):
+        """Исходная синхронная Database (для скриптов и фоновых потоков)."""
+        return self._db
+
+    async def open(self):
+        """Открытие пула соединений и пула потоков. Вызывается до старта polling."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="db")
+        await self._run(self._db.open)
+        return self
+
+    async def close(self):
+        """Закрытие соединений и остановка пула потоков."""
+        if self._executor is None:
+            return
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def get_user_role(self, telegram_id):
+        """Роль из кеша без перехода в пул потоков; при промахе — запрос к БД."""
+        cached = self._db.role_cache.get(telegram_id)
+        if cached is not MISSING:
+            return cached
+        return await self._run(self._db._load_user_role, telegram_id)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # С контекстом вызывающей задачи: сессия чтения (replicas.read_session) доходит до потока
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, context.run, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await self._run(attr, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+def create_replica_set():
+    """Реплики из DB_REPLICA_CONNECTION_STRINGS (None, если не настроены)."""
+    if not DB_REPLICA_CONNECTION_STRINGS:
+        return None
+    replicas = [
+        Replica(f"replica{index}", PooledDatabase(dsn, min_size=1, max_size=DB_REPLICA_POOL_SIZE, read_retries=0))
+        for index, dsn in enumerate(DB_REPLICA_CONNECTION_STRINGS, 1)
+    ]
+    return ReplicaSet(replicas, max_lag=DB_REPLICA_MAX_LAG, check_interval=DB_REPLICA_CHECK_INTERVAL,
+                      session_ttl=DB_READ_SESSION_TTL)
+
+
+def create_database():
+    """Создаёт асинхронную БД согласно DB_BACKEND из config.py.
+
+    'pool'   — пул соединений DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE;
+    'single' — одно общее соединение (прежний режим), запросы выполняются по одному.
+    Чтения ролей и справочников идут на реплики, если заданы DB_REPLICA_HOSTS.
+    """
+    if DB_BACKEND == 'single':
+        return AsyncDatabase(Database(replicas=create_replica_set()), max_workers=1)
+    if DB_BACKEND == 'pool':
+        return AsyncDatabase(PooledDatabase(replicas=create_replica_set()))
+    raise ValueError(f"Неизвестный DB_BACKEND: {DB_BACKEND!r} (ожидается 'pool' или 'single')")
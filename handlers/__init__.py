@@ -1,24 +1,50 @@
 import logging  # <-- ДОБАВЬТЕ ЭТУ СТРОКУ
 
 from aiogram import Dispatcher, Router
+from aiogram.filters import ExceptionTypeFilter
+from aiogram.types import ErrorEvent
+
+from breaker import DatabaseUnavailable
+from middlewares import AuthMiddleware, MetricsMiddleware
 
 # Импортируем модули 
 from . import auth
 from . import receipt
-# from . import order
-# from . import admin
-# from . import finance
+from . import finance
+from . import order
+from . import admin
+from . import stock
+
+DATABASE_UNAVAILABLE_TEXT = "⚠️ База даних тимчасово недоступна. Спробуйте, будь ласка, за хвилину."
+
+
+async def database_unavailable(event: ErrorEvent):
+    """Ответ пользователю, если обновление не обработано из-за недоступной БД."""
+    update = event.update
+    logging.warning("БД недоступна, обновление %s не обработано: %s", update.update_id, event.exception)
+    if update.callback_query is not None:
+        await update.callback_query.answer(DATABASE_UNAVAILABLE_TEXT, show_alert=True)
+    elif update.message is not None:
+        await update.message.answer(DATABASE_UNAVAILABLE_TEXT)
+
 
 def register_all_routers(dp: Dispatcher):
     """Функция для регистрации всех роутеров в Диспетчере."""
     
     # Регистрация модулей. Порядок важен (auth должна быть первой)
-    dp.include_router(auth.router)
-    dp.include_router(receipt.router)
-    
-    # TODO: Раскомментировать по мере создания модулей
-    # dp.include_router(order.router)
-    # dp.include_router(admin.router)
-    # dp.include_router(finance.router)
+    routers = [auth.router, receipt.router, finance.router, order.router, admin.router, stock.router]
+
+    # Замер времени хэндлеров (снаружи, чтобы учитывать и определение роли);
+    # роль пользователя определяется один раз на обновление и передаётся в хэндлеры
+    metrics_middleware = MetricsMiddleware()
+    auth_middleware = AuthMiddleware()
+    for router in routers:
+        for observer in (router.message, router.callback_query):
+            observer.middleware(metrics_middleware)
+            observer.middleware(auth_middleware)
+        dp.include_router(router)
+
+    # Недоступная БД (breaker.DatabaseUnavailable) — короткий ответ вместо ожидания и общей ошибки
+    dp.errors.register(database_unavailable, ExceptionTypeFilter(DatabaseUnavailable))
     
     logging.info("All handlers successfully registered.")
\ No newline at end of file
@@ -0,0 +1,219 @@
+import logging
+import os
+
+from aiogram import Router, types, F
+from aiogram.fsm.context import FSMContext
+
+import reports
+from analytics import NUMPY_AVAILABLE, CatalogAnalytics  # Аналітика складу (потрібен numpy)
+from catalog import CatalogCache  # Назви постачальників і товарів
+from database import AsyncDatabase  # Для анотації типів
+from .finance import AGING_LABELS
+from .order import item_title
+
+router = Router()
+
+# Callback-дані звітів
+REPORT_CALLBACK_PREFIX = "report:"
+EXPORT_CALLBACK_PREFIX = "report_export:"
+MENU_CALLBACK = "report_menu"
+
+# Скільки рядків зведення показувати в чаті (повний звіт — у файлі)
+SUMMARY_ROWS = 15
+
+# ----------------------------------------------------------------------
+# КЛАВІАТУРИ ТА ТЕКСТИ
+# ----------------------------------------------------------------------
+
+def reports_keyboard():
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="📦 Вартість складу", callback_data=f"{REPORT_CALLBACK_PREFIX}stock")],
+    ] + [
+        [types.InlineKeyboardButton(text=f"📥 Приходи: {title}", callback_data=f"{REPORT_CALLBACK_PREFIX}receipts:{period}")]
+        for period, title in reports.PERIODS.items()
+    ] + [
+        [types.InlineKeyboardButton(text="⏳ Давність боргу", callback_data=f"{REPORT_CALLBACK_PREFIX}aging")],
+    ] + [
+        [types.InlineKeyboardButton(text=f"🗓 Залишки на початок: {title}", callback_data=f"{REPORT_CALLBACK_PREFIX}stock_at:{period}")]
+        for period, title in reports.PERIODS.items()
+    ] + ([
+        [types.InlineKeyboardButton(text="📈 Аналітика складу", callback_data=f"{REPORT_CALLBACK_PREFIX}analytics")],
+    ] if NUMPY_AVAILABLE else []))
+
+
+def export_keyboard(report, period=None):
+    """Кнопки вивантаження звіту (XLSX — лише якщо встановлено openpyxl)."""
+    suffix = f":{period}" if period else ""
+    formats = (['csv'] + (['xlsx'] if reports.XLSX_AVAILABLE else [])) if report in reports.EXPORTS else []
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [
+            types.InlineKeyboardButton(text=f"⬇️ {fmt.upper()}", callback_data=f"{EXPORT_CALLBACK_PREFIX}{report}:{fmt}{suffix}")
+            for fmt in formats
+        ],
+        [types.InlineKeyboardButton(text="⬅️ До звітів", callback_data=MENU_CALLBACK)],
+    ])
+
+
+def summary_lines(rows, format_row):
+    lines = [format_row(row) for row in rows[:SUMMARY_ROWS]]
+    if len(rows) > SUMMARY_ROWS:
+        lines.append(f"… та ще {len(rows) - SUMMARY_ROWS} (повністю — у файлі)")
+    return lines
+
+
+def analytics_lines(result, catalog: CatalogCache):
+    """Зведення аналітики складу: підсумки, постачальники за вартістю та найбільші відхилення цін."""
+    difference = result['catalog_value'] - result['value']
+    lines = [
+        "📈 Аналітика складу\n",
+        f"Позицій на складі: {result['in_stock']} з {result['items']}",
+        f"Вартість за середньою ціною: {result['value']:.2f}",
+        f"За цінами каталогу: {result['catalog_value']:.2f} ({difference:+.2f})",
+        f"Відхилення ціни від каталогу: {result['flagged']} поз.",
+    ]
+    if result['suppliers']:
+        lines.append("\nПостачальники:")
+        for supplier_id, in_stock, value, catalog_value, flagged in result['suppliers'][:SUMMARY_ROWS]:
+            name = catalog.supplier_name(supplier_id) or f"#{supplier_id}"
+            lines.append(f"• {name}: {in_stock} поз., {value:.2f}" + (f", відхилень: {flagged}" if flagged else ""))
+        if len(result['suppliers']) > SUMMARY_ROWS:
+            lines.append(f"… та ще {len(result['suppliers']) - SUMMARY_ROWS}")
+    if result['deviations']:
+        lines.append("\nНайбільші відхилення:")
+        for item_id, quantity, average, catalog_price, recent_price, deviation in result['deviations']:
+            item = catalog.item(item_id)
+            recent = f", приходи {recent_price:.2f}" if recent_price is not None else ""
+            lines.append(
+                f"• {item[1] if item else f'#{item_id}'}: {quantity:g} шт., середня {average:.2f}, "
+                f"каталог {catalog_price:.2f}{recent} ({deviation:+.0%})"
+            )
+    return lines
+
+
+def report_params(report, period):
+    if report == 'receipts':
+        date_from, date_to = reports.period_dates(period)
+        return {'date_from': date_from, 'date_to': date_to}
+    return None
+
+# ----------------------------------------------------------------------
+# МЕНЮ ЗВІТІВ
+# ----------------------------------------------------------------------
+
+@router.message(F.text == "📊 Отчеты")
+async def handle_reports_menu(message: types.Message, state: FSMContext, role: str = None):
+    if role != 'админ':
+        await message.reply("У вас немає прав для доступу до цього модуля.")
+        return
+
+    await state.clear()
+    await message.answer("📊 Оберіть звіт:", reply_markup=reports_keyboard())
+
+
+@router.callback_query(F.data == MENU_CALLBACK)
+async def handle_reports_list(callback: types.CallbackQuery, role: str = None):
+    await callback.answer()
+    if role != 'админ':
+        return
+    await callback.message.edit_text("📊 Оберіть звіт:", reply_markup=reports_keyboard())
+
+
+@router.callback_query(F.data.startswith(REPORT_CALLBACK_PREFIX))
+async def handle_report(callback: types.CallbackQuery, db: AsyncDatabase, catalog: CatalogCache,
+                        analytics: CatalogAnalytics = None, role: str = None):
+    await callback.answer()
+    if role != 'админ':
+        return
+
+    report, _, period = callback.data[len(REPORT_CALLBACK_PREFIX):].partition(':')
+    period = period or None
+
+    if report == 'stock':
+        rows = await db.report_stock_value()
+        if rows is not None:
+            total = sum(row[3] or 0 for row in rows)
+            lines = [f"📦 Вартість складу: {total:.2f}\n"]
+            lines += summary_lines(rows, lambda row: f"• {row[0]}: {row[1]} поз., {row[3] or 0:.2f}")
+    elif report == 'receipts':
+        params = report_params(report, period)
+        rows = await db.report_receipts(params['date_from'], params['date_to'])
+        if rows is not None:
+            total = sum(row[3] for row in rows)
+            lines = [f"📥 Приходи за {reports.PERIODS[period]} "
+                     f"({params['date_from']:%d.%m.%Y} – {params['date_to']:%d.%m.%Y}): {total:.2f}\n"]
+            lines += summary_lines(rows, lambda row: f"• {row[0]}: {row[1]} рядк., {row[3]:.2f}")
+    elif report == 'aging':
+        rows = await db.report_debt_aging()
+        if rows is not None:
+            total = sum(row[1] for row in rows)
+            lines = [f"⏳ Давність боргу, всього: {total:.2f}\n"]
+            lines += summary_lines(rows, lambda row: f"• {row[0]}: {row[1]:.2f} (" + ", ".join(
+                f"{label}: {amount:.2f}" for label, amount in zip(AGING_LABELS, row[2:]) if amount
+            ) + ")")
+    elif report == 'stock_at':
+        # Залишки з журналу руху складу на початок періоду (найближчий знімок і рух після нього)
+        moment, _ = reports.period_dates(period)
+        rows = await db.stock_as_of(moment)
+        if rows is not None:
+            rows.sort(key=lambda row: row[2], reverse=True)
+            total = sum(row[2] for row in rows)
+            lines = [f"🗓 Залишки на {moment:%d.%m.%Y}: {len(rows)} поз., {total:.2f}\n"]
+            lines += [f"• {item_title(catalog, item_id)}: {quantity:g} шт., {value:.2f}"
+                      for item_id, quantity, value in rows[:SUMMARY_ROWS]]
+            if len(rows) > SUMMARY_ROWS:
+                lines.append(f"… та ще {len(rows) - SUMMARY_ROWS}")
+    elif report == 'analytics' and analytics is not None:
+        try:
+            result = await analytics.summary()
+        except Exception as e:
+            logging.error("Помилка розрахунку аналітики складу: %s", e)
+            result = None
+        rows = None if result is None else result['suppliers']
+        if result is not None:
+            lines = analytics_lines(result, catalog)
+    else:
+        return
+
+    if rows is None:
+        await callback.message.answer("Помилка читання звіту з БД. Спробуйте пізніше.")
+        return
+    if not rows:
+        lines.append("Даних немає.")
+
+    # Без Markdown: назви постачальників можуть містити символи розмітки
+    await callback.message.edit_text("\n".join(lines), reply_markup=export_keyboard(report, period))
+
+# ----------------------------------------------------------------------
+# ВИВАНТАЖЕННЯ У ФАЙЛ
+# ----------------------------------------------------------------------
+
+@router.callback_query(F.data.startswith(EXPORT_CALLBACK_PREFIX))
+async def handle_report_export(callback: types.CallbackQuery, db: AsyncDatabase, role: str = None):
+    if role != 'админ':
+        await callback.answer()
+        return
+
+    report, fmt, *rest = callback.data[len(EXPORT_CALLBACK_PREFIX):].split(':')
+    period = rest[0] if rest else None
+    if report not in reports.EXPORTS or fmt not in ('csv', 'xlsx'):
+        await callback.answer()
+        return
+    await callback.answer("Формую файл…")
+
+    try:
+        path = await db.export_report(report, report_params(report, period), fmt)
+    except Exception as e:
+        logging.error("Помилка вивантаження звіту %s (%s): %s", report, fmt, e)
+        await callback.message.answer("Не вдалося сформувати файл звіту. Спробуйте пізніше.")
+        return
+
+    title = reports.EXPORTS[report][0]
+    if period:
+        title = f"{title} ({reports.PERIODS[period]})"
+    try:
+        await callback.message.answer_document(
+            types.FSInputFile(path, filename=f"{reports.EXPORTS[report][0]}.{fmt}"),
+            caption=title
+        )
+    finally:
+        os.remove(path)
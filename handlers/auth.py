@@ -2,7 +2,6 @@ import logging
 from aiogram import Router, types, F
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
-from database import Database # Пока импортируем явно, потом будем брать из dp
 
 # Инициализация роутера для этого модуля
 router = Router()
@@ -26,6 +25,10 @@ def get_main_menu(role):
         buttons = [
             [types.KeyboardButton(text="📦 Приемка Товара"), types.KeyboardButton(text="🛠️ Корректировки Остатков")]
         ]
+    elif role == 'менеджер':
+        buttons = [
+            [types.KeyboardButton(text="🛒 Новый Заказ")]
+        ]
     
     menu = types.ReplyKeyboardMarkup(
         keyboard=buttons,
@@ -37,24 +40,14 @@ def get_main_menu(role):
 # --- Обработчики ---
 
 @router.message(CommandStart())
-async def send_welcome(message: types.Message, state: FSMContext, db: Database = None):
+async def send_welcome(message: types.Message, state: FSMContext, role: str = None, user_name: str = None):
     """Обработчик команды /start и авторизация."""
     
     # Очищаем все текущие состояния FSM при старте
     await state.clear()
     
-    # Получаем объект БД из контекста Dispatcher
-    if db is None:
-        db = message.bot.get('db') 
-        if not db:
-             # Это на случай, если db не передана через dp
-             from database import Database
-             db = Database()
-             
-    telegram_id = message.from_user.id
-    
-    # 1. Проверка роли пользователя в БД
-    role, name = db.get_user_role(telegram_id)
+    # 1. Роль пользователя уже определена AuthMiddleware
+    name = user_name
     
     if role:
         # Пользователь авторизован
@@ -70,13 +63,8 @@ async def send_welcome(message: types.Message, state: FSMContext, db: Database =
 
 
 @router.message(F.text == "Назад в меню" or F.text == "Отмена")
-async def handle_cancel(message: types.Message, state: FSMContext, db: Database = None):
+async def handle_cancel(message: types.Message, state: FSMContext, role: str = None):
     """Обработчик для отмены любого текущего процесса."""
     await state.clear()
     
-    if db is None:
-        db = message.bot.get('db')
-    
-    role, _ = db.get_user_role(message.from_user.id)
-    
     await message.reply("Действие отменено.", reply_markup=get_main_menu(role))
\ No newline at end of file
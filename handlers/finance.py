@@ -0,0 +1,187 @@
+import logging
+from decimal import Decimal, InvalidOperation
+
+from aiogram import Router, types, F
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+from catalog import CatalogCache  # Назви постачальників
+from database import AsyncDatabase  # Для анотації типів
+from statements import AGING_BUCKETS
+from .auth import get_main_menu  # Для повернення в головне меню
+
+router = Router()
+
+# Callback-дані розрахунків
+SUPPLIER_CALLBACK_PREFIX = "finance_supplier:"
+PAY_CALLBACK_PREFIX = "finance_pay:"
+LIST_CALLBACK = "finance_list"
+
+CANCEL_PAYMENT_TEXT = "❌ Скасувати Оплату"
+
+# Підписи кошиків давності боргу (див. Database.supplier_aging)
+AGING_LABELS = (
+    f"до {AGING_BUCKETS[0]} дн.",
+    f"{AGING_BUCKETS[0] + 1}–{AGING_BUCKETS[1]} дн.",
+    f"{AGING_BUCKETS[1] + 1}–{AGING_BUCKETS[2]} дн.",
+    f"понад {AGING_BUCKETS[2]} дн.",
+)
+
+# ----------------------------------------------------------------------
+# FSM СТАНИ
+# ----------------------------------------------------------------------
+
+class FinanceStates(StatesGroup):
+    waiting_for_payment_amount = State()
+
+# ----------------------------------------------------------------------
+# КЛАВІАТУРИ ТА ТЕКСТИ
+# ----------------------------------------------------------------------
+
+def balances_keyboard(balances):
+    """Інлайн-клавіатура постачальників із боргом (по одному в рядку)."""
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=f"{name}: {balance:.2f}", callback_data=f"{SUPPLIER_CALLBACK_PREFIX}{supplier_id}")]
+        for supplier_id, name, balance in balances
+    ])
+
+
+def supplier_keyboard(supplier_id):
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="💸 Внести оплату", callback_data=f"{PAY_CALLBACK_PREFIX}{supplier_id}")],
+        [types.InlineKeyboardButton(text="⬅️ До списку", callback_data=LIST_CALLBACK)],
+    ])
+
+
+def balances_text(balances):
+    total = sum(balance for _, _, balance in balances)
+    lines = [f"💰 **Розрахунки з постачальниками**\nЗагальний борг: **{total:.2f}**\n"]
+    lines += [f"• {name}: {balance:.2f}" for _, name, balance in balances]
+    return "\n".join(lines)
+
+
+def parse_amount(text):
+    """Сума оплати з тексту ('1 250,50' -> Decimal('1250.50')) або None."""
+    try:
+        amount = Decimal(text.replace(' ', '').replace(',', '.')).quantize(Decimal('0.01'))
+    except (InvalidOperation, AttributeError):
+        return None
+    return amount if amount.is_finite() and amount > 0 else None
+
+# ----------------------------------------------------------------------
+# ПЕРЕГЛЯД БАЛАНСІВ
+# ----------------------------------------------------------------------
+
+async def show_balances(message: types.Message, db: AsyncDatabase, edit=False):
+    balances = await db.supplier_balances()
+
+    if balances is None:
+        await message.answer("Помилка читання розрахунків з БД. Спробуйте пізніше.")
+        return
+    if not balances:
+        text, markup = "Заборгованості перед постачальниками немає.", None
+    else:
+        text, markup = balances_text(balances), balances_keyboard(balances)
+
+    if edit:
+        await message.edit_text(text, reply_markup=markup, parse_mode="Markdown")
+    else:
+        await message.answer(text, reply_markup=markup, parse_mode="Markdown")
+
+
+@router.message(F.text == "💰 Расчеты")
+async def handle_finance_menu(message: types.Message, state: FSMContext, db: AsyncDatabase, role: str = None):
+    if role != 'админ':
+        await message.reply("У вас немає прав для доступу до цього модуля.")
+        return
+
+    await state.clear()
+    await show_balances(message, db)
+
+
+@router.callback_query(F.data == LIST_CALLBACK)
+async def handle_balances_list(callback: types.CallbackQuery, db: AsyncDatabase, role: str = None):
+    await callback.answer()
+    if role != 'админ':
+        return
+    await show_balances(callback.message, db, edit=True)
+
+
+@router.callback_query(F.data.startswith(SUPPLIER_CALLBACK_PREFIX))
+async def handle_supplier_balance(callback: types.CallbackQuery, db: AsyncDatabase, catalog: CatalogCache, role: str = None):
+    await callback.answer()
+    if role != 'админ':
+        return
+
+    supplier_id = int(callback.data[len(SUPPLIER_CALLBACK_PREFIX):])
+    balance = await db.supplier_balance(supplier_id)
+    aging = await db.supplier_aging(supplier_id)
+
+    if balance is None or aging is None:
+        await callback.message.answer("Помилка читання розрахунків з БД. Спробуйте пізніше.")
+        return
+
+    supplier_name = catalog.supplier_name(supplier_id) or f"№{supplier_id}"
+    lines = [f"🏭 **{supplier_name}**", f"Борг: **{balance:.2f}**"]
+    if aging:
+        lines.append("\nЗа давністю:")
+        lines += [f"• {AGING_LABELS[bucket]}: {amount:.2f}" for bucket, amount in aging]
+    elif balance < 0:
+        lines.append("Переплата постачальнику.")
+
+    await callback.message.edit_text("\n".join(lines), reply_markup=supplier_keyboard(supplier_id), parse_mode="Markdown")
+
+# ----------------------------------------------------------------------
+# ОПЛАТА ПОСТАЧАЛЬНИКУ
+# ----------------------------------------------------------------------
+
+@router.callback_query(F.data.startswith(PAY_CALLBACK_PREFIX))
+async def handle_start_payment(callback: types.CallbackQuery, state: FSMContext, catalog: CatalogCache, role: str = None):
+    await callback.answer()
+    if role != 'админ':
+        return
+
+    supplier_id = int(callback.data[len(PAY_CALLBACK_PREFIX):])
+    await state.set_state(FinanceStates.waiting_for_payment_amount)
+    await state.set_data({'payment_supplier_id': supplier_id})
+
+    supplier_name = catalog.supplier_name(supplier_id) or f"№{supplier_id}"
+    await callback.message.answer(
+        f"Введіть суму оплати постачальнику **{supplier_name}**:",
+        reply_markup=types.ReplyKeyboardMarkup(
+            keyboard=[[types.KeyboardButton(text=CANCEL_PAYMENT_TEXT)]],
+            resize_keyboard=True
+        ),
+        parse_mode="Markdown"
+    )
+
+
+@router.message(FinanceStates.waiting_for_payment_amount, F.text == CANCEL_PAYMENT_TEXT)
+async def handle_cancel_payment(message: types.Message, state: FSMContext, role: str = None):
+    await state.clear()
+    await message.reply("Оплату скасовано.", reply_markup=get_main_menu(role))
+
+
+@router.message(FinanceStates.waiting_for_payment_amount)
+async def process_payment_amount(message: types.Message, state: FSMContext, db: AsyncDatabase, role: str = None):
+    amount = parse_amount(message.text)
+    if amount is None:
+        await message.reply("Будь ласка, введіть додатну суму (наприклад, 1250.50).")
+        return
+
+    data = await state.get_data()
+    supplier_id = data['payment_supplier_id']
+
+    result = await db.record_payment(supplier_id, amount, message.from_user.id)
+    if not result:
+        await message.answer("Помилка запису оплати в БД. Оплату не збережено, спробуйте ще раз.")
+        return
+
+    entry_id, balance = result
+    logging.info("Оплата %s постачальнику %s (запис журналу %s)", amount, supplier_id, entry_id)
+    await state.clear()
+    await message.answer(
+        f"✅ Оплату **{amount:.2f}** зараховано. Борг перед постачальником: **{balance:.2f}**.",
+        reply_markup=get_main_menu(role),
+        parse_mode="Markdown"
+    )
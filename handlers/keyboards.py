@@ -0,0 +1,109 @@
+from aiogram import types
+
+from cache import MISSING, TTLCache
+from config import KEYBOARD_CACHE_SIZE, KEYBOARD_PAGE_SIZE
+from idempotency import with_token
+
+# Кнопки, що діють на будь-якому кроці приходу
+FINISH_RECEIPT_TEXT = "✅ Завершити Прихід"
+CANCEL_RECEIPT_TEXT = "❌ Скасувати Прихід"
+
+# Callback-дані інлайн-клавіатури товарів
+ITEM_CALLBACK_PREFIX = "receipt_item:"
+PAGE_CALLBACK_PREFIX = "receipt_items_page:"
+FINISH_CALLBACK = "receipt_finish"
+CANCEL_CALLBACK = "receipt_cancel"
+
+# Готові розмітки (і рядки кнопок) перевикористовуються: ключ включає версію довідника,
+# тож після зміни номенклатури клавіатура будується заново
+_markups = TTLCache(maxsize=KEYBOARD_CACHE_SIZE)
+
+CANCEL_KEYBOARD = types.ReplyKeyboardMarkup(
+    keyboard=[[types.KeyboardButton(text=CANCEL_RECEIPT_TEXT)]],
+    resize_keyboard=True
+)
+
+
+def _memoized(key, build):
+    markup = _markups.get(key)
+    if markup is MISSING:
+        markup = build()
+        _markups.set(key, markup)
+    return markup
+
+
+def _two_columns(buttons):
+    return [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+
+def receipt_actions_row():
+    """Кнопки завершення/скасування приходу; завершення — з новим токеном ідемпотентності."""
+    return [
+        types.InlineKeyboardButton(text=FINISH_RECEIPT_TEXT, callback_data=with_token(FINISH_CALLBACK)),
+        types.InlineKeyboardButton(text=CANCEL_RECEIPT_TEXT, callback_data=CANCEL_CALLBACK),
+    ]
+
+
+def page_count(total, page_size=KEYBOARD_PAGE_SIZE):
+    return max(1, -(-total // page_size))
+
+
+def supplier_keyboard(catalog, cancel_text=CANCEL_RECEIPT_TEXT):
+    """Reply-клавіатура постачальників (2 колонки) з кнопкою скасування (приходу або замовлення)."""
+
+    def build():
+        rows = _two_columns([types.KeyboardButton(text=name) for _, name in catalog.suppliers()])
+        rows.append([types.KeyboardButton(text=cancel_text)])
+        return types.ReplyKeyboardMarkup(
+            keyboard=rows,
+            resize_keyboard=True,
+            input_field_placeholder="Оберіть постачальника"
+        )
+
+    return _memoized(('suppliers', cancel_text, catalog.suppliers_version), build)
+
+
+def items_keyboard(catalog, supplier_id, page=0):
+    """Інлайн-клавіатура однієї сторінки товарів постачальника.
+
+    Товари (2 колонки), навігація між сторінками та кнопки завершення/скасування.
+    Рядки товарів і навігації для однакових (постачальник, сторінка, версія
+    номенклатури) перевикористовуються; кнопки приходу будуються щоразу.
+    """
+    items = catalog.items(supplier_id)
+    pages = page_count(len(items))
+    page = min(max(page, 0), pages - 1)
+
+    def build():
+        start = page * KEYBOARD_PAGE_SIZE
+        rows = _two_columns([
+            types.InlineKeyboardButton(text=name, callback_data=f"{ITEM_CALLBACK_PREFIX}{item_id}")
+            for item_id, name, _ in items[start:start + KEYBOARD_PAGE_SIZE]
+        ])
+        if pages > 1:
+            nav = []
+            if page > 0:
+                nav.append(types.InlineKeyboardButton(text="◀️", callback_data=f"{PAGE_CALLBACK_PREFIX}{page - 1}"))
+            nav.append(types.InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=f"{PAGE_CALLBACK_PREFIX}{page}"))
+            if page < pages - 1:
+                nav.append(types.InlineKeyboardButton(text="▶️", callback_data=f"{PAGE_CALLBACK_PREFIX}{page + 1}"))
+            rows.append(nav)
+        return rows
+
+    rows = _memoized(('items', supplier_id, page, catalog.supplier_version(supplier_id)), build)
+    return types.InlineKeyboardMarkup(inline_keyboard=rows + [receipt_actions_row()])
+
+
+def search_results_keyboard(items):
+    """Інлайн-клавіатура з результатами пошуку товару (по одному в рядку) та кнопками приходу."""
+    rows = [
+        [types.InlineKeyboardButton(text=name, callback_data=f"{ITEM_CALLBACK_PREFIX}{item_id}")]
+        for item_id, name, _ in items
+    ]
+    rows.append(receipt_actions_row())
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def cache_stats():
+    """Лічильники кешу клавіатур."""
+    return _markups.stats()
@@ -0,0 +1,309 @@
+import logging
+from decimal import Decimal, InvalidOperation
+
+from aiogram import Router, types, F
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+from catalog import CatalogCache  # Довідники постачальників і номенклатури
+from config import SEARCH_RESULTS_LIMIT
+from database import AsyncDatabase  # Для анотації типів
+from idempotency import with_token  # Одноразові токени кнопок, що змінюють дані
+from .auth import get_main_menu  # Для повернення в головне меню
+from .keyboards import supplier_keyboard
+
+router = Router()
+
+# Кнопки меню та замовлення
+NEW_ORDER_TEXT = "🛒 Новый Заказ"
+PENDING_ORDERS_TEXT = "⚠️ Неподтвержденные Заказы"
+CANCEL_ORDER_TEXT = "❌ Скасувати Замовлення"
+
+# Callback-дані замовлень
+ITEM_CALLBACK_PREFIX = "order_item:"
+SUBMIT_CALLBACK = "order_submit"
+CANCEL_CALLBACK = "order_cancel"
+CONFIRM_CALLBACK_PREFIX = "order_confirm:"  # id замовлення або 'all:<найбільший показаний id>'
+RELEASE_CALLBACK_PREFIX = "order_release:"
+
+ORDER_ROLES = ('админ', 'менеджер')
+# Скільки замовлень показувати в списку непідтверджених
+PENDING_LIST_LIMIT = 10
+
+# ----------------------------------------------------------------------
+# FSM СТАНИ
+# ----------------------------------------------------------------------
+
+class OrderStates(StatesGroup):
+    waiting_for_supplier = State()
+    waiting_for_item = State()
+    waiting_for_quantity = State()
+
+# ----------------------------------------------------------------------
+# КЛАВІАТУРИ ТА ТЕКСТИ
+# ----------------------------------------------------------------------
+
+def order_actions_row(has_lines):
+    row = [types.InlineKeyboardButton(text="❌ Скасувати", callback_data=CANCEL_CALLBACK)]
+    if has_lines:
+        row.insert(0, types.InlineKeyboardButton(text="✅ Оформити", callback_data=with_token(SUBMIT_CALLBACK)))
+    return row
+
+
+def found_items_keyboard(items, available, has_lines):
+    """Знайдені товари з доступною кількістю (ATP) та кнопки замовлення."""
+    rows = [
+        [types.InlineKeyboardButton(
+            text=f"{name} — доступно {available.get(item_id, 0):g}",
+            callback_data=f"{ITEM_CALLBACK_PREFIX}{item_id}"
+        )]
+        for item_id, name, _ in items
+    ]
+    rows.append(order_actions_row(has_lines))
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def item_title(catalog, item_id):
+    item = catalog.item(item_id)
+    return item[1] if item else f"#{item_id}"
+
+
+def parse_quantity(text):
+    try:
+        quantity = Decimal((text or '').replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        return None
+    return quantity if quantity.is_finite() and quantity > 0 else None
+
+# ----------------------------------------------------------------------
+# ОФОРМЛЕННЯ ЗАМОВЛЕННЯ (МЕНЕДЖЕР)
+# ----------------------------------------------------------------------
+
+@router.message(F.text == NEW_ORDER_TEXT)
+async def handle_start_order(message: types.Message, state: FSMContext, catalog: CatalogCache, role: str = None):
+    if role not in ORDER_ROLES:
+        await message.reply("У вас немає прав для доступу до цього модуля.")
+        return
+
+    if not catalog.suppliers():
+        await message.reply("В системі немає зареєстрованих постачальників. Операція скасована.")
+        return
+
+    await state.set_data({'order_lines': []})
+    await state.set_state(OrderStates.waiting_for_supplier)
+    await message.reply("Нове замовлення. Оберіть постачальника:", reply_markup=supplier_keyboard(catalog, CANCEL_ORDER_TEXT))
+
+
+@router.message(StateFilter(OrderStates), F.text == CANCEL_ORDER_TEXT)
+async def handle_cancel_order(message: types.Message, state: FSMContext, role: str = None):
+    await state.clear()
+    await message.reply("Замовлення скасовано.", reply_markup=get_main_menu(role))
+
+
+@router.callback_query(F.data == CANCEL_CALLBACK)
+async def handle_cancel_order_callback(callback: types.CallbackQuery, state: FSMContext, role: str = None):
+    await state.clear()
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.message.answer("Замовлення скасовано.", reply_markup=get_main_menu(role))
+
+
+@router.message(OrderStates.waiting_for_supplier)
+async def process_order_supplier(message: types.Message, state: FSMContext, catalog: CatalogCache):
+    supplier_id = catalog.supplier_id(message.text)
+    if supplier_id is None:
+        await message.reply("Будь ласка, оберіть постачальника зі списку кнопок.")
+        return
+
+    await state.update_data(order_supplier_id=supplier_id)
+    await state.set_state(OrderStates.waiting_for_item)
+    await message.reply(
+        f"Постачальник: {message.text}.\nВведіть назву або частину назви товару:",
+        reply_markup=types.ReplyKeyboardMarkup(
+            keyboard=[[types.KeyboardButton(text=CANCEL_ORDER_TEXT)]],
+            resize_keyboard=True
+        )
+    )
+
+
+@router.message(OrderStates.waiting_for_item)
+async def process_order_item(message: types.Message, state: FSMContext, db: AsyncDatabase, catalog: CatalogCache):
+    data = await state.get_data()
+    supplier_id = data['order_supplier_id']
+
+    item = catalog.item_by_name(supplier_id, message.text)
+    found = [item] if item else await catalog.search_items(supplier_id, message.text or '', limit=SEARCH_RESULTS_LIMIT)
+    if not found:
+        await message.reply("Товар не знайдено. Уточніть назву.")
+        return
+
+    # Доступна кількість читається з рядків залишків за ключем, без обходу відкритих замовлень
+    available = await db.available_to_promise([item_id for item_id, _, _ in found])
+    if available is None:
+        await message.answer("Помилка читання залишків з БД. Спробуйте ще раз.")
+        return
+
+    await message.reply(
+        "Оберіть товар:",
+        reply_markup=found_items_keyboard(found, available, bool(data.get('order_lines')))
+    )
+
+
+@router.callback_query(OrderStates.waiting_for_item, F.data.startswith(ITEM_CALLBACK_PREFIX))
+async def handle_order_item_button(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase,
+                                   catalog: CatalogCache):
+    data = await state.get_data()
+    item = catalog.item(int(callback.data[len(ITEM_CALLBACK_PREFIX):]))
+
+    if item is None or item[3] != data['order_supplier_id']:
+        await callback.answer("Товар не знайдено в довіднику. Оберіть інший.", show_alert=True)
+        return
+
+    available = await db.available_to_promise([item[0]])
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await state.update_data(order_item_id=item[0])
+    await state.set_state(OrderStates.waiting_for_quantity)
+    await callback.message.answer(
+        f"Товар: {item[1]}.\nДоступно: {(available or {}).get(item[0], 0):g}. Введіть кількість:"
+    )
+
+
+@router.message(OrderStates.waiting_for_quantity)
+async def process_order_quantity(message: types.Message, state: FSMContext, db: AsyncDatabase, catalog: CatalogCache):
+    quantity = parse_quantity(message.text)
+    if quantity is None:
+        await message.reply("Невірний формат. Введіть кількість числом (наприклад, 10 або 5.5):")
+        return
+
+    data = await state.get_data()
+    item_id = data['order_item_id']
+    lines = data.get('order_lines', [])
+    already = sum(Decimal(str(qty)) for line_item, qty in lines if line_item == item_id)
+
+    # Попередня перевірка; остаточна — при резервуванні під блокуванням рядка
+    available = await db.available_to_promise([item_id])
+    if available is not None and quantity + already > available.get(item_id, 0):
+        await message.reply(f"Доступно лише {available.get(item_id, 0) - already:g}. Введіть меншу кількість:")
+        return
+
+    lines.append([item_id, float(quantity)])
+    await state.update_data(order_lines=lines)
+    await state.set_state(OrderStates.waiting_for_item)
+    await message.answer(
+        f"✅ {item_title(catalog, item_id)} × {quantity:g} додано. Позицій у замовленні: {len(lines)}.\n"
+        "Введіть наступний товар або оформіть замовлення:",
+        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[order_actions_row(True)])
+    )
+
+
+@router.callback_query(F.data == SUBMIT_CALLBACK)
+async def handle_submit_order(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase,
+                              catalog: CatalogCache, role: str = None):
+    data = await state.get_data()
+    lines = data.get('order_lines')
+    if not lines:
+        await callback.answer("Замовлення порожнє.", show_alert=True)
+        return
+
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+
+    result = await db.place_order(callback.from_user.id, lines)
+    if result is None:
+        await callback.message.answer("Помилка запису замовлення в БД. Спробуйте оформити ще раз.",
+                                      reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[order_actions_row(True)]))
+        return
+
+    order_id, shortages = result
+    if shortages:
+        # Поки менеджер збирав замовлення, товар зарезервували інші: прибираємо такі позиції
+        short_ids = {item_id for item_id, _, _ in shortages}
+        lines = [line for line in lines if line[0] not in short_ids]
+        await state.update_data(order_lines=lines)
+        text = "⚠️ Не вистачає товару, позиції прибрано із замовлення:\n" + "\n".join(
+            f"• {item_title(catalog, item_id)}: потрібно {needed:g}, доступно {available:g}"
+            for item_id, needed, available in shortages
+        )
+        await callback.message.answer(
+            text + ("\nОформіть решту або додайте інші товари." if lines else ""),
+            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[order_actions_row(bool(lines))])
+        )
+        return
+
+    logging.info("Замовлення %s: менеджер %s, позицій %s", order_id, callback.from_user.id, len(lines))
+    await state.clear()
+    await callback.message.answer(
+        f"🎉 Замовлення №{order_id} оформлено, товар зарезервовано. Очікує підтвердження.",
+        reply_markup=get_main_menu(role)
+    )
+
+# ----------------------------------------------------------------------
+# НЕПІДТВЕРДЖЕНІ ЗАМОВЛЕННЯ (АДМІН)
+# ----------------------------------------------------------------------
+
+async def pending_orders_view(db: AsyncDatabase, catalog: CatalogCache):
+    """Текст і клавіатура списку непідтверджених замовлень або None при помилці БД."""
+    orders = await db.pending_orders(PENDING_LIST_LIMIT)
+    if orders is None:
+        return None
+    if not orders:
+        return "Непідтверджених замовлень немає.", None
+
+    blocks, rows = [], []
+    for order_id, manager, created, lines in orders:
+        items = ", ".join(f"{item_title(catalog, item_id)} × {quantity:g}" for item_id, quantity in lines or [])
+        blocks.append(f"№{order_id} ({manager}, {created:%d.%m %H:%M}): {items}")
+        rows.append([
+            types.InlineKeyboardButton(text=f"✅ №{order_id}", callback_data=with_token(f"{CONFIRM_CALLBACK_PREFIX}{order_id}")),
+            types.InlineKeyboardButton(text=f"❌ №{order_id}", callback_data=with_token(f"{RELEASE_CALLBACK_PREFIX}{order_id}")),
+        ])
+    # Найбільший показаний id: замовлення, створені після показу списку, пачкою не підтверджуються
+    shown_up_to = max(order[0] for order in orders)
+    rows.append([types.InlineKeyboardButton(
+        text="✅ Підтвердити всі", callback_data=with_token(f"{CONFIRM_CALLBACK_PREFIX}all:{shown_up_to}")
+    )])
+    return "⚠️ Непідтверджені замовлення:\n\n" + "\n".join(blocks), types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@router.message(F.text == PENDING_ORDERS_TEXT)
+async def handle_pending_orders(message: types.Message, db: AsyncDatabase, catalog: CatalogCache, role: str = None):
+    if role != 'админ':
+        await message.reply("У вас немає прав для доступу до цього модуля.")
+        return
+
+    view = await pending_orders_view(db, catalog)
+    if view is None:
+        await message.answer("Помилка читання замовлень з БД. Спробуйте пізніше.")
+        return
+    text, markup = view
+    await message.answer(text, reply_markup=markup)
+
+
+@router.callback_query(F.data.startswith(CONFIRM_CALLBACK_PREFIX) | F.data.startswith(RELEASE_CALLBACK_PREFIX))
+async def handle_close_orders(callback: types.CallbackQuery, db: AsyncDatabase, catalog: CatalogCache, role: str = None):
+    if role != 'админ':
+        await callback.answer("Недостатньо прав.", show_alert=True)
+        return
+
+    confirm = callback.data.startswith(CONFIRM_CALLBACK_PREFIX)
+    target = callback.data.split(':', 1)[1]
+    if target.startswith('all'):
+        # Пачкою — лише замовлення, які адмін бачив у списку (id не більше показаного)
+        shown_up_to = int(target.partition(':')[2] or 0)
+        orders = await db.pending_orders(PENDING_LIST_LIMIT) or []
+        order_ids = [order[0] for order in orders if order[0] <= shown_up_to]
+    else:
+        order_ids = [int(target)]
+
+    closed = await (db.confirm_orders(order_ids) if confirm else db.release_orders(order_ids))
+    if closed is None:
+        await callback.answer("Помилка запису в БД. Спробуйте ще раз.", show_alert=True)
+        return
+    await callback.answer(f"{'Підтверджено' if confirm else 'Скасовано'}: {len(closed)}")
+
+    view = await pending_orders_view(db, catalog)
+    if view is not None:
+        text, markup = view
+        await callback.message.edit_text(text, reply_markup=markup)
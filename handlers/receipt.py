@@ -1,10 +1,30 @@
+import asyncio
 import logging
-from aiogram import Router, types, F
+import os
+import tempfile
+
+from aiogram import Bot, Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import Database  # Для анотації типів
+from breaker import DatabaseUnavailable  # БД недоступна — відповідаємо з клавіатурою для повтору
+from catalog import CatalogCache  # Довідники постачальників і номенклатури
+from config import IMPORT_MAX_ROWS, RECEIPT_DRAFT_MODE, SEARCH_RESULTS_LIMIT
+from database import AsyncDatabase  # Для анотації типів
+from idempotency import with_token  # Одноразові токени кнопок, що змінюють дані
+from importer import SUPPORTED_EXTENSIONS, InvoiceError, parse_invoice  # Імпорт накладних CSV/XLSX
+from search import normalize  # Порівняння назв без урахування регістру та схожих літер
 from .auth import get_main_menu  # Для повернення в головне меню
+from .keyboards import (
+    CANCEL_CALLBACK,
+    CANCEL_KEYBOARD,
+    FINISH_CALLBACK,
+    ITEM_CALLBACK_PREFIX,
+    PAGE_CALLBACK_PREFIX,
+    items_keyboard,
+    search_results_keyboard,
+    supplier_keyboard,
+)
 
 router = Router()
 
@@ -40,169 +60,299 @@ def get_receipt_menu():
 # ----------------------------------------------------------------------
 
 @router.message(F.text == "📦 Склад/Приход" or F.text == "📦 Приемка Товара")
-async def handle_start_receipt(message: types.Message, state: FSMContext, db: Database):
-    telegram_id = message.from_user.id
-    role, _ = db.get_user_role(telegram_id) 
-
+async def handle_start_receipt(message: types.Message, state: FSMContext, catalog: CatalogCache, role: str = None):
     if role not in ['админ', 'завсклада']:
         await message.reply("У вас немає прав для доступу до цього модуля.")
         return
 
-    # 1. Отримання списку постачальників
-    suppliers = db.get_suppliers() 
+    # 1. Отримання списку постачальників (з кешу довідників)
+    suppliers = catalog.suppliers()
 
     if not suppliers:
         await message.reply("В системі немає зареєстрованих постачальників. Операція скасована.")
         await state.clear()
         return
 
-    # 2. Формування клавіатури постачальників
-    supplier_map = {name: id for id, name in suppliers}
-    
-    await state.set_data({'supplier_map': supplier_map})
-
-    buttons = [types.KeyboardButton(text=name) for name in supplier_map.keys()]
-    keyboard_rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
-    keyboard_rows.append([types.KeyboardButton(text="❌ Скасувати Прихід")])
-    
-    menu = types.ReplyKeyboardMarkup(
-        keyboard=keyboard_rows,
-        resize_keyboard=True,
-        input_field_placeholder="Оберіть постачальника"
-    )
+    # 2. Клавіатура постачальників (сам довідник у сесію не копіюємо)
+    await state.set_data({})
+    menu = supplier_keyboard(catalog)
 
     await state.set_state(ReceiptStates.waiting_for_supplier)
     await message.reply("Почнімо приймання товару. Оберіть постачальника:", reply_markup=menu)
 
 
 @router.message(ReceiptStates.waiting_for_supplier)
-async def process_supplier(message: types.Message, state: FSMContext, db: Database):
+async def process_supplier(message: types.Message, state: FSMContext, catalog: CatalogCache, role: str = None):
     supplier_name = message.text
-    data = await state.get_data()
-    supplier_map = data.get('supplier_map')
     
     if supplier_name == "❌ Скасувати Прихід":
         await state.clear()
-        await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(db.get_user_role(message.from_user.id)[0]))
+        await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(role))
         return
 
-    if supplier_name not in supplier_map:
+    supplier_id = catalog.supplier_id(supplier_name)
+
+    if supplier_id is None:
         await message.reply("Будь ласка, оберіть постачальника зі списку кнопок.")
         return
-
-    supplier_id = supplier_map[supplier_name]
     
     # 1. Отримання номенклатури постачальника
-    items = db.get_items_by_supplier(supplier_id)
+    items = catalog.items(supplier_id)
     
     if not items:
         await message.reply(f"У постачальника **{supplier_name}** немає зареєстрованої номенклатури. Оберіть іншого або скасуйте.", parse_mode="Markdown")
         return
 
-    # item_map: {назва: (id, ціна)}
-    item_map = {name: (id, price) for id, name, price in items}
-    
-    # 2. Зберігання даних про постачальника і номенклатуру
+    # 2. Зберігання даних про постачальника (номенклатура лишається в довіднику)
     await state.update_data(
         current_receipt_supplier_id=supplier_id,
         current_receipt_supplier_name=supplier_name,
-        current_items_map=item_map,
         current_receipt_id=None
     )
     
-    # 3. Формування клавіатури товарів (+ завершення/скасування)
-    item_buttons = [types.KeyboardButton(text=name) for name in item_map.keys()]
-    keyboard_rows = [item_buttons[i:i + 2] for i in range(0, len(item_buttons), 2)]
-    keyboard_rows.append([types.KeyboardButton(text="✅ Завершити Прихід"), types.KeyboardButton(text="❌ Скасувати Прихід")])
-    
-    menu = types.ReplyKeyboardMarkup(
-        keyboard=keyboard_rows,
-        resize_keyboard=True,
-        input_field_placeholder=f"Оберіть товар від {supplier_name}"
-    )
-
+    # 3. Сторінка товарів (інлайн, з кнопками завершення/скасування);
+    #    reply-клавіатуру постачальників замінюємо на кнопку скасування
     await state.set_state(ReceiptStates.waiting_for_item_name)
-    await message.reply(f"Ви обрали **{supplier_name}**. Оберіть товар для оприбуткування:", reply_markup=menu, parse_mode="Markdown")
+    await message.reply(f"Ви обрали **{supplier_name}**.", reply_markup=CANCEL_KEYBOARD, parse_mode="Markdown")
+    await message.answer(
+        "Оберіть товар для оприбуткування або надішліть файл накладної (CSV/XLSX):",
+        reply_markup=items_keyboard(catalog, supplier_id)
+    )
 
 # ----------------------------------------------------------------------
 # ПРІОРИТЕТНІ ОБРОБНИКИ ДЛЯ waiting_for_item_name (ЗАВЕРШЕННЯ/СКАСУВАННЯ)
 # ----------------------------------------------------------------------
 
-@router.message(ReceiptStates.waiting_for_item_name, F.text == "✅ Завершити Прихід")
-async def handle_finish_receipt(message: types.Message, state: FSMContext, db: Database):
+async def finish_receipt(message: types.Message, state: FSMContext, db: AsyncDatabase, catalog: CatalogCache,
+                         role: str, user_id: int):
+    """Завершення приходу (спільне для reply- та інлайн-кнопки)."""
     data = await state.get_data()
     receipt_id = data.get('current_receipt_id')
-    
-    role, _ = db.get_user_role(message.from_user.id)
-    
-    await message.reply(
+
+    if RECEIPT_DRAFT_MODE:
+        # Кнопку «Завершити» з інлайн-клавіатури вже прибрано (її токен використано),
+        # тож при відмові надсилаємо клавіатуру з новою кнопкою
+        retry_markup = items_keyboard(catalog, data['current_receipt_supplier_id'], data.get('current_items_page', 0))
+        draft_lines = data.get('draft_lines')
+        if not draft_lines:
+            await message.answer("Чернетка приходу порожня. Додайте хоча б один товар або скасуйте прихід.",
+                                 reply_markup=retry_markup)
+            return
+
+        # Весь документ записується однією транзакцією
+        try:
+            result = await db.commit_receipt_draft(
+                supplier_id=data['current_receipt_supplier_id'],
+                user_id=user_id,
+                lines=draft_lines
+            )
+        except DatabaseUnavailable:
+            result = None
+        if not result:
+            await message.answer("Помилка запису приходу в БД. Чернетку збережено, спробуйте завершити ще раз.",
+                                 reply_markup=retry_markup)
+            return
+        receipt_id, _ = result
+    
+    await message.answer(
         f"🎉 **Прихід №{receipt_id} успішно завершено!**\nДані записані, залишки оновлено.",
         reply_markup=get_main_menu(role),
         parse_mode="Markdown"
     )
     await state.clear() 
 
+@router.message(ReceiptStates.waiting_for_item_name, F.text == "✅ Завершити Прихід")
+async def handle_finish_receipt(message: types.Message, state: FSMContext, db: AsyncDatabase,
+                                catalog: CatalogCache, role: str = None):
+    await finish_receipt(message, state, db, catalog, role, message.from_user.id)
+
+@router.callback_query(ReceiptStates.waiting_for_item_name, F.data == FINISH_CALLBACK)
+async def handle_finish_receipt_callback(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase,
+                                         catalog: CatalogCache, role: str = None):
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await finish_receipt(callback.message, state, db, catalog, role, callback.from_user.id)
+
 @router.message(ReceiptStates.waiting_for_item_name, F.text == "❌ Скасувати Прихід")
-async def handle_cancel_receipt_item_name_state(message: types.Message, state: FSMContext, db: Database):
+async def handle_cancel_receipt_item_name_state(message: types.Message, state: FSMContext, role: str = None):
     await state.clear()
-    await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(db.get_user_role(message.from_user.id)[0]))
+    await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(role))
+
+@router.callback_query(F.data == CANCEL_CALLBACK)
+async def handle_cancel_receipt_callback(callback: types.CallbackQuery, state: FSMContext, role: str = None):
+    await state.clear()
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.message.answer("Приймання товару скасовано.", reply_markup=get_main_menu(role))
 
 # ----------------------------------------------------------------------
 # ОСНОВНИЙ ОБРОБНИК ВИБОРУ ТОВАРУ
 # ----------------------------------------------------------------------
 
-@router.message(ReceiptStates.waiting_for_item_name)
-async def process_item_name(message: types.Message, state: FSMContext, db: Database):
-    item_name = message.text
-    
-    # Пріоритетні кнопки оброблені вище, тут лише перевіряємо, чи це назва товару
-    
-    data = await state.get_data()
-    item_map = data.get('current_items_map')
-
-    if item_name not in item_map:
-        # Повторно надсилаємо клавіатуру, якщо користувач ввів невідомий текст
-        supplier_name = data.get('current_receipt_supplier_name')
-        
-        item_buttons = [types.KeyboardButton(text=name) for name in item_map.keys()]
-        keyboard_rows = [item_buttons[i:i + 2] for i in range(0, len(item_buttons), 2)]
-        keyboard_rows.append([types.KeyboardButton(text="✅ Завершити Прихід"), types.KeyboardButton(text="❌ Скасувати Прихід")])
-        
-        menu = types.ReplyKeyboardMarkup(
-            keyboard=keyboard_rows,
-            resize_keyboard=True,
-            input_field_placeholder=f"Додайте наступний товар від {supplier_name}"
-        )
-        
-        await message.reply("Пожалуйста, выберите товар из предложенных кнопок.", reply_markup=menu)
-        return
-
-    item_id, default_price = item_map[item_name]
+async def select_item(message: types.Message, state: FSMContext, item):
+    """Фіксує обраний товар (id, назва, ціна) і переходить до введення кількості."""
+    item_id, item_name, default_price = item[:3]
     
     # Зберігаємо ID та ім'я товару в контекст
     await state.update_data(
         current_item_id=item_id,
         current_item_name=item_name,
-        current_price=default_price # Може бути використана як підказка при редагуванні
+        current_price=float(default_price) if default_price is not None else None # Може бути використана як підказка при редагуванні
     )
 
     await state.set_state(ReceiptStates.waiting_for_quantity)
     
     # Виводимо клавіатуру скасування
-    menu = types.ReplyKeyboardMarkup(
-        keyboard=[[types.KeyboardButton(text="❌ Скасувати Прихід")]],
-        resize_keyboard=True
+    await message.answer(f"Товар: **{item_name}**.\nВведіть кількість (наприклад, 10.5):",
+                         reply_markup=CANCEL_KEYBOARD,
+                         parse_mode="Markdown")
+
+
+@router.callback_query(ReceiptStates.waiting_for_item_name, F.data.startswith(ITEM_CALLBACK_PREFIX))
+async def handle_item_button(callback: types.CallbackQuery, state: FSMContext, catalog: CatalogCache):
+    data = await state.get_data()
+    item = catalog.item(int(callback.data[len(ITEM_CALLBACK_PREFIX):]))
+
+    if item is None or item[3] != data['current_receipt_supplier_id']:
+        await callback.answer("Товар не знайдено в довіднику. Оберіть інший.", show_alert=True)
+        return
+
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await select_item(callback.message, state, item)
+
+
+@router.callback_query(ReceiptStates.waiting_for_item_name, F.data.startswith(PAGE_CALLBACK_PREFIX))
+async def handle_items_page(callback: types.CallbackQuery, state: FSMContext, catalog: CatalogCache):
+    data = await state.get_data()
+    page = int(callback.data[len(PAGE_CALLBACK_PREFIX):])
+
+    if page != data.get('current_items_page', 0):
+        await state.update_data(current_items_page=page)
+        await callback.message.edit_reply_markup(
+            reply_markup=items_keyboard(catalog, data['current_receipt_supplier_id'], page)
+        )
+    await callback.answer()
+
+
+# ----------------------------------------------------------------------
+# ІМПОРТ НАКЛАДНОЇ З ФАЙЛУ
+# ----------------------------------------------------------------------
+
+# Скільки відхилених рядків показувати у звіті
+REJECTED_REPORT_LIMIT = 20
+
+@router.message(ReceiptStates.waiting_for_item_name, F.document)
+async def handle_invoice_file(message: types.Message, state: FSMContext, bot: Bot, db: AsyncDatabase,
+                              catalog: CatalogCache, role: str = None):
+    data = await state.get_data()
+    supplier_id = data['current_receipt_supplier_id']
+    file_name = message.document.file_name or ''
+
+    if data.get('current_receipt_id') or data.get('draft_lines'):
+        await message.reply("Спершу завершіть або скасуйте поточний прихід, потім надішліть накладну.")
+        return
+    if not file_name.lower().endswith(SUPPORTED_EXTENSIONS):
+        await message.reply("Підтримуються лише файли накладних CSV та XLSX.")
+        return
+
+    await message.reply("⏳ Обробляю накладну...")
+
+    # Файл зберігається на диск і читається потоково, а не цілком у пам'ять
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file_name)[1])
+    os.close(fd)
+    try:
+        await bot.download(message.document, destination=path)
+        result = await asyncio.to_thread(parse_invoice, path, file_name, catalog.items(supplier_id), IMPORT_MAX_ROWS)
+    except InvoiceError as e:
+        await message.answer(f"Не вдалося прочитати накладну: {e}")
+        return
+    except Exception:
+        # Збій завантаження або непередбачений формат — відповідь усе одно потрібна
+        logging.exception("Помилка обробки накладної %s", file_name)
+        await message.answer("Не вдалося обробити накладну. Перевірте файл і надішліть його ще раз.")
+        return
+    finally:
+        os.remove(path)
+
+    rejected_text = ""
+    if result.rejected:
+        rejected_text = f"\n\n⚠️ Відхилено рядків: {len(result.rejected)}\n" + "\n".join(
+            f"• рядок {row_number}: {reason}" for row_number, reason in result.rejected[:REJECTED_REPORT_LIMIT]
+        )
+        if len(result.rejected) > REJECTED_REPORT_LIMIT:
+            rejected_text += f"\n… та ще {len(result.rejected) - REJECTED_REPORT_LIMIT}"
+
+    if not result.lines:
+        await message.answer("У накладній немає жодного придатного рядка. Прихід не створено." + rejected_text)
+        return
+
+    # Усі рядки, залишки та борг записуються однією транзакцією (рядки — через COPY)
+    try:
+        saved = await db.commit_receipt_draft(
+            supplier_id=supplier_id,
+            user_id=message.from_user.id,
+            lines=result.lines,
+            name='import_receipt'
+        )
+    except DatabaseUnavailable:
+        await message.answer("⚠️ База даних тимчасово недоступна, накладну не збережено. "
+                             "Надішліть файл ще раз, коли база відновиться.")
+        return
+    if not saved:
+        await message.answer("Помилка запису приходу в БД. Накладну не збережено, спробуйте ще раз.")
+        return
+
+    receipt_id, receipt_total = saved
+    logging.info("Імпорт накладної %s: прихід %s, рядків %s, відхилено %s",
+                 file_name, receipt_id, len(result.lines), len(result.rejected))
+    await state.clear()
+    # Без Markdown: у назвах відхилених товарів можуть бути службові символи
+    await message.answer(
+        f"🎉 Прихід №{receipt_id} створено з накладної.\n"
+        f"Прийнято рядків: {len(result.lines)} на суму {receipt_total}." + rejected_text,
+        reply_markup=get_main_menu(role)
     )
-    await message.reply(f"Товар: **{item_name}**.\nВведіть кількість (наприклад, 10.5):",
-                        reply_markup=menu,
-                        parse_mode="Markdown")
+
+
+@router.message(ReceiptStates.waiting_for_item_name)
+async def process_item_name(message: types.Message, state: FSMContext, catalog: CatalogCache):
+    # Фото, стікер чи голосове — без тексту: відповідаємо як на ненайдений товар
+    item_name = message.text or ''
+    
+    # Пріоритетні кнопки оброблені вище, тут лише перевіряємо, чи це назва товару
+    
+    data = await state.get_data()
+    supplier_id = data['current_receipt_supplier_id']
+    item = catalog.item_by_name(supplier_id, item_name)
+
+    if item is None:
+        # Введено частину назви — пропонуємо найкращі збіги
+        found = await catalog.search_items(supplier_id, item_name, limit=SEARCH_RESULTS_LIMIT)
+        # Одразу обираємо лише єдиний товар, назва якого починається з введеного тексту;
+        # збіг за частиною слова чи з опечаткою — тільки кнопкою, щоб не записати інший товар
+        if len(found) == 1 and normalize(found[0][1]).startswith(normalize(item_name)):
+            await select_item(message, state, found[0])
+            return
+        if found:
+            await message.reply("Знайдені товари — оберіть потрібний:", reply_markup=search_results_keyboard(found))
+            return
+
+        # Нічого не знайдено — повторно надсилаємо сторінку товарів
+        await message.reply(
+            "Товар не знайдено. Уточніть назву або оберіть товар із запропонованих кнопок.",
+            reply_markup=items_keyboard(catalog, supplier_id, data.get('current_items_page', 0))
+        )
+        return
+
+    await select_item(message, state, item)
 
 # ----------------------------------------------------------------------
 # ОБРОБНИКИ КІЛЬКОСТІ ТА ЦІНИ
 # ----------------------------------------------------------------------
 
 @router.message(ReceiptStates.waiting_for_quantity)
-async def process_quantity(message: types.Message, state: FSMContext, db: Database):
+async def process_quantity(message: types.Message, state: FSMContext, db: AsyncDatabase, role: str = None):
     try:
         quantity = float(message.text.replace(',', '.'))
         if quantity <= 0:
@@ -213,7 +363,7 @@ async def process_quantity(message: types.Message, state: FSMContext, db: Databa
 
     if message.text == "❌ Скасувати Прихід":
         await state.clear()
-        await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(db.get_user_role(message.from_user.id)[0]))
+        await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(role))
         return
 
     await state.update_data(current_quantity=quantity)
@@ -235,7 +385,7 @@ async def process_quantity(message: types.Message, state: FSMContext, db: Databa
 
 
 @router.message(ReceiptStates.waiting_for_price)
-async def process_price_and_save_line(message: types.Message, state: FSMContext, db: Database):
+async def process_price_and_save_line(message: types.Message, state: FSMContext, db: AsyncDatabase, role: str = None):
     try:
         price = float(message.text.replace(',', '.'))
         if price <= 0:
@@ -246,7 +396,7 @@ async def process_price_and_save_line(message: types.Message, state: FSMContext,
 
     if message.text == "❌ Скасувати Прихід":
         await state.clear()
-        await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(db.get_user_role(message.from_user.id)[0]))
+        await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(role))
         return
 
     await state.update_data(current_price=price)
@@ -258,7 +408,7 @@ async def process_price_and_save_line(message: types.Message, state: FSMContext,
     total_amount = round(quantity * price, 2)
     
     keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="✅ Зберегти та додати", callback_data="receipt_save_line")],
+        [types.InlineKeyboardButton(text="✅ Зберегти та додати", callback_data=with_token("receipt_save_line"))],
         [types.InlineKeyboardButton(text="✏️ Змінити кількість", callback_data="receipt_edit_quantity")],
         [types.InlineKeyboardButton(text="✏️ Змінити ціну", callback_data="receipt_edit_price")]
     ])
@@ -297,13 +447,9 @@ async def handle_edit_quantity(callback: types.CallbackQuery, state: FSMContext)
     )
     
     # 2. Надсилаємо нове повідомлення з Reply-клавіатурою
-    menu = types.ReplyKeyboardMarkup(
-        keyboard=[[types.KeyboardButton(text="❌ Скасувати Прихід")]],
-        resize_keyboard=True
-    )
     await callback.message.answer(
         "**Введіть нове значення кількості** (наприклад, 10.5):",
-        reply_markup=menu,
+        reply_markup=CANCEL_KEYBOARD,
         parse_mode="Markdown"
     )
     await callback.answer("Ви перейшли до редагування кількості.")
@@ -321,13 +467,9 @@ async def handle_edit_price(callback: types.CallbackQuery, state: FSMContext):
     )
 
     # 2. Надсилаємо нове повідомлення з Reply-клавіатурою
-    menu = types.ReplyKeyboardMarkup(
-        keyboard=[[types.KeyboardButton(text="❌ Скасувати Прихід")]],
-        resize_keyboard=True
-    )
     await callback.message.answer(
         "**Введіть нове значення ціни** за одиницю (наприклад, 50.00):",
-        reply_markup=menu,
+        reply_markup=CANCEL_KEYBOARD,
         parse_mode="Markdown"
     )
     await callback.answer("Ви перейшли до редагування ціни.")
@@ -335,7 +477,7 @@ async def handle_edit_price(callback: types.CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "receipt_save_line", ReceiptStates.waiting_for_price)
-async def handle_save_line(callback: types.CallbackQuery, state: FSMContext, db: Database):
+async def handle_save_line(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase, catalog: CatalogCache):
     
     # ----------------------------------------------------
     # 1. ЗАХИСТ ВІД ПОДВІЙНОГО НАТИСКАННЯ ТА ВИДАЛЕННЯ КНОПКИ
@@ -362,69 +504,62 @@ async def handle_save_line(callback: types.CallbackQuery, state: FSMContext, db:
     
     receipt_id = data.get('current_receipt_id')
     
-    # ----------------------------------------------------
-    # 2. СТВОРЕННЯ ЗАГОЛОВКА ТА ОБЛІК ЗАБОРГОВАНОСТІ
-    # ----------------------------------------------------
-    if not receipt_id:
-        supplier_id = data['current_receipt_supplier_id']
-        
-        # Створення документа приходу (повертає ID або None)
-        receipt_id = db.create_new_receipt(
-            supplier_id=supplier_id,
-            user_id=callback.from_user.id
+    if RECEIPT_DRAFT_MODE:
+        # ----------------------------------------------------
+        # 2. РЕЖИМ ЧЕРНЕТКИ: РЯДОК ЛИШЕ ДОДАЄТЬСЯ У FSM
+        # ----------------------------------------------------
+        # Компактний запис [id, кількість, ціна]; у БД усе потрапить при завершенні приходу
+        draft_lines = data.get('draft_lines', [])
+        draft_lines.append([item_id, quantity, price])
+        await state.update_data(draft_lines=draft_lines)
+
+        status_text = (
+            f"✅ Товар **{item_name}** додано до чернетки приходу (рядків: {len(draft_lines)}). (Сума: **{line_total}**)\n"
+        )
+    else:
+        # ----------------------------------------------------
+        # 2. ЗАПИС РЯДКА ОДНІЄЮ ТРАНЗАКЦІЄЮ
+        # ----------------------------------------------------
+        # Заголовок приходу (для першого рядка), рядок, залишки та борг
+        # записуються разом: або все, або нічого
+        result = await db.save_receipt_line(
+            receipt_id=receipt_id,
+            supplier_id=data['current_receipt_supplier_id'],
+            user_id=callback.from_user.id,
+            item_id=item_id,
+            quantity=quantity,
+            price=price
         )
-        
-        if not receipt_id:
-             await callback.message.answer("Помилка при створенні документа приходу. Операція скасована.")
-             await state.clear()
-             return
-             
-        # РЕЄСТРАЦІЯ ПОЧАТКОВОГО БОРГУ: статус 'не оплачено' (вирішення CHECK constraint)
-        db.register_initial_debt(receipt_id) 
-        
-        await state.update_data(current_receipt_id=receipt_id)
 
-    # 3. Додаємо рядок приходу та оновлюємо залишки
-    db.add_receipt_line(
-        receipt_id=receipt_id,
-        item_id=item_id,
-        quantity=quantity,
-        price=price
-    )
-    db.update_inventory(
-        item_id=item_id,
-        quantity=quantity,
-        price=price
-    )
+        if not result:
+            await callback.message.answer(
+                "Помилка запису рядка в БД. Рядок не збережено, оберіть товар ще раз.",
+                reply_markup=items_keyboard(catalog, data['current_receipt_supplier_id'], data.get('current_items_page', 0))
+            )
+            await state.set_state(ReceiptStates.waiting_for_item_name)
+            return
 
-    # 4. ОНОВЛЕННЯ СУМИ БОРГУ НА СУМУ НОВОГО РЯДКА
-    db.update_debt_amount(receipt_id, line_total)
+        receipt_id, stock_quantity, supplier_debt = result
+        await state.update_data(current_receipt_id=receipt_id)
+
+        status_text = (
+            f"✅ Товар **{item_name}** додано до приходу №{receipt_id}. Облік оновлено. (Сума: **{line_total}**)\n"
+            f"Залишок на складі: {stock_quantity}. Борг перед постачальником: {supplier_debt}.\n"
+        )
     
     # ----------------------------------------------------
-    # 5. ПЕРЕХІД ДО ДОДАВАННЯ НАСТУПНОГО ТОВАРУ
+    # 3. ПЕРЕХІД ДО ДОДАВАННЯ НАСТУПНОГО ТОВАРУ
     # ----------------------------------------------------
     supplier_name = data.get('current_receipt_supplier_name')
-    item_map = data['current_items_map']
-
-    # Формування клавіатури товарів + кнопки завершення/скасування
-    item_buttons = [types.KeyboardButton(text=name) for name in item_map.keys()]
-    keyboard_rows = [item_buttons[i:i + 2] for i in range(0, len(item_buttons), 2)]
-    keyboard_rows.append([types.KeyboardButton(text="✅ Завершити Прихід"), types.KeyboardButton(text="❌ Скасувати Прихід")])
-    
-    menu_for_next_item = types.ReplyKeyboardMarkup(
-        keyboard=keyboard_rows,
-        resize_keyboard=True,
-        input_field_placeholder=f"Додайте наступний товар від {supplier_name}"
-    )
 
     # Встановлення FSM-стану для очікування наступного товару
     await state.set_state(ReceiptStates.waiting_for_item_name) 
     
-    # Надсилаємо НОВЕ повідомлення з Reply-клавіатурою (з товарами)
+    # Надсилаємо НОВЕ повідомлення зі сторінкою товарів (готова клавіатура з кешу)
     await callback.message.answer(
-        f"✅ Товар **{item_name}** додано до приходу №{receipt_id}. Облік оновлено. (Сума: **{line_total}**)\n"
+        status_text +
         f"Продовжуємо. Оберіть наступний товар від **{supplier_name}**:", 
-        reply_markup=menu_for_next_item, 
+        reply_markup=items_keyboard(catalog, data['current_receipt_supplier_id'], data.get('current_items_page', 0)),
         parse_mode="Markdown"
     )
 
@@ -433,6 +568,6 @@ async def handle_save_line(callback: types.CallbackQuery, state: FSMContext, db:
 # ----------------------------------------------------------------------
 
 @router.message(F.text == "❌ Скасувати Прихід")
-async def handle_cancel_anywhere(message: types.Message, state: FSMContext, db: Database):
+async def handle_cancel_anywhere(message: types.Message, state: FSMContext, role: str = None):
     await state.clear()
-    await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(db.get_user_role(message.from_user.id)[0]))
\ No newline at end of file
+    await message.reply("Приймання товару скасовано.", reply_markup=get_main_menu(role))
\ No newline at end of file
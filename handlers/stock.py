@@ -0,0 +1,162 @@
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from aiogram import Router, types, F
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+from catalog import CatalogCache  # Довідники постачальників і номенклатури
+from config import SEARCH_RESULTS_LIMIT
+from database import AsyncDatabase  # Для анотації типів
+from .auth import get_main_menu  # Для повернення в головне меню
+from .keyboards import supplier_keyboard
+
+router = Router()
+
+# Кнопки меню (адміна та завскладу) і скасування корекції
+ADJUSTMENT_MENU_TEXTS = {"🛠️ Корректировки", "🛠️ Корректировки Остатков"}
+CANCEL_ADJUSTMENT_TEXT = "❌ Скасувати Корекцію"
+
+# Callback-дані вибору товару
+ITEM_CALLBACK_PREFIX = "adjust_item:"
+
+ADJUSTMENT_ROLES = ('админ', 'завсклада')
+
+CANCEL_KEYBOARD = types.ReplyKeyboardMarkup(
+    keyboard=[[types.KeyboardButton(text=CANCEL_ADJUSTMENT_TEXT)]],
+    resize_keyboard=True
+)
+
+# ----------------------------------------------------------------------
+# FSM СТАНИ
+# ----------------------------------------------------------------------
+
+class AdjustmentStates(StatesGroup):
+    waiting_for_supplier = State()
+    waiting_for_item = State()
+    waiting_for_quantity = State()
+
+# ----------------------------------------------------------------------
+# КЛАВІАТУРИ ТА ТЕКСТИ
+# ----------------------------------------------------------------------
+
+def found_items_keyboard(items):
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=name, callback_data=f"{ITEM_CALLBACK_PREFIX}{item_id}")]
+        for item_id, name, _ in items
+    ])
+
+
+def parse_actual_quantity(text):
+    """Фактична кількість з інвентаризації: нуль допустимий, від'ємна — ні."""
+    try:
+        quantity = Decimal((text or '').replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        return None
+    return quantity if quantity.is_finite() and quantity >= 0 else None
+
+# ----------------------------------------------------------------------
+# КОРЕКЦІЯ ЗАЛИШКІВ (ІНВЕНТАРИЗАЦІЯ)
+# ----------------------------------------------------------------------
+
+@router.message(F.text.in_(ADJUSTMENT_MENU_TEXTS))
+async def handle_start_adjustment(message: types.Message, state: FSMContext, catalog: CatalogCache, role: str = None):
+    if role not in ADJUSTMENT_ROLES:
+        await message.reply("У вас немає прав для доступу до цього модуля.")
+        return
+
+    if not catalog.suppliers():
+        await message.reply("В системі немає зареєстрованих постачальників. Операція скасована.")
+        return
+
+    await state.clear()
+    await state.set_state(AdjustmentStates.waiting_for_supplier)
+    await message.reply(
+        "Корекція залишків. Оберіть постачальника:",
+        reply_markup=supplier_keyboard(catalog, CANCEL_ADJUSTMENT_TEXT)
+    )
+
+
+@router.message(StateFilter(AdjustmentStates), F.text == CANCEL_ADJUSTMENT_TEXT)
+async def handle_cancel_adjustment(message: types.Message, state: FSMContext, role: str = None):
+    await state.clear()
+    await message.reply("Корекцію скасовано.", reply_markup=get_main_menu(role))
+
+
+@router.message(AdjustmentStates.waiting_for_supplier)
+async def process_adjustment_supplier(message: types.Message, state: FSMContext, catalog: CatalogCache):
+    supplier_id = catalog.supplier_id(message.text)
+    if supplier_id is None:
+        await message.reply("Будь ласка, оберіть постачальника зі списку кнопок.")
+        return
+
+    await state.update_data(adjust_supplier_id=supplier_id)
+    await state.set_state(AdjustmentStates.waiting_for_item)
+    await message.reply(
+        f"Постачальник: {message.text}.\nВведіть назву або частину назви товару:",
+        reply_markup=CANCEL_KEYBOARD
+    )
+
+
+@router.message(AdjustmentStates.waiting_for_item)
+async def process_adjustment_item(message: types.Message, state: FSMContext, catalog: CatalogCache):
+    data = await state.get_data()
+    supplier_id = data['adjust_supplier_id']
+
+    item = catalog.item_by_name(supplier_id, message.text)
+    found = [item] if item else await catalog.search_items(supplier_id, message.text or '', limit=SEARCH_RESULTS_LIMIT)
+    if not found:
+        await message.reply("Товар не знайдено. Уточніть назву.")
+        return
+
+    await message.reply("Оберіть товар:", reply_markup=found_items_keyboard(found))
+
+
+@router.callback_query(AdjustmentStates.waiting_for_item, F.data.startswith(ITEM_CALLBACK_PREFIX))
+async def handle_adjustment_item_button(callback: types.CallbackQuery, state: FSMContext, db: AsyncDatabase,
+                                        catalog: CatalogCache):
+    data = await state.get_data()
+    item = catalog.item(int(callback.data[len(ITEM_CALLBACK_PREFIX):]))
+
+    if item is None or item[3] != data['adjust_supplier_id']:
+        await callback.answer("Товар не знайдено в довіднику. Оберіть інший.", show_alert=True)
+        return
+
+    # Обліковий залишок — з журналу руху складу на поточний момент
+    stock = await db.stock_as_of(datetime.now(timezone.utc), [item[0]])
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await state.update_data(adjust_item_id=item[0])
+    await state.set_state(AdjustmentStates.waiting_for_quantity)
+    current = f"{sum(quantity for _, quantity, _ in stock):g}" if stock is not None else "невідомо"
+    await callback.message.answer(
+        f"Товар: {item[1]}.\nЗа обліком: {current}. Введіть фактичну кількість:",
+        reply_markup=CANCEL_KEYBOARD
+    )
+
+
+@router.message(AdjustmentStates.waiting_for_quantity)
+async def process_adjustment_quantity(message: types.Message, state: FSMContext, db: AsyncDatabase,
+                                      catalog: CatalogCache, role: str = None):
+    quantity = parse_actual_quantity(message.text)
+    if quantity is None:
+        await message.reply("Невірний формат. Введіть фактичну кількість числом (наприклад, 0, 10 або 5.5):")
+        return
+
+    data = await state.get_data()
+    item = catalog.item(data['adjust_item_id'])
+    title = item[1] if item else f"#{data['adjust_item_id']}"
+
+    # Залишок встановлюється рівним фактичному, тож повторне введення тієї ж кількості нічого не змінить
+    result = await db.adjust_stock(data['adjust_item_id'], quantity, message.from_user.id,
+                                   comment="Корекція залишку через бот")
+    if result is None:
+        await message.reply("❌ Помилка запису корекції в БД. Введіть кількість ще раз або скасуйте корекцію.")
+        return
+
+    delta, actual = result
+    await state.clear()
+    text = (f"✅ {title}: залишок {actual:g} (зміна {delta:+g})." if delta
+            else f"✅ {title}: залишок {actual:g} збігається з обліком, корекція не потрібна.")
+    await message.answer(text, reply_markup=get_main_menu(role))
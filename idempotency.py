@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import secrets
+
+from cache import MISSING, TTLCache
+
+# Токен дописывается к callback-данным кнопки после разделителя: "receipt_save_line#Ab3_x9Qz"
+TOKEN_SEPARATOR = '#'
+TOKEN_BYTES = 6  # 8 символов base64url
+
+# Ограничение Telegram на callback_data, байт
+CALLBACK_DATA_LIMIT = 64
+
+
+def with_token(data):
+    """Callback-данные кнопки с новым одноразовым токеном.
+
+    Каждая отрисовка кнопки получает свой токен, поэтому повторная доставка
+    того же нажатия и второе нажатие той же кнопки распознаются как повтор.
+    """
+    tokenized = f"{data}{TOKEN_SEPARATOR}{secrets.token_urlsafe(TOKEN_BYTES)}"
+    if len(tokenized.encode('utf-8')) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data с токеном длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    return tokenized
+
+
+def split_token(data):
+    """(данные без токена, токен); токен None, если кнопка без токена."""
+    base, separator, token = data.rpartition(TOKEN_SEPARATOR)
+    if not separator or not token:
+        return data, None
+    return base, token
+
+
+class IdempotencyStore:
+    """Учёт уже обработанных нажатий кнопок с токеном.
+
+    Недавние ключи хранятся в ограниченном LRU-кеше процесса: повтор отсекается
+    без обращения к БД, в том числе пока первое нажатие ещё обрабатывается.
+    Новый ключ дополнительно записывается в КлючиИдемпотентности (уникальный
+    ключ), что ловит повторы после перезапуска и между процессами бота.
+    Ключи старше ttl секунд удаляются фоновой задачей.
+    """
+
+    def __init__(self, db, maxsize=10000, ttl=604800, interval=3600):
+        self.db = db
+        self.ttl = ttl
+        self.interval = interval
+        self._recent = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._task = None
+        self.duplicates = 0
+
+    async def claim(self, key):
+        """True — нажатие первое и его нужно обработать, False — повтор."""
+        if self._recent.get(key) is not MISSING:
+            self.duplicates += 1
+            return False
+        self._recent.set(key, True)
+
+        try:
+            claimed = await self.db.claim_idempotency_key(key)
+        except Exception:
+            # Нажатие не обработано (БД недоступна) — после восстановления его можно повторить
+            self._recent.invalidate(key)
+            raise
+        if claimed is None:
+            # БД недоступна: записи хэндлера всё равно не пройдут, повторы в процессе отсекает кеш
+            logging.warning("Ключ идемпотентности %s не записан в БД", key)
+            return True
+        if not claimed:
+            self.duplicates += 1
+        return claimed
+
+    async def start(self):
+        """Запуск фоновой очистки старых ключей."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            try:
+                deleted = await self.db.delete_expired_idempotency_keys(self.ttl)
+                if deleted:
+                    logging.info("Удалены старые ключи идемпотентности: %s", deleted)
+            except Exception:
+                logging.exception("Ошибка очистки ключей идемпотентности")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        """Остановка фоновой задачи."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        """Число ключей в кеше процесса и отклонённых повторов."""
+        return {'recent': len(self._recent), 'duplicates': self.duplicates}
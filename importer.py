@@ -0,0 +1,211 @@
+import codecs
+import csv
+import os
+import zipfile
+from decimal import Decimal, InvalidOperation
+
+from search import normalize
+
+try:
+    import openpyxl  # Необязательная зависимость: нужна только для XLSX
+    from openpyxl.utils.exceptions import InvalidFileException
+except ImportError:
+    openpyxl = None
+    InvalidFileException = None
+
+# Названия колонок накладной (сравниваются после search.normalize)
+COLUMN_ALIASES = {
+    'code': ('код', 'id', 'артикул', 'арт'),
+    'name': ('назва', 'назва товару', 'товар', 'найменування', 'наименование', 'название', 'номенклатура', 'name'),
+    'quantity': ('кількість', 'к-сть', 'количество', 'кол-во', 'qty', 'quantity'),
+    'price': ('ціна', 'ціна закупівлі', 'цена', 'цена закупки', 'price'),
+}
+_ALIASES = {normalize(alias): column for column, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+# Заголовок ищется в первых строках файла (над ним бывает шапка накладной)
+HEADER_SEARCH_ROWS = 20
+SNIFF_BYTES = 64 * 1024
+CHUNK_BYTES = 1024 * 1024
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx')
+
+
+class InvoiceError(ValueError):
+    """Файл накладной нельзя разобрать (формат, кодировка, нет заголовка)."""
+
+
+class ImportResult:
+    """Итог разбора накладной.
+
+    lines — принятые строки [номенклатура_id, количество, цена] (как черновик прихода),
+    rejected — [(номер строки файла, причина)], total — сумма принятых строк.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.rejected = []
+        self.total = Decimal(0)
+
+
+def _is_utf8(f):
+    """Весь остаток файла — корректный UTF-8 (читается по частям, без загрузки в память)."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        while chunk := f.read(CHUNK_BYTES):
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _open_csv(path):
+    """Построчное чтение CSV: кодировка (UTF-8 или cp1251) и разделитель определяются по началу файла.
+
+    Если начало файла — только ASCII (латинский заголовок), кодировка
+    определяется проверкой всего файла. Непредусмотренные байты заменяются,
+    а не обрывают разбор: такая строка будет отклонена как ненайденный товар.
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(SNIFF_BYTES)
+        try:
+            text = codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+            encoding = 'utf-8-sig'
+            if sample.isascii() and not _is_utf8(f):
+                encoding = 'cp1251'
+        except UnicodeDecodeError:
+            text = sample.decode('cp1251', errors='replace')
+            encoding = 'cp1251'
+    try:
+        dialect = csv.Sniffer().sniff(text, delimiters=';,\t')
+    except csv.Error:
+        dialect = csv.excel
+    with open(path, newline='', encoding=encoding, errors='replace') as f:
+        try:
+            yield from csv.reader(f, dialect)
+        except csv.Error as e:
+            raise InvoiceError(f"Пошкоджений файл CSV ({e}).") from e
+
+
+def _open_xlsx(path):
+    """Построчное чтение первого листа XLSX (read_only — без загрузки книги в память)."""
+    if openpyxl is None:
+        raise InvoiceError("Для файлів XLSX потрібен пакет openpyxl. Надішліть накладну у форматі CSV.")
+    # Пошкоджений або перейменований файл (не книга Excel)
+    errors = (zipfile.BadZipFile, InvalidFileException, KeyError, OSError)
+    try:
+        book = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    except errors as e:
+        raise InvoiceError("Файл XLSX пошкоджений або не є книгою Excel.") from e
+    try:
+        yield from book.active.iter_rows(values_only=True)
+    except errors as e:
+        raise InvoiceError("Файл XLSX пошкоджений або не є книгою Excel.") from e
+    finally:
+        book.close()
+
+
+def _rows(path, file_name):
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if extension == '.csv':
+        return _open_csv(path)
+    if extension == '.xlsx':
+        return _open_xlsx(path)
+    raise InvoiceError("Підтримуються лише файли CSV та XLSX.")
+
+
+def _header(row):
+    """Номера колонок {code/name/quantity/price: индекс}, если строка похожа на заголовок."""
+    columns = {}
+    for index, cell in enumerate(row):
+        column = _ALIASES.get(normalize(str(cell))) if cell is not None else None
+        if column and column not in columns:
+            columns[column] = index
+    if 'quantity' in columns and ('name' in columns or 'code' in columns):
+        return columns
+    return None
+
+
+def _number(value):
+    """Decimal из ячейки ('1 250,5', 1250.5, Decimal) или None."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return Decimal(str(value))
+    text = str(value).replace('\xa0', '').replace(' ', '').replace(',', '.')
+    if not text:
+        return None
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        return None
+    return number if number.is_finite() else None
+
+
+def _cell(row, columns, column):
+    index = columns.get(column)
+    if index is None or index >= len(row):
+        return None
+    value = row[index]
+    return value.strip() if isinstance(value, str) else value
+
+
+def parse_invoice(path, file_name, items, max_rows=50000):
+    """Разбор накладной поставщика по строкам с сопоставлением с его номенклатурой.
+
+    items — номенклатура поставщика [(id, название, цена)]; строка находится по коду
+    (id) или по названию без учёта регистра и похожих букв. Пустая цена берётся из
+    справочника. Файл читается потоково, в памяти — только принятые строки.
+    """
+    by_id = {item[0]: item for item in items}
+    by_name = {normalize(item[1]): item for item in items}
+    result = ImportResult()
+    columns = None
+    data_rows = 0
+
+    for row_number, row in enumerate(_rows(path, file_name), start=1):
+        if columns is None:
+            columns = _header(row)
+            if columns is None and row_number >= HEADER_SEARCH_ROWS:
+                raise InvoiceError("Не знайдено рядок заголовка (назва або код, кількість, ціна).")
+            continue
+        if not any(cell not in (None, '') for cell in row):
+            continue
+
+        data_rows += 1
+        if data_rows > max_rows:
+            result.rejected.append((row_number, f"перевищено ліміт {max_rows} рядків, решту файлу не оброблено"))
+            break
+
+        code = _cell(row, columns, 'code')
+        name = _cell(row, columns, 'name')
+        item = None
+        if code not in (None, ''):
+            try:
+                item = by_id.get(int(code))
+            except (TypeError, ValueError):
+                item = None
+        if item is None and name:
+            item = by_name.get(normalize(str(name)))
+        if item is None:
+            result.rejected.append((row_number, f"товар «{name or code}» не знайдено у постачальника"))
+            continue
+
+        quantity = _number(_cell(row, columns, 'quantity'))
+        if quantity is None or quantity <= 0:
+            result.rejected.append((row_number, "невірна кількість"))
+            continue
+
+        raw_price = _cell(row, columns, 'price')
+        price = _number(raw_price)
+        if price is None and raw_price in (None, '') and item[2] is not None:
+            price = Decimal(str(item[2]))
+        if price is None or price < 0:
+            result.rejected.append((row_number, "невірна ціна"))
+            continue
+
+        result.lines.append([item[0], quantity, price])
+        result.total += round(quantity * price, 2)
+
+    if columns is None:
+        raise InvoiceError("Файл порожній або не містить рядка заголовка.")
+    return result
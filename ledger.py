@@ -0,0 +1,38 @@
+import asyncio
+import logging
+
+
+class LedgerCompactor:
+    """Фоновая свёртка журнала расчётов в балансы поставщиков.
+
+    Записи журнала только дописываются, а баланс читается как свёрнутая сумма
+    плюс хвост журнала после неё. Регулярная свёртка держит хвост коротким,
+    поэтому чтение баланса не зависит от длины истории расчётов.
+    """
+
+    def __init__(self, db, interval=60):
+        self.db = db
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        """Запуск фоновой свёртки."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            try:
+                updated = await self.db.ledger_compact()
+                if updated:
+                    logging.info("Свёрнут журнал расчётов, поставщиков: %s", updated)
+            except Exception:
+                logging.exception("Ошибка свёртки журнала расчётов")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        """Остановка фоновой свёртки."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from config import METRICS_ENABLED, SLOW_QUERY_THRESHOLD
+
+# Включена ли инструментация. Проверяется до любых замеров, поэтому
+# в выключенном состоянии цена — одна проверка булева флага.
+ENABLED = METRICS_ENABLED
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_lock = threading.Lock()
+
+
+class Counter:
+    """Счётчик с метками."""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = {}
+
+    def inc(self, label_value, amount=1):
+        with _lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+class Histogram:
+    """Гистограмма задержек с метками (формат Prometheus: кумулятивные корзины)."""
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        self.values = {}  # метка -> [счётчики корзин..., +Inf], сумма
+
+    def observe(self, label_value, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with _lock:
+            entry = self.values.get(label_value)
+            if entry is None:
+                entry = self.values[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {cumulative}')
+        return lines
+
+
+DB_QUERY_SECONDS = Histogram('crm_db_query_seconds', "Время выполнения запросов к БД", 'query')
+DB_QUERY_ROWS = Counter('crm_db_query_rows_total', "Строк возвращено или изменено запросами", 'query')
+DB_QUERY_ERRORS = Counter('crm_db_query_errors_total', "Ошибок выполнения запросов", 'query')
+DB_ROUND_TRIPS = Counter('crm_db_round_trips_total', "Обращений к серверу БД (execute, COPY)", 'call')
+HANDLER_SECONDS = Histogram('crm_handler_seconds', "Время работы хэндлеров", 'handler')
+HANDLER_ERRORS = Counter('crm_handler_errors_total', "Исключений в хэндлерах", 'handler')
+SEND_RETRIES = Counter('crm_send_retries_total', "Ответов 429 от Bot API (запрос повторён)", 'method')
+SEND_COALESCED = Counter('crm_send_coalesced_total', "Неотправленных правок, заменённых новыми", 'method')
+
+_metrics = [DB_QUERY_SECONDS, DB_QUERY_ROWS, DB_QUERY_ERRORS, DB_ROUND_TRIPS, HANDLER_SECONDS, HANDLER_ERRORS,
+            SEND_RETRIES, SEND_COALESCED]
+_collectors = []
+
+
+def register_collector(collect):
+    """Дополнительный источник метрик: функция, возвращающая {имя_метрики: значение} (gauge)."""
+    _collectors.append(collect)
+
+
+def _row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple):
+        return 1
+    if isinstance(result, int) and not isinstance(result, bool):
+        return max(result, 0)
+    return 0
+
+
+def observe_query(name, seconds, result, query=None):
+    """Учёт выполненного запроса; медленные запросы пишутся в лог."""
+    DB_QUERY_SECONDS.observe(name, seconds)
+    DB_QUERY_ROWS.inc(name, _row_count(result))
+    if seconds >= SLOW_QUERY_THRESHOLD:
+        sql = ' '.join(query.split())[:200] if query else ''
+        logging.warning("Медленный запрос %s: %.3f с %s", name, seconds, sql)
+
+
+@contextmanager
+def timed_query(name):
+    """Замер блока работы с БД (транзакции из нескольких запросов)."""
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DB_QUERY_ERRORS.inc(name)
+        raise
+    finally:
+        observe_query(name, time.perf_counter() - started, None)
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, value in collect().items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+async def start_http_server(host, port):
+    """Локальный HTTP-эндпоинт /metrics. Возвращает aiohttp AppRunner (для остановки — cleanup())."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,109 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+import metrics
+from idempotency import IdempotencyStore, split_token
+from replicas import session
+
+
+class AuthMiddleware(BaseMiddleware):
+    """Определяет роль пользователя один раз на обновление.
+
+    Роль и имя берутся из кеша ролей Database (при промахе — из БД) и передаются
+    в хэндлеры аргументами `role` и `user_name`, поэтому хэндлерам больше не нужно
+    самим вызывать get_user_role.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        db = data.get('db')
+
+        role, name = None, None
+        if user is not None and db is not None:
+            role, name = await db.get_user_role(user.id)
+
+        data['role'] = role
+        data['user_name'] = name
+        return await handler(event, data)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замер времени работы каждого хэндлера (метрика crm_handler_seconds по имени функции)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not metrics.ENABLED:
+            return await handler(event, data)
+
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(name, time.perf_counter() - started)
+
+
+class IdempotencyMiddleware(BaseMiddleware):
+    """Отсечение повторных нажатий кнопок с токеном (idempotency.with_token).
+
+    Регистрируется внешним middleware на callback_query диспетчера: срабатывает
+    один раз на нажатие до фильтров. Фильтры и хэндлеры получают callback_data
+    уже без токена; повтор получает короткий ответ и до хэндлера не доходит.
+    """
+
+    def __init__(self, store: IdempotencyStore):
+        self.store = store
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not event.data:
+            return await handler(event, data)
+        base, token = split_token(event.data)
+        if token is None:
+            return await handler(event, data)
+
+        if not await self.store.claim(f"{event.from_user.id}:{token}"):
+            await event.answer("Цю дію вже виконано.")
+            return None
+        return await handler(event.model_copy(update={'data': base}), data)
+
+
+class ReadSessionMiddleware(BaseMiddleware):
+    """Сессия чтения пользователя на время обработки обновления (replicas.read_session).
+
+    Регистрируется внешним middleware на update диспетчера. Записи пользователя
+    запоминают позицию WAL, и его чтения с реплик идут только на реплики, уже
+    применившие её: только что сохранённые данные видны сразу.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        with session(user.id):
+            return await handler(event, data)
@@ -0,0 +1,171 @@
+"""Версионные миграции схемы и проверка индексов.
+
+Миграции — файлы migrations/NNNN_название.sql, применяются по порядку номеров,
+каждая один раз; применённые версии записываются в ВерсииСхемы.
+
+    python migrate.py                  # применить новые миграции
+    python migrate.py --status         # какие миграции применены
+    python migrate.py --check-indexes  # EXPLAIN всех запросов реестра statements
+
+Таблицы модулей (журнал расчётов, заказы, отчёты, FSM) создаёт бот при запуске
+(Database.ensure_*_schema), поэтому проверку индексов запускать на базе,
+где бот уже стартовал.
+"""
+import argparse
+import os
+import re
+import sys
+
+import psycopg2
+
+from statements import STATEMENTS
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+_MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Ключ advisory-блокировки: несколько процессов бота не применяют миграции одновременно
+MIGRATION_LOCK_ID = 7301
+
+VERSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ВерсииСхемы (
+    версия INTEGER PRIMARY KEY,
+    название TEXT NOT NULL,
+    применено TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Запросы, которые по смыслу читают таблицы целиком (отчёты по всем строкам)
+FULL_SCAN_STATEMENTS = {'report_stock_value', 'report_debt_aging', 'stock_as_of'}
+
+
+def available_migrations(directory=MIGRATIONS_DIR):
+    """Файлы миграций [(версия, название, путь)] по возрастанию версии."""
+    migrations = []
+    for file_name in os.listdir(directory):
+        match = _MIGRATION_FILE.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, file_name)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Повторяющиеся номера миграций в {directory}")
+    return migrations
+
+
+def applied_versions(cur):
+    cur.execute(VERSIONS_SCHEMA)
+    cur.execute("SELECT версия FROM ВерсииСхемы")
+    return {row[0] for row in cur.fetchall()}
+
+
+def apply_migrations(db, directory=MIGRATIONS_DIR):
+    """Применение ещё не применённых миграций в одной транзакции.
+
+    Либо применяются все новые миграции, либо (при ошибке) ни одна.
+    Возвращает список применённых версий или None при ошибке.
+    """
+    migrations = available_migrations(directory)
+    applied = []
+    try:
+        with db.transaction('migrate') as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            done = applied_versions(cur)
+            for version, name, path in migrations:
+                if version in done:
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    cur.execute(f.read())
+                cur.execute("INSERT INTO ВерсииСхемы (версия, название) VALUES (%s, %s)", (version, name))
+                applied.append(version)
+                print(f"Применена миграция {version:04d}_{name}.")
+        return applied
+    except psycopg2.Error as e:
+        print(f"Ошибка применения миграций: {e}")
+        return None
+
+
+def _plan_problems(plan):
+    """Узлы плана, читающие таблицу без индекса: [(таблица, тип узла, условие)]."""
+    problems = []
+    relation = plan.get('Relation Name')
+    if relation:
+        node_type = plan['Node Type']
+        indexed = 'Index Cond' in plan or 'Recheck Cond' in plan
+        if node_type == 'Seq Scan' or ('Filter' in plan and not indexed):
+            problems.append((relation, node_type, plan.get('Filter', '')))
+    for child in plan.get('Plans', ()):
+        problems.extend(_plan_problems(child))
+    return problems
+
+
+def check_indexes(db):
+    """EXPLAIN каждого запроса реестра statements с общим (generic) планом.
+
+    Последовательное чтение запрещено (enable_seqscan = off), поэтому Seq Scan
+    в плане означает, что подходящего индекса нет вовсе, а отбор строк фильтром
+    без условия индекса — что индекс есть, но не по нужным колонкам.
+    Возвращает {имя запроса: [(таблица, тип узла, условие)]} для проблемных запросов.
+    """
+    problems = {}
+    with db.connection() as conn:
+        if not conn:
+            raise psycopg2.OperationalError("Нет соединения с БД")
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL enable_seqscan = off")
+                cur.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+                for name, statement in sorted(STATEMENTS.items()):
+                    if name not in conn.prepared:
+                        cur.execute(statement.prepare_sql)
+                        conn.prepared.add(name)
+                    cur.execute("EXPLAIN (FORMAT JSON) " + statement.execute_sql, [None] * len(statement.arg_names))
+                    found = _plan_problems(cur.fetchone()[0][0]['Plan'])
+                    if found and name not in FULL_SCAN_STATEMENTS:
+                        problems[name] = found
+        finally:
+            conn.rollback()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы CRM")
+    parser.add_argument('--status', action='store_true', help="показать применённые и ожидающие миграции")
+    parser.add_argument('--check-indexes', action='store_true', help="проверить планы запросов реестра")
+    args = parser.parse_args()
+
+    from database import Database
+    db = Database()
+    if db.conn is None:
+        return 1
+    try:
+        if args.status:
+            with db.transaction('migrate_status') as cur:
+                done = applied_versions(cur)
+            for version, name, _ in available_migrations():
+                print(f"{'✔' if version in done else ' '} {version:04d}_{name}")
+            return 0
+
+        if args.check_indexes:
+            try:
+                problems = check_indexes(db)
+            except psycopg2.Error as e:
+                print(f"Ошибка проверки планов запросов: {e}")
+                return 1
+            for name, found in problems.items():
+                for relation, node_type, condition in found:
+                    print(f"{name}: {node_type} по {relation}" + (f" (фильтр {condition})" if condition else ""))
+            print("Все запросы используют индексы." if not problems else f"Запросов без индекса: {len(problems)}")
+            return 1 if problems else 0
+
+        applied = apply_migrations(db)
+        if applied is None:
+            return 1
+        if not applied:
+            print("Новых миграций нет.")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
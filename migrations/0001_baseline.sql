@@ -0,0 +1,50 @@
+-- Базовая схема CRM: таблицы, с которыми работает database.py.
+-- IF NOT EXISTS — в уже работающих базах таблицы созданы вручную и не меняются,
+-- недостающие ключи и индексы добавляет 0002_indexes.sql.
+
+CREATE TABLE IF NOT EXISTS Пользователи (
+    telegram_id BIGINT PRIMARY KEY,
+    роль TEXT NOT NULL,
+    имя TEXT,
+    код_менеджера TEXT
+);
+
+CREATE TABLE IF NOT EXISTS Поставщики (
+    id SERIAL PRIMARY KEY,
+    название TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS Номенклатура (
+    id SERIAL PRIMARY KEY,
+    поставщик_id INTEGER NOT NULL REFERENCES Поставщики (id),
+    название_товара TEXT NOT NULL,
+    текущая_цена_закупки NUMERIC
+);
+
+CREATE TABLE IF NOT EXISTS Приходы (
+    id SERIAL PRIMARY KEY,
+    поставщик_id INTEGER NOT NULL REFERENCES Поставщики (id),
+    завсклада_id BIGINT
+);
+
+CREATE TABLE IF NOT EXISTS СтрокиПрихода (
+    id SERIAL PRIMARY KEY,
+    приход_id INTEGER NOT NULL REFERENCES Приходы (id),
+    номенклатура_id INTEGER NOT NULL REFERENCES Номенклатура (id),
+    количество NUMERIC NOT NULL,
+    цена_закупки NUMERIC NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ОстаткиСклада (
+    номенклатура_id INTEGER PRIMARY KEY REFERENCES Номенклатура (id),
+    количество_на_складе NUMERIC NOT NULL DEFAULT 0,
+    середня_ціна_закупівлі NUMERIC NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS ЗадолженностиПоставщикам (
+    id SERIAL PRIMARY KEY,
+    приход_id INTEGER NOT NULL REFERENCES Приходы (id),
+    сумма_задолженности NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    сумма_оплачено NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    статус TEXT NOT NULL DEFAULT 'не оплачено'
+);
@@ -0,0 +1,42 @@
+-- Индексы под запросы statements.py и ключи, без которых не работают UPSERT.
+-- В существующих базах часть индексов могла быть создана вручную: индекс
+-- создаётся, только если нет непарциального индекса с теми же ведущими колонками
+-- (для уникального — с точно тем же набором колонок).
+
+CREATE OR REPLACE FUNCTION pg_temp.ensure_index(tbl regclass, cols text[], index_name text, is_unique boolean DEFAULT false)
+RETURNS void AS $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_index i
+        WHERE i.indrelid = tbl
+          AND i.indpred IS NULL
+          AND (NOT is_unique OR (i.indisunique AND i.indnkeyatts = array_length(cols, 1)))
+          AND (
+              SELECT array_agg(a.attname::text ORDER BY k.ord)
+              FROM unnest((i.indkey::int2[])[0:array_length(cols, 1) - 1]) WITH ORDINALITY AS k (attnum, ord)
+              JOIN pg_attribute a ON a.attrelid = tbl AND a.attnum = k.attnum
+          ) = cols
+    ) THEN
+        EXECUTE format(
+            'CREATE %s INDEX %I ON %s (%s)',
+            CASE WHEN is_unique THEN 'UNIQUE' ELSE '' END,
+            index_name,
+            tbl,
+            (SELECT string_agg(quote_ident(c), ', ') FROM unnest(cols) AS c)
+        );
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Цели ON CONFLICT: add_new_user и UPSERT_INVENTORY
+SELECT pg_temp.ensure_index('Пользователи', ARRAY['telegram_id'], 'пользователи_telegram_id_key', true);
+SELECT pg_temp.ensure_index('ОстаткиСклада', ARRAY['номенклатура_id'], 'остаткисклада_номенклатура_id_key', true);
+
+-- get_items_by_supplier (WHERE поставщик_id ORDER BY название_товара) и get_all_items
+SELECT pg_temp.ensure_index('Номенклатура', ARRAY['поставщик_id', 'название_товара'], 'номенклатура_поставщик_название_idx');
+
+-- Внешние ключи, по которым ищутся строки документа и долг по приходу
+SELECT pg_temp.ensure_index('Приходы', ARRAY['поставщик_id'], 'приходы_поставщик_idx');
+SELECT pg_temp.ensure_index('СтрокиПрихода', ARRAY['приход_id'], 'строкиприхода_приход_idx');
+SELECT pg_temp.ensure_index('СтрокиПрихода', ARRAY['номенклатура_id'], 'строкиприхода_номенклатура_idx');
+SELECT pg_temp.ensure_index('ЗадолженностиПоставщикам', ARRAY['приход_id'], 'задолженности_приход_idx');
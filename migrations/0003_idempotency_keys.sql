@@ -0,0 +1,10 @@
+-- Ключи идемпотентности нажатий инлайн-кнопок (idempotency.py): повторная
+-- доставка или двойное нажатие кнопки с тем же токеном не выполняет действие
+-- второй раз. Ключи старше IDEMPOTENCY_KEY_TTL удаляет бот.
+
+CREATE TABLE IF NOT EXISTS КлючиИдемпотентности (
+    ключ TEXT PRIMARY KEY,
+    создано TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS ключиидемпотентности_создано_idx ON КлючиИдемпотентности (создано);
@@ -0,0 +1,6 @@
+-- Дата прихода: нужна журналу расчётов (сроки долга), агрегатам отчётов и
+-- аналитике склада. Для уже существующих приходов — дата применения миграции.
+
+ALTER TABLE Приходы ADD COLUMN IF NOT EXISTS создано TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS приходы_создано_idx ON Приходы (создано);
@@ -0,0 +1,202 @@
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+from breaker import DatabaseUnavailable
+from cache import MISSING, TTLCache
+
+# Сессия чтения текущего обновления (telegram_id пользователя). Записи сессии
+# запоминают позицию WAL, и её чтения идут только на реплики, применившие эту позицию
+read_session = contextvars.ContextVar('read_session', default=None)
+# Значение read_session: читать только из основной БД
+PRIMARY = 'primary'
+
+# Состояние реплики: в режиме восстановления ли она, до какой позиции применён WAL
+# и отставание в секундах (0, если всё полученное уже применено)
+REPLICA_STATUS_QUERY = """
+SELECT pg_is_in_recovery(),
+       pg_last_wal_replay_lsn()::text,
+       CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END::float8
+"""
+
+
+def parse_lsn(text):
+    """Позиция WAL '16/B374D848' в число для сравнения."""
+    high, _, low = text.partition('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+@contextmanager
+def session(key):
+    """Чтения и записи внутри блока относятся к сессии key (PRIMARY — чтения только из основной БД)."""
+    token = read_session.set(key)
+    try:
+        yield
+    finally:
+        read_session.reset(token)
+
+
+def primary_reads():
+    """Чтения внутри блока — только из основной БД (данные только что изменены)."""
+    return session(PRIMARY)
+
+
+class Replica:
+    """Реплика: свой пул соединений и последнее известное состояние репликации."""
+
+    def __init__(self, name, db):
+        self.name = name
+        self.db = db
+        self.usable = False
+        self.replay_lsn = 0
+        self.lag = None
+        self.checked_at = 0.0
+        self.reason = "ещё не проверена"
+        self.lock = threading.Lock()
+
+
+class ReplicaSet:
+    """Чтение части запросов с реплик с откатом на основную БД.
+
+    Запрос уходит на реплику (по кругу), если она доступна, в режиме
+    восстановления и отстаёт не больше max_lag секунд; состояние реплики
+    перепроверяется не чаще check_interval. Внутри сессии чтения после записи
+    реплика подходит, только если уже применила позицию WAL этой записи
+    (read-your-writes); позиции сессий хранятся session_ttl секунд.
+    Если подходящей реплики нет или запрос на ней не выполнился, run возвращает
+    MISSING и запрос выполняется в основной БД.
+    """
+
+    def __init__(self, replicas, max_lag=5, check_interval=2, session_ttl=600, session_cache_size=10000):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._sessions = TTLCache(maxsize=session_cache_size, ttl=session_ttl)
+        self._rotation = itertools.count()
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    def open(self):
+        for replica in self.replicas:
+            replica.db.open()
+
+    def close(self):
+        for replica in self.replicas:
+            replica.db.close()
+
+    def tracking(self):
+        """Нужно ли запоминать позицию WAL после записи (идёт сессия чтения)."""
+        key = read_session.get()
+        return key is not None and key != PRIMARY
+
+    def note_write(self, lsn):
+        """Позиция WAL после записи текущей сессии; None — неизвестна (читать из основной БД)."""
+        key = read_session.get()
+        if key is None or key == PRIMARY:
+            return
+        current = self._sessions.get(key)
+        if lsn is None or current is None:
+            self._sessions.set(key, None)
+        elif current is MISSING or lsn > current:
+            self._sessions.set(key, lsn)
+
+    def run(self, statement, params, execute):
+        """Результат execute(conn, statement, params) на подходящей реплике или MISSING."""
+        key = read_session.get()
+        min_lsn = 0
+        if key == PRIMARY:
+            min_lsn = None
+        elif key is not None:
+            min_lsn = self._sessions.get(key, 0)
+        if min_lsn is None:
+            self.primary_reads += 1
+            return MISSING
+
+        start = next(self._rotation) % len(self.replicas)
+        for replica in self.replicas[start:] + self.replicas[:start]:
+            if not self._fresh(replica, min_lsn):
+                continue
+            try:
+                with replica.db.connection() as conn:
+                    if not conn:
+                        continue
+                    # Без открытой транзакции: долгие транзакции на реплике мешают применению WAL
+                    conn.autocommit = True
+                    result = execute(conn, statement, params)
+                self.replica_reads += 1
+                return result
+            except (psycopg2.Error, DatabaseUnavailable) as e:
+                logging.warning("Запрос %s на реплике %s не выполнен: %s", statement.name, replica.name, e)
+                self._mark(replica, False, str(e).strip())
+        self.primary_reads += 1
+        return MISSING
+
+    def _fresh(self, replica, min_lsn):
+        """Реплика подходит для чтения: состояние свежее, отставание допустимо, позиция сессии применена."""
+        stale = time.monotonic() - replica.checked_at >= self.check_interval
+        if stale or (replica.usable and replica.replay_lsn < min_lsn):
+            self._check(replica)
+        return replica.usable and replica.replay_lsn >= min_lsn
+
+    def _check(self, replica):
+        # Проверяет один поток, остальные пользуются прежним состоянием
+        if not replica.lock.acquire(blocking=False):
+            return
+        try:
+            with replica.db.connection() as conn:
+                if not conn:
+                    return
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(REPLICA_STATUS_QUERY)
+                    in_recovery, replay_lsn, lag = cur.fetchone()
+            if not in_recovery or replay_lsn is None:
+                self._mark(replica, False, "не в режиме реплики")
+                return
+            replica.replay_lsn = parse_lsn(replay_lsn)
+            replica.lag = lag
+            if lag > self.max_lag:
+                self._mark(replica, False, f"отставание {lag:.1f} с")
+            else:
+                self._mark(replica, True)
+        except (psycopg2.Error, DatabaseUnavailable) as e:
+            self._mark(replica, False, str(e).strip())
+        finally:
+            replica.checked_at = time.monotonic()
+            replica.lock.release()
+
+    def _mark(self, replica, usable, reason=None):
+        if usable != replica.usable:
+            if usable:
+                logging.info("Реплика %s снова используется для чтения", replica.name)
+            else:
+                logging.warning("Реплика %s не используется для чтения: %s", replica.name, reason)
+        replica.usable = usable
+        replica.reason = reason
+
+    def stats(self):
+        """Чтения с реплик, чтения в основной БД вместо реплики и число годных реплик."""
+        return {
+            'replica_reads': self.replica_reads,
+            'primary_reads': self.primary_reads,
+            'usable': sum(replica.usable for replica in self.replicas),
+        }
+
+    def health(self):
+        return [
+            {
+                'replica': replica.name,
+                'usable': replica.usable,
+                'lag': replica.lag,
+                'reason': replica.reason,
+                'breaker': replica.db.breaker.state,
+            }
+            for replica in self.replicas
+        ]
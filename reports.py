@@ -0,0 +1,96 @@
+import codecs
+import os
+import tempfile
+from datetime import date, timedelta
+
+from statements import REPORT_DEBT_AGING
+
+try:
+    import openpyxl  # Необязательная зависимость: нужна только для выгрузки в XLSX
+except ImportError:
+    openpyxl = None
+
+XLSX_AVAILABLE = openpyxl is not None
+
+# Подробные выгрузки отчётов (строки — в файл, в чат идёт только сводка)
+STOCK_EXPORT = """
+SELECT p.название AS "Постачальник", n.название_товара AS "Товар",
+       o.количество_на_складе AS "Кількість", o.зарезервировано AS "Резерв",
+       o.середня_ціна_закупівлі AS "Середня ціна",
+       round(o.количество_на_складе * o.середня_ціна_закупівлі, 2) AS "Вартість"
+FROM ОстаткиСклада o
+JOIN Номенклатура n ON n.id = o.номенклатура_id
+JOIN Поставщики p ON p.id = n.поставщик_id
+WHERE o.количество_на_складе <> 0
+ORDER BY p.название, n.название_товара
+"""
+
+RECEIPTS_EXPORT = """
+SELECT r.день AS "Дата", p.название AS "Постачальник", r.строк AS "Рядків",
+       r.количество AS "Кількість", r.сумма AS "Сума"
+FROM ОтчетПриходы r
+JOIN Поставщики p ON p.id = r.поставщик_id
+WHERE r.день >= %(date_from)s AND r.день < %(date_to)s
+ORDER BY r.день, p.название
+"""
+
+# отчёт -> (название файла, запрос выгрузки)
+EXPORTS = {
+    'stock': ("Оцінка складу", STOCK_EXPORT),
+    'receipts': ("Приходи", RECEIPTS_EXPORT),
+    'aging': ("Давність боргу", REPORT_DEBT_AGING),
+}
+
+# Периоды отчёта по приходам: код -> название
+PERIODS = {
+    'month': "поточний місяць",
+    'prev_month': "минулий місяць",
+    'year': "останні 12 місяців",
+}
+
+
+def period_dates(period, today=None):
+    """Границы периода [date_from, date_to) по коду из PERIODS."""
+    today = today or date.today()
+    first_of_month = today.replace(day=1)
+    if period == 'month':
+        return first_of_month, today + timedelta(days=1)
+    if period == 'prev_month':
+        return (first_of_month - timedelta(days=1)).replace(day=1), first_of_month
+    if period == 'year':
+        return today - timedelta(days=364), today + timedelta(days=1)
+    raise ValueError(f"Неизвестный период отчёта: {period}")
+
+
+def export_report(db, report, params=None, fmt='csv'):
+    """Выгрузка отчёта во временный файл; возвращает путь (файл удаляет вызывающий).
+
+    db — синхронная Database; функция блокирующая, вызывается через Database.export_report
+    (`await db.export_report(...)` — в пуле потоков БД).
+    CSV пишет сам Postgres (COPY), XLSX собирается построчно из серверного курсора,
+    так что в памяти не держится весь результат.
+    """
+    title, query = EXPORTS[report]
+    fd, path = tempfile.mkstemp(prefix='report_', suffix=f'.{fmt}')
+    try:
+        if fmt == 'csv':
+            with os.fdopen(fd, 'wb') as f:
+                # BOM — чтобы Excel открыл кириллицу в UTF-8 без мастера импорта
+                f.write(codecs.BOM_UTF8)
+                db.copy_query_csv(query, params, f)
+        elif fmt == 'xlsx':
+            os.close(fd)
+            if openpyxl is None:
+                raise RuntimeError("Для выгрузки в XLSX нужен пакет openpyxl")
+            book = openpyxl.Workbook(write_only=True)
+            sheet = book.create_sheet(title[:31])
+            for row in db.iter_query(query, params):
+                sheet.append(list(row))
+            book.save(path)
+        else:
+            os.close(fd)
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    except Exception:
+        os.remove(path)
+        raise
+    return path
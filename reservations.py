@@ -0,0 +1,38 @@
+import asyncio
+import logging
+
+
+class ReservationSweeper:
+    """Фоновая отмена заказов, не подтверждённых за ttl секунд.
+
+    Такие заказы отменяются пачкой (Database.release_expired_orders), и их
+    резерв возвращается в доступный остаток. ttl=0 — не отменять автоматически.
+    """
+
+    def __init__(self, db, ttl=172800, interval=300):
+        self.db = db
+        self.ttl = ttl
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        """Запуск фоновой отмены просроченных резервов."""
+        if self._task is None and self.ttl:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            try:
+                released = await self.db.release_expired_orders(self.ttl)
+                if released:
+                    logging.info("Отменены просроченные заказы: %s", released)
+            except Exception:
+                logging.exception("Ошибка отмены просроченных заказов")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        """Остановка фоновой задачи."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
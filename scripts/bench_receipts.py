@@ -0,0 +1,337 @@
+"""Бенчмарк приёмки товара: сценарий прихода через настоящий Dispatcher бота.
+
+Запускать только на одноразовой локальной БД — скрипт применяет миграции,
+заполняет справочники синтетикой и пишет приходы (данные остаются в базе):
+
+    python -m scripts.bench_receipts --db-name crm_bench --users 1,5,20 --lines 10
+
+Остальные параметры подключения (DB_HOST, DB_USER, DB_PASSWORD) берутся из
+окружения/.env. Обновления (сообщения и нажатия кнопок) подаются в bot.dp через
+feed_raw_update, запросы к Telegram API перехватывает сессия-заглушка. Для каждого
+числа одновременных пользователей выводятся p50/p95/p99 по хэндлерам, обращений
+к БД на строку прихода и пропускная способность (строк в секунду). Замер
+сравнивается с сохранённым базовым (--baseline); при его отсутствии или с
+--save-baseline текущий замер записывается как базовый.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_receipts_baseline.json')
+
+BENCH_PREFIX = "Bench"
+BENCH_USER_BASE = 900_000_000  # telegram_id синтетических кладовщиков
+
+# Регрессия — если p95 хэндлера хуже базового больше чем на допуск (и больше чем на шум)
+P95_NOISE_FLOOR = 0.001
+
+
+def configure_environment(args):
+    """Переменные окружения для config.py — до импорта bot."""
+    os.environ['DB_NAME'] = args.db_name
+    os.environ.setdefault('BOT_TOKEN', '123456789:bench')
+    # Счётчик обращений к БД работает только при включённых метриках
+    os.environ['METRICS_ENABLED'] = 'true'
+    os.environ['METRICS_PORT'] = '0'
+    os.environ['RECEIPT_DRAFT_MODE'] = 'true' if args.draft else 'false'
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.pool_size)
+    # Очередь отправки остаётся в цепочке, но без лимитов Telegram: меряется сам бот
+    os.environ['SEND_GLOBAL_RATE'] = '1000000'
+    os.environ['SEND_CHAT_RATE'] = '1000000'
+    os.environ['SEND_CHAT_BURST'] = '1000000'
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def seed_catalog(db, suppliers, items, users):
+    """Синтетические поставщики, номенклатура и кладовщики (если их ещё нет)."""
+    from psycopg2.extras import execute_values
+
+    with db.transaction('bench_seed') as cur:
+        cur.execute(f"SELECT count(*) FILTER (WHERE название NOT LIKE '{BENCH_PREFIX} %'), count(*) FROM Поставщики")
+        foreign, total = cur.fetchone()
+        if foreign:
+            raise SystemExit("В базе есть настоящие поставщики — бенчмарк запускается только на одноразовой БД.")
+        if total == 0:
+            supplier_ids = [row[0] for row in execute_values(
+                cur,
+                "INSERT INTO Поставщики (название) VALUES %s RETURNING id",
+                [(f"{BENCH_PREFIX} постачальник {i:03d}",) for i in range(1, suppliers + 1)],
+                fetch=True
+            )]
+            rng = random.Random(1)
+            execute_values(
+                cur,
+                "INSERT INTO Номенклатура (поставщик_id, название_товара, текущая_цена_закупки) VALUES %s",
+                [
+                    (supplier_ids[n % len(supplier_ids)], f"{BENCH_PREFIX} товар {n:06d}", round(rng.uniform(5, 500), 2))
+                    for n in range(1, items + 1)
+                ],
+                page_size=1000
+            )
+        elif total != suppliers:
+            raise SystemExit(f"Справочник уже заполнен другим размером ({total} поставщиков) — нужна чистая БД.")
+        execute_values(
+            cur,
+            "INSERT INTO Пользователи (telegram_id, роль, имя) VALUES %s ON CONFLICT (telegram_id) DO NOTHING",
+            [(BENCH_USER_BASE + i, 'завсклада', f"{BENCH_PREFIX} {i}") for i in range(users)]
+        )
+
+
+class Simulator:
+    """Подаёт обновления от имени синтетических пользователей и собирает замеры."""
+
+    def __init__(self, dp, bot):
+        from aiogram import BaseMiddleware
+        from aiogram.client.session.base import BaseSession
+        from aiogram import types
+
+        self.dp = dp
+        self.bot = bot
+        self.update_ids = itertools.count(1)
+        self.samples = defaultdict(list)
+        self.unhandled = 0
+        simulator = self
+
+        class StubSession(BaseSession):
+            """Сессия бота без сети: на методы Telegram API отвечает заглушками."""
+
+            def __init__(self):
+                super().__init__()
+                self.calls = defaultdict(int)
+                self.message_ids = itertools.count(1)
+
+            async def make_request(self, bot, method, timeout=None):
+                self.calls[type(method).__name__] += 1
+                chat_id = getattr(method, 'chat_id', None)
+                if chat_id is None:
+                    return True
+                return types.Message(
+                    message_id=next(self.message_ids),
+                    date=datetime.now(),
+                    chat=types.Chat(id=chat_id, type='private'),
+                    text=getattr(method, 'text', None)
+                )
+
+            async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+                yield b''
+
+            async def close(self):
+                pass
+
+        class TimingMiddleware(BaseMiddleware):
+            """Время самого хэндлера (без определения роли) по имени функции."""
+
+            async def __call__(self, handler, event, data):
+                name = getattr(getattr(data.get('handler'), 'callback', None), '__name__', 'unknown')
+                started = time.perf_counter()
+                try:
+                    return await handler(event, data)
+                finally:
+                    simulator.samples[name].append(time.perf_counter() - started)
+
+        self.session = StubSession()
+        bot.session = self.session
+        timing = TimingMiddleware()
+        for router in dp.sub_routers:
+            router.message.middleware(timing)
+            router.callback_query.middleware(timing)
+
+    def reset(self):
+        self.samples.clear()
+        self.session.calls.clear()
+        self.unhandled = 0
+
+    async def _feed(self, update):
+        from aiogram.dispatcher.event.bases import UNHANDLED
+
+        update['update_id'] = next(self.update_ids)
+        if await self.dp.feed_raw_update(self.bot, update) is UNHANDLED:
+            self.unhandled += 1
+
+    @staticmethod
+    def _user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': BENCH_PREFIX}
+
+    async def message(self, user_id, text):
+        await self._feed({'message': {
+            'message_id': next(self.update_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }})
+
+    async def callback(self, user_id, data):
+        await self._feed({'callback_query': {
+            'id': str(next(self.update_ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': next(self.update_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': BENCH_PREFIX,
+            },
+        }})
+
+    async def receipt(self, user_id, supplier_name, item_ids, lines, rng):
+        """Один приход: выбор поставщика, lines строк (товар, количество, цена, запись), завершение."""
+        # Кнопки записи — с токеном, как их рисует бот: замер включает проверку повтора
+        from idempotency import with_token
+
+        await self.message(user_id, "📦 Склад/Приход")
+        await self.message(user_id, supplier_name)
+        for _ in range(lines):
+            await self.callback(user_id, f"receipt_item:{rng.choice(item_ids)}")
+            await self.message(user_id, str(rng.randint(1, 50)))
+            await self.callback(user_id, "receipt_confirm_quantity")
+            await self.message(user_id, f"{rng.uniform(5, 500):.2f}")
+            await self.callback(user_id, with_token("receipt_save_line"))
+        await self.callback(user_id, with_token("receipt_finish"))
+
+
+async def run_level(simulator, catalog, users, receipts, lines):
+    """Прогон с users одновременными пользователями; возвращает сводку замера."""
+    import metrics
+
+    suppliers = catalog.suppliers()
+
+    async def user_session(i):
+        rng = random.Random(i)
+        supplier_id, supplier_name = suppliers[i % len(suppliers)]
+        item_ids = [item[0] for item in catalog.items(supplier_id)]
+        for _ in range(receipts):
+            await simulator.receipt(BENCH_USER_BASE + i, supplier_name, item_ids, lines, rng)
+
+    simulator.reset()
+    round_trips_before = sum(metrics.DB_ROUND_TRIPS.values.values())
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    round_trips = sum(metrics.DB_ROUND_TRIPS.values.values()) - round_trips_before
+
+    total_lines = users * receipts * lines
+    return {
+        'lines_per_second': total_lines / elapsed,
+        'receipts_per_second': users * receipts / elapsed,
+        'round_trips_per_line': round_trips / total_lines,
+        'unhandled_updates': simulator.unhandled,
+        'api_calls': dict(simulator.session.calls),
+        'handlers': {
+            name: {
+                'count': len(values),
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+            }
+            for name, values in sorted(simulator.samples.items())
+        },
+    }
+
+
+def print_level(users, result):
+    print(f"\n=== Пользователей: {users} ===")
+    print(f"Строк/с: {result['lines_per_second']:.1f}, приходов/с: {result['receipts_per_second']:.2f}, "
+          f"обращений к БД на строку: {result['round_trips_per_line']:.2f}")
+    if result['unhandled_updates']:
+        print(f"Не обработано обновлений: {result['unhandled_updates']} (сценарий разошёлся с хэндлерами)")
+    print(f"{'хэндлер':<36}{'вызовов':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for name, stats in result['handlers'].items():
+        print(f"{name:<36}{stats['count']:>9}{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}{stats['p99'] * 1000:>10.2f}")
+
+
+def compare(baseline, results, tolerance):
+    """Регрессии относительно базового замера: список строк с описанием."""
+    regressions = []
+    for users, result in results.items():
+        base = baseline.get(users)
+        if base is None:
+            continue
+        if result['lines_per_second'] < base['lines_per_second'] * (1 - tolerance):
+            regressions.append(f"{users} польз.: строк/с {result['lines_per_second']:.1f} < {base['lines_per_second']:.1f}")
+        if result['round_trips_per_line'] > base['round_trips_per_line'] + 0.01:
+            regressions.append(f"{users} польз.: обращений к БД на строку "
+                               f"{result['round_trips_per_line']:.2f} > {base['round_trips_per_line']:.2f}")
+        for name, stats in result['handlers'].items():
+            base_p95 = base['handlers'].get(name, {}).get('p95')
+            if base_p95 is not None and stats['p95'] > base_p95 * (1 + tolerance) and stats['p95'] - base_p95 > P95_NOISE_FLOOR:
+                regressions.append(f"{users} польз.: {name} p95 {stats['p95'] * 1000:.2f} мс > {base_p95 * 1000:.2f} мс")
+    return regressions
+
+
+async def bench(args):
+    import bot as bot_module
+
+    simulator = Simulator(bot_module.dp, bot_module.bot)
+    if bot_module.sender is not None:
+        simulator.session.middleware(bot_module.sender)
+    db = bot_module.db
+    await db.open()
+    if await db.migrate() is None:
+        return 1
+    await asyncio.to_thread(seed_catalog, db.sync, args.suppliers, args.items, max(args.users))
+    await bot_module.on_startup()
+    try:
+        results = {}
+        for users in args.users:
+            results[str(users)] = await run_level(simulator, bot_module.catalog, users, args.receipts, args.lines)
+            print_level(users, results[str(users)])
+    finally:
+        await bot_module.on_shutdown()
+
+    params = {
+        'suppliers': args.suppliers, 'items': args.items, 'receipts': args.receipts,
+        'lines': args.lines, 'draft': args.draft, 'pool_size': args.pool_size,
+    }
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'params': params, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\nБазовый замер сохранён: {args.baseline}")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['params'] != params:
+        print(f"\nПараметры отличаются от базового замера {baseline['params']} — сравнение пропущено.")
+        return 0
+    regressions = compare(baseline['results'], results, args.tolerance)
+    for line in regressions:
+        print(f"РЕГРЕССИЯ: {line}")
+    print("\nOK" if not regressions else f"\nРегрессий: {len(regressions)}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db-name', required=True, help="одноразовая локальная БД (подставляется вместо DB_NAME)")
+    parser.add_argument('--users', default='1,5,20', help="числа одновременных пользователей через запятую")
+    parser.add_argument('--receipts', type=int, default=3, help="приходов на пользователя")
+    parser.add_argument('--lines', type=int, default=10, help="строк в приходе")
+    parser.add_argument('--suppliers', type=int, default=20, help="поставщиков в синтетическом справочнике")
+    parser.add_argument('--items', type=int, default=5000, help="товаров в синтетическом справочнике")
+    parser.add_argument('--pool-size', type=int, default=10, help="максимум соединений пула (DB_POOL_MAX_SIZE)")
+    parser.add_argument('--draft', action='store_true', help="режим черновика прихода (RECEIPT_DRAFT_MODE)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="файл базового замера")
+    parser.add_argument('--save-baseline', action='store_true', help="записать текущий замер как базовый")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="допустимое ухудшение относительно базового (доля)")
+    args = parser.parse_args()
+    args.users = [int(users) for users in args.users.split(',')]
+
+    configure_environment(args)
+    return asyncio.run(bench(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
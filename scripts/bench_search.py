@@ -0,0 +1,87 @@
+"""Бенчмарк search.ItemSearchIndex на синтетическом каталоге.
+
+    python -m scripts.bench_search --items 100000 --queries 2000
+
+Строит индекс по случайным названиям товаров и замеряет время ответа
+для префиксных запросов, подстрок из середины названия и запросов с опечаткой.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from search import ItemSearchIndex
+
+WORDS = [
+    "Молоко", "Кефір", "Сир", "Масло", "Йогурт", "Сметана", "Ряжанка", "Вершки", "Хліб", "Батон",
+    "Ковбаса", "Сосиски", "Шинка", "Філе", "Курка", "Яйця", "Цукор", "Борошно", "Крупа", "Гречка",
+    "Рис", "Макарони", "Олія", "Соняшникова", "Оливкова", "Сік", "Яблучний", "Апельсиновий", "Вода",
+    "Мінеральна", "Газована", "Чай", "Кава", "Мелена", "Розчинна", "Печиво", "Вафлі", "Цукерки",
+    "Шоколад", "Чорний", "Молочний", "Пластівці", "Вівсяні", "Кукурудзяні", "Горох", "Квасоля",
+    "Томатна", "Паста", "Кетчуп", "Майонез", "Гірчиця", "Сіль", "Перець", "Оцет", "Дріжджі",
+    "Галичина", "Яготинське", "Простоквашино", "Президент", "Ферма", "Добряна", "Селянське",
+]
+UNITS = ["0.5л", "1л", "200г", "400г", "1кг", "2.5%", "3.2%", "15%", "20шт", "pack"]
+
+
+def synthetic_catalog(size, rng):
+    names = set()
+    while len(names) < size:
+        words = rng.sample(WORDS, rng.randint(2, 4))
+        names.add(f"{' '.join(words)} {rng.choice(UNITS)} арт.{rng.randint(1, 999999)}")
+    return [(i, name, round(rng.uniform(5, 500), 2)) for i, name in enumerate(sorted(names))]
+
+
+def with_typo(text, rng):
+    i = rng.randrange(1, len(text) - 1)
+    return text[:i] + text[i + 1:]
+
+
+def measure(index, queries):
+    timings = []
+    hits = 0
+    for query in queries:
+        started = time.perf_counter()
+        result = index.search(query, limit=10)
+        timings.append((time.perf_counter() - started) * 1000)
+        hits += bool(result)
+    timings.sort()
+    return {
+        'p50': statistics.median(timings),
+        'p95': timings[int(len(timings) * 0.95) - 1],
+        'p99': timings[int(len(timings) * 0.99) - 1],
+        'max': timings[-1],
+        'found': hits / len(queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    items = synthetic_catalog(args.items, rng)
+
+    started = time.perf_counter()
+    index = ItemSearchIndex(items)
+    print(f"Каталог: {len(items)} товаров, построение индекса: {time.perf_counter() - started:.2f} с")
+
+    names = [name for _, name, _ in rng.sample(items, args.queries)]
+    scenarios = {
+        'префикс': [name[:rng.randint(3, 8)] for name in names],
+        'подстрока': [name.split()[1][:rng.randint(3, 6)].lower() for name in names],
+        'два слова': [' '.join(word[:4] for word in name.split()[:2]) for name in names],
+        'опечатка': [with_typo(name.split()[0], rng) for name in names],
+    }
+    print(f"{'запросы':<12}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}{'найдено':>10}")
+    for title, queries in scenarios.items():
+        stats = measure(index, queries)
+        print(f"{title:<12}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}"
+              f"{stats['max']:>10.3f}{stats['found']:>10.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Проверка восстановления соединения с БД при её остановке и запуске.
+
+Скрипт непрерывно читает из БД (запрос get_suppliers из реестра) в нескольких
+потоках и по ходу останавливает и снова запускает локальный Postgres:
+
+    python -m scripts.db_outage --backend pool --workers 4 \\
+        --stop-cmd "pg_ctl -D /var/lib/postgresql/data stop -m fast" \\
+        --start-cmd "pg_ctl -D /var/lib/postgresql/data start" \\
+        --down-after 5 --down-for 15 --duration 40
+
+Без --stop-cmd/--start-cmd Postgres можно остановить и запустить вручную.
+Печатаются смены состояния автомата (breaker.CircuitBreaker) и итог: сколько
+запросов прошло, сколько отклонено сразу (DatabaseUnavailable) и за какое время,
+сколько вернули ошибку, и через сколько после запуска БД прошёл первый запрос.
+Проверка успешна, если после запуска БД запросы снова проходят, а пока она
+остановлена, отказы быстрые (не ждут таймаута подключения).
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from breaker import DatabaseUnavailable
+from database import Database, PooledDatabase
+
+# Отказ быстрее этого считается отклонением без попытки подключения, сек
+FAST_FAIL = 0.05
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=('pool', 'single'), default='pool')
+    parser.add_argument('--workers', type=int, default=4, help="потоков чтения (для single — 1)")
+    parser.add_argument('--interval', type=float, default=0.1, help="пауза между запросами потока, сек")
+    parser.add_argument('--duration', type=float, default=40, help="длительность проверки, сек")
+    parser.add_argument('--stop-cmd', help="команда остановки Postgres")
+    parser.add_argument('--start-cmd', help="команда запуска Postgres")
+    parser.add_argument('--down-after', type=float, default=5, help="через сколько секунд остановить БД")
+    parser.add_argument('--down-for', type=float, default=15, help="сколько секунд БД остановлена")
+    args = parser.parse_args()
+
+    db = PooledDatabase() if args.backend == 'pool' else Database()
+    db.open()
+    workers = args.workers if args.backend == 'pool' else 1
+
+    outcomes = defaultdict(list)  # исход -> [(момент, длительность)]
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + args.duration
+    db_started_at = []
+
+    def reader():
+        while time.monotonic() < deadline:
+            began = time.monotonic()
+            try:
+                outcome = 'ok' if db.get_suppliers() is not None else 'error'
+            except DatabaseUnavailable:
+                outcome = 'unavailable'
+            finished = time.monotonic()
+            with lock:
+                outcomes[outcome].append((finished - started, finished - began))
+            time.sleep(args.interval)
+
+    def outage():
+        time.sleep(args.down_after)
+        print(f"[{time.monotonic() - started:6.2f}] Остановка БД: {args.stop_cmd}")
+        subprocess.run(args.stop_cmd, shell=True, check=False)
+        time.sleep(args.down_for)
+        print(f"[{time.monotonic() - started:6.2f}] Запуск БД: {args.start_cmd}")
+        subprocess.run(args.start_cmd, shell=True, check=False)
+        db_started_at.append(time.monotonic() - started)
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(workers)]
+    if args.stop_cmd and args.start_cmd:
+        threads.append(threading.Thread(target=outage, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    state = None
+    try:
+        while any(thread.is_alive() for thread in threads):
+            health = db.health()
+            if health['state'] != state:
+                state = health['state']
+                print(f"[{time.monotonic() - started:6.2f}] Автомат: {state}, сбоев подряд {health['failures']}, "
+                      f"проба через {health['retry_in']} с, {health['last_error'] or ''}")
+            time.sleep(0.05)
+    finally:
+        db.close()
+
+    for outcome in ('ok', 'unavailable', 'error'):
+        timings = sorted(duration for _, duration in outcomes[outcome])
+        if timings:
+            print(f"{outcome}: {len(timings)}, p50 {statistics.median(timings) * 1000:.1f} мс, "
+                  f"max {timings[-1] * 1000:.1f} мс")
+        else:
+            print(f"{outcome}: 0")
+
+    rejected = [duration for _, duration in outcomes['unavailable']]
+    fast = sum(duration < FAST_FAIL for duration in rejected)
+    print(f"Быстрых отказов: {fast} из {len(rejected)} (< {FAST_FAIL * 1000:.0f} мс)")
+
+    ok = bool(outcomes['ok'])
+    if db_started_at:
+        recovered = [moment for moment, _ in outcomes['ok'] if moment > db_started_at[0]]
+        if recovered:
+            print(f"Первый успешный запрос через {min(recovered) - db_started_at[0]:.2f} с после запуска БД")
+        else:
+            print("После запуска БД запросы не прошли")
+        ok = bool(recovered)
+    print("OK" if ok else "НЕ ВОССТАНОВИЛОСЬ")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
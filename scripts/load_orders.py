@@ -0,0 +1,151 @@
+"""Нагрузочная проверка резервирования остатков при параллельных заказах.
+
+Запускать только на тестовой (локальной) БД — скрипт выставляет остаток
+выбранных товаров, создаёт заказы, а в конце удаляет их и восстанавливает остатки:
+
+    python -m scripts.load_orders --item-ids 1,2,3 --stock 500 --workers 32 --orders 20
+
+Все потоки одновременно заказывают одни и те же товары через пул соединений
+(Database.place_order), затем половина успешных заказов подтверждается,
+остальные отменяются пачками. Проверяется, что товара не зарезервировано
+больше, чем было, и что остаток и резерв сходятся с точным расчётом.
+"""
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+from decimal import Decimal
+
+from database import PooledDatabase
+
+
+def read_stock(db, item_ids):
+    rows = db.execute_query(
+        "SELECT номенклатура_id, количество_на_складе, зарезервировано FROM ОстаткиСклада WHERE номенклатура_id = ANY(%s)",
+        (item_ids,),
+        fetch_all=True,
+    )
+    return {item_id: (Decimal(quantity), Decimal(reserved)) for item_id, quantity, reserved in rows or []}
+
+
+def set_stock(db, stock):
+    for item_id, (quantity, reserved) in stock.items():
+        db.execute_query(
+            "UPDATE ОстаткиСклада SET количество_на_складе = %s, зарезервировано = %s WHERE номенклатура_id = %s",
+            (quantity, reserved, item_id),
+        )
+
+
+def delete_orders(db, order_ids):
+    if order_ids:
+        db.execute_query("DELETE FROM ДвиженияСклада WHERE заказ_id = ANY(%s)", (order_ids,))
+        db.execute_query("DELETE FROM СтрокиЗаказа WHERE заказ_id = ANY(%s)", (order_ids,))
+        db.execute_query("DELETE FROM Заказы WHERE id = ANY(%s)", (order_ids,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--item-ids', required=True, help="id товаров через запятую (должны быть в ОстаткиСклада)")
+    parser.add_argument('--stock', type=Decimal, default=Decimal(500), help="остаток каждого товара на время теста")
+    parser.add_argument('--workers', type=int, default=32, help="число параллельных менеджеров")
+    parser.add_argument('--orders', type=int, default=20, help="заказов на менеджера")
+    parser.add_argument('--batch', type=int, default=50, help="заказов в пачке подтверждения/отмены")
+    args = parser.parse_args()
+
+    item_ids = [int(item_id) for item_id in args.item_ids.split(',')]
+    db = PooledDatabase(min_size=args.workers, max_size=args.workers).open()
+    db.ensure_orders_schema()
+    initial = read_stock(db, item_ids)
+    if set(initial) != set(item_ids):
+        print(f"Нет строк остатков для товаров: {sorted(set(item_ids) - set(initial))}")
+        db.close()
+        return 1
+
+    # Заказы готовятся заранее: 1-3 товара из списка, количество 1-10
+    rng = random.Random(42)
+    plans = [
+        [
+            [[item_id, rng.randint(1, 10)] for item_id in rng.sample(item_ids, rng.randint(1, min(3, len(item_ids))))]
+            for _ in range(args.orders)
+        ]
+        for _ in range(args.workers)
+    ]
+    placed, rejected, errors, timings = [], [], [], []
+    lock = threading.Lock()
+    start = threading.Barrier(args.workers)
+
+    def worker(plan):
+        start.wait()
+        for lines in plan:
+            started = time.perf_counter()
+            result = db.place_order(0, lines)
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings.append(elapsed)
+                if result is None:
+                    errors.append(lines)
+                elif result[0] is None:
+                    rejected.append(lines)
+                else:
+                    placed.append((result[0], lines))
+
+    set_stock(db, {item_id: (args.stock, Decimal(0)) for item_id in item_ids})
+    threads = [threading.Thread(target=worker, args=(plan,)) for plan in plans]
+    order_ids = []
+    try:
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        order_ids = [order_id for order_id, _ in placed]
+
+        reserved = {item_id: Decimal(0) for item_id in item_ids}
+        for _, lines in placed:
+            for item_id, quantity in lines:
+                reserved[item_id] += quantity
+        after_orders = read_stock(db, item_ids)
+
+        # Половину подтверждаем, половину отменяем — пачками
+        confirmed = order_ids[::2]
+        released = order_ids[1::2]
+        for i in range(0, len(confirmed), args.batch):
+            db.confirm_orders(confirmed[i:i + args.batch])
+        for i in range(0, len(released), args.batch):
+            db.release_orders(released[i:i + args.batch])
+        shipped = {item_id: Decimal(0) for item_id in item_ids}
+        confirmed_ids = set(confirmed)
+        for order_id, lines in placed:
+            if order_id in confirmed_ids:
+                for item_id, quantity in lines:
+                    shipped[item_id] += quantity
+        final = read_stock(db, item_ids)
+
+        timings.sort()
+        total = len(timings)
+        print(f"Заказов: {total} за {elapsed:.2f} с ({total / elapsed:.0f}/с), "
+              f"p50 {statistics.median(timings) * 1000:.1f} мс, p95 {timings[int(total * 0.95) - 1] * 1000:.1f} мс")
+        print(f"Зарезервировано: {len(placed)}, отказ по остатку: {len(rejected)}, ошибок БД: {len(errors)}")
+
+        ok = not errors
+        for item_id in item_ids:
+            quantity, held = after_orders[item_id]
+            final_quantity, final_held = final[item_id]
+            print(f"Товар {item_id}: резерв {held} (ожидалось {reserved[item_id]}), "
+                  f"остаток после подтверждения {final_quantity} (ожидалось {args.stock - shipped[item_id]}), "
+                  f"резерв после закрытия {final_held}")
+            ok &= held == reserved[item_id] and held <= args.stock
+            ok &= final_quantity == args.stock - shipped[item_id] and final_held == 0
+        print("OK" if ok else "РАСХОЖДЕНИЕ")
+        return 0 if ok else 1
+    finally:
+        delete_orders(db, order_ids)
+        set_stock(db, initial)
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
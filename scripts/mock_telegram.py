@@ -0,0 +1,109 @@
+"""Локальный мок-сервер Bot API для проверки очереди отправки (sender.SendQueue).
+
+    python -m scripts.mock_telegram --port 8081 --chat-rate 1 --global-rate 30
+
+Бот направляется на него через TELEGRAM_API_URL=http://127.0.0.1:8081.
+Сервер отвечает на методы Bot API правдоподобными заглушками и, как Telegram,
+возвращает 429 с retry_after при превышении частоты в чат или на бота.
+Статистика запросов — GET /stats.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+# Методы, которые возвращают сообщение; остальные — True
+MESSAGE_METHODS = {'sendmessage', 'senddocument', 'sendphoto', 'editmessagetext', 'editmessagereplymarkup'}
+
+
+class RateWindow:
+    """Скользящее окно в 1 секунду: не больше limit запросов."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.times = deque()
+
+    def hit(self, now):
+        while self.times and now - self.times[0] >= 1:
+            self.times.popleft()
+        if len(self.times) >= self.limit:
+            return 1 - (now - self.times[0])
+        self.times.append(now)
+        return 0
+
+
+def create_app(global_rate, chat_rate, poll_timeout):
+    message_ids = itertools.count(1)
+    global_window = RateWindow(global_rate)
+    chat_windows = defaultdict(lambda: RateWindow(chat_rate))
+    stats = defaultdict(int)
+
+    async def read_params(request):
+        if request.content_type == 'application/json':
+            return await request.json()
+        return {key: value for key, value in (await request.post()).items() if isinstance(value, str)}
+
+    async def handle_method(request):
+        method = request.match_info['method'].lower()
+        params = await read_params(request)
+        chat_id = params.get('chat_id')
+        now = time.monotonic()
+
+        if method == 'getupdates':
+            # Long polling без обновлений
+            await asyncio.sleep(min(float(params.get('timeout', 0) or 0), poll_timeout))
+            return web.json_response({'ok': True, 'result': []})
+
+        wait = global_window.hit(now)
+        if not wait and chat_id is not None and method != 'answercallbackquery':
+            wait = chat_windows[chat_id].hit(now)
+        if wait:
+            stats['429'] += 1
+            retry_after = max(1, round(wait))
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {retry_after}",
+                'parameters': {'retry_after': retry_after},
+            }, status=429)
+
+        stats[method] += 1
+        if method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Mock', 'username': 'mock_bot'}
+        elif method in MESSAGE_METHODS:
+            result = {
+                'message_id': int(params.get('message_id') or next(message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id or 0), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_stats(request):
+        return web.Response(text=json.dumps(stats, ensure_ascii=False, indent=2), content_type='application/json')
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', handle_method)
+    app.router.add_get('/stats', handle_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--global-rate', type=int, default=30, help="запросов в секунду на бота до 429")
+    parser.add_argument('--chat-rate', type=int, default=1, help="сообщений в секунду в чат до 429")
+    parser.add_argument('--poll-timeout', type=float, default=1, help="максимум ожидания getUpdates, сек")
+    args = parser.parse_args()
+    web.run_app(create_app(args.global_rate, args.chat_rate, args.poll_timeout), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Проверка чтения с реплики и read-your-writes на двух локальных Postgres.
+
+Нужны основная БД и потоковая реплика, заданная в DB_REPLICA_HOSTS:
+
+    DB_REPLICA_HOSTS=127.0.0.1:5433 python -m scripts.replica_check --users 200
+
+Скрипт создаёт временных пользователей (отрицательные telegram_id) и сразу
+читает их роль запросом get_user_role, который выполняется на реплике.
+В сессии чтения (как у хэндлеров) каждый только что созданный пользователь
+должен найтись; с --no-session запись и чтение идут без сессии, и часть
+чтений может не увидеть запись, пока реплика её не применила.
+В конце пользователи удаляются, печатается число чтений с реплики и из основной БД.
+"""
+import argparse
+import sys
+import time
+
+from database import PooledDatabase, create_replica_set
+from replicas import session
+
+FIRST_TEST_ID = -900000000
+TEST_ROLE = 'тест'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200, help="сколько пользователей создать и прочитать")
+    parser.add_argument('--no-session', action='store_true', help="писать и читать без сессии чтения")
+    args = parser.parse_args()
+
+    replicas = create_replica_set()
+    if replicas is None:
+        print("Реплики не настроены: задайте DB_REPLICA_HOSTS")
+        return 1
+    db = PooledDatabase(replicas=replicas).open()
+    ids = [FIRST_TEST_ID - index for index in range(args.users)]
+
+    missed = []
+    started = time.perf_counter()
+    try:
+        for telegram_id in ids:
+            if args.no_session:
+                db.run('add_new_user', (telegram_id, TEST_ROLE, f"replica check {telegram_id}", None))
+                row = db.run('get_user_role', (telegram_id,))
+            else:
+                with session(telegram_id):
+                    db.add_new_user(telegram_id, TEST_ROLE, f"replica check {telegram_id}")
+                    row = db.run('get_user_role', (telegram_id,))
+            if not row or row[0] != TEST_ROLE:
+                missed.append(telegram_id)
+        elapsed = time.perf_counter() - started
+
+        stats = replicas.stats()
+        print(f"Пользователей: {len(ids)} за {elapsed:.2f} с")
+        print(f"Чтений с реплики: {stats['replica_reads']}, из основной БД: {stats['primary_reads']}")
+        for replica in replicas.health():
+            print(f"{replica['replica']}: {'используется' if replica['usable'] else 'не используется'}, "
+                  f"отставание {replica['lag']} с, {replica['reason'] or ''}")
+        print(f"Запись не видна сразу после сохранения: {len(missed)}")
+        if args.no_session:
+            return 0
+        print("OK" if not missed else "НАРУШЕН READ-YOUR-WRITES")
+        return 0 if not missed else 1
+    finally:
+        db.execute_query("DELETE FROM Пользователи WHERE telegram_id = ANY(%s)", (ids,))
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Нагрузочная проверка Database.update_inventory на одновременных приходах.
+
+Запускать только на тестовой (локальной) БД — скрипт меняет остаток товара
+и в конце восстанавливает исходные значения:
+
+    python -m scripts.stress_inventory --item-id 1 --workers 32 --receipts 50
+
+Все потоки одновременно оприходуют один и тот же товар через пул соединений.
+После завершения сравнивается итоговый остаток и средневзвешенная цена
+с ожидаемыми значениями, посчитанными точно (Decimal).
+"""
+import argparse
+import random
+import sys
+import threading
+from decimal import Decimal
+
+from database import PooledDatabase
+
+
+def read_stock(db, item_id):
+    row = db.execute_query(
+        "SELECT количество_на_складе, середня_ціна_закупівлі FROM ОстаткиСклада WHERE номенклатура_id = %s",
+        (item_id,),
+        fetch_one=True,
+    )
+    return (Decimal(row[0]), Decimal(row[1])) if row else None
+
+
+def last_movement_id(db):
+    return db.execute_query("SELECT COALESCE(max(id), 0) FROM ДвиженияСклада", fetch_one=True)[0]
+
+
+def restore_stock(db, item_id, initial, since_movement):
+    # Движения прогона удаляются вместе с восстановлением остатка: журнал и проекция совпадают
+    db.execute_query(
+        "DELETE FROM ДвиженияСклада WHERE номенклатура_id = %s AND id > %s",
+        (item_id, since_movement),
+    )
+    if initial is None:
+        db.execute_query("DELETE FROM ОстаткиСклада WHERE номенклатура_id = %s", (item_id,))
+    else:
+        db.execute_query(
+            "UPDATE ОстаткиСклада SET количество_на_складе = %s, середня_ціна_закупівлі = %s WHERE номенклатура_id = %s",
+            (initial[0], initial[1], item_id),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--item-id', type=int, required=True, help="id товара из Номенклатура")
+    parser.add_argument('--workers', type=int, default=32, help="число параллельных потоков")
+    parser.add_argument('--receipts', type=int, default=50, help="приходов на поток")
+    parser.add_argument('--tolerance', type=Decimal, default=Decimal('0.000001'),
+                        help="допустимое отклонение средней цены")
+    args = parser.parse_args()
+
+    db = PooledDatabase(min_size=args.workers, max_size=args.workers).open()
+    initial = read_stock(db, args.item_id)
+    since_movement = last_movement_id(db)
+
+    # Заранее готовим приходы, чтобы знать точный ожидаемый результат
+    rng = random.Random(42)
+    batches = [
+        [(Decimal(rng.randint(1, 500)) / 10, Decimal(rng.randint(100, 99999)) / 100) for _ in range(args.receipts)]
+        for _ in range(args.workers)
+    ]
+    failures = []
+    start = threading.Barrier(args.workers)
+
+    def worker(batch):
+        start.wait()
+        for quantity, price in batch:
+            if not db.update_inventory(args.item_id, quantity, price):
+                failures.append((quantity, price))
+
+    threads = [threading.Thread(target=worker, args=(batch,)) for batch in batches]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        qty0, avg0 = initial or (Decimal(0), Decimal(0))
+        lines = [line for batch in batches for line in batch]
+        expected_qty = qty0 + sum(q for q, _ in lines)
+        expected_avg = (qty0 * avg0 + sum(q * p for q, p in lines)) / expected_qty
+        actual_qty, actual_avg = read_stock(db, args.item_id)
+
+        print(f"Приходов: {len(lines)}, ошибок записи: {len(failures)}")
+        print(f"Остаток:  ожидалось {expected_qty}, получено {actual_qty}")
+        print(f"Средняя:  ожидалось {expected_avg:.6f}, получено {actual_avg:.6f}")
+
+        ok = not failures and actual_qty == expected_qty and abs(actual_avg - expected_avg) <= args.tolerance
+        print("OK" if ok else "РАСХОЖДЕНИЕ")
+        return 0 if ok else 1
+    finally:
+        restore_stock(db, args.item_id, initial, since_movement)
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
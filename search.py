@@ -0,0 +1,146 @@
+import re
+from array import array
+from bisect import bisect_left
+
+# Символы, которые пользователи путают при наборе: украинские буквы, ё,
+# и латиница, совпадающая по виду с кириллицей (раскладка, копирование из накладных)
+_TRANSLATE = str.maketrans({
+    'ё': 'е', 'є': 'е', 'ї': 'і', 'ґ': 'г', 'й': 'и',
+    'a': 'а', 'c': 'с', 'e': 'е', 'o': 'о', 'p': 'р', 'x': 'х', 'y': 'у',
+    'i': 'і', 'k': 'к', 'm': 'м', 't': 'т', 'h': 'н', 'b': 'в',
+})
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Приведение названия к виду для поиска: регистр, похожие буквы, пунктуация."""
+    text = _NON_WORD.sub(' ', text.casefold().translate(_TRANSLATE))
+    return ' '.join(text.split())
+
+
+def trigrams(text):
+    """Триграммы нормализованной строки (с пробелом в начале, чтобы учитывать начало слов)."""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ItemSearchIndex:
+    """Индекс поиска товаров одного поставщика по части названия.
+
+    - префикс названия — бинарный поиск по отсортированным нормализованным названиям;
+    - подстрока (или начала нескольких слов) — берётся самый редкий триграмм запроса,
+      кандидаты из его списка проверяются на вхождение;
+    - опечатки — если точных вхождений мало, кандидаты ранжируются по числу общих триграмм.
+
+    items — последовательность (id, название, цена); search возвращает те же кортежи.
+    """
+
+    # Ограничения перебора, чтобы время ответа не зависело от размера каталога
+    FUZZY_CANDIDATES = 300
+    SUBSTRING_OVERSCAN = 10
+
+    def __init__(self, items):
+        self.items = list(items)
+        self._names = [normalize(item[1]) for item in self.items]
+
+        # Отсортированные названия для префиксного поиска
+        self._sorted = sorted(range(len(self._names)), key=self._names.__getitem__)
+        self._sorted_names = [self._names[i] for i in self._sorted]
+
+        postings = {}
+        for position, name in enumerate(self._names):
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(position)
+        # array вместо list: в несколько раз меньше памяти на больших каталогах
+        self._postings = {gram: array('I', positions) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.items)
+
+    def search(self, text, limit=10):
+        """До limit лучших совпадений для введённого текста."""
+        query = normalize(text)
+        if not query:
+            return []
+
+        found = self._prefix(query, limit)
+        if len(found) < limit and len(query) >= 2:
+            seen = set(found)
+            found.extend(self._substring(query, limit - len(found), seen))
+        if len(found) < limit and len(query) >= 3:
+            seen = set(found)
+            found.extend(p for p in self._fuzzy(query, limit - len(found), seen))
+        return [self.items[position] for position in found[:limit]]
+
+    def _prefix(self, query, limit):
+        start = bisect_left(self._sorted_names, query)
+        found = []
+        for i in range(start, min(start + limit, len(self._sorted_names))):
+            if not self._sorted_names[i].startswith(query):
+                break
+            found.append(self._sorted[i])
+        return found
+
+    def _rarest(self, grams):
+        return sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+
+    def _substring(self, query, limit, seen):
+        # Триграммы самих слов запроса (без пробелов по краям: слово может быть серединой слова
+        # в названии); для двухбуквенных слов — триграмм начала слова
+        words = query.split()
+        word_grams = []
+        for word in words:
+            grams = {word[i:i + 3] for i in range(len(word) - 2)} or ({f" {word}"} if len(word) == 2 else set())
+            if grams:
+                word_grams.append(grams)
+        if not word_grams:
+            return []
+
+        if len(words) == 1:
+            candidates = self._rarest(word_grams[0])[0]
+
+            def matches_query(name):
+                return query in name
+        else:
+            # Несколько слов: каждое должно быть началом какого-то слова названия.
+            # Кандидаты — пересечение самых редких списков каждого слова (set-операции в C)
+            postings = sorted((self._rarest(grams)[0] for grams in word_grams), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+                if not candidates:
+                    return []
+            word_starts = [f" {word}" for word in words]
+
+            def matches_query(name):
+                padded = f" {name}"
+                return all(word in padded for word in word_starts)
+
+        matches = []
+        for p in candidates:
+            if p not in seen and matches_query(self._names[p]):
+                matches.append(p)
+                if len(matches) >= limit * self.SUBSTRING_OVERSCAN:
+                    break
+        # Сначала совпадения с начала слова, затем более короткие названия
+        matches.sort(key=lambda p: (f" {query}" not in f" {self._names[p]}", len(self._names[p])))
+        return matches[:limit]
+
+    def _fuzzy(self, query, limit, seen):
+        grams = trigrams(query)
+        candidates = set()
+        for posting in self._rarest(grams):
+            candidates.update(p for p in posting[:self.FUZZY_CANDIDATES - len(candidates)] if p not in seen)
+            if len(candidates) >= self.FUZZY_CANDIDATES:
+                break
+
+        # Совпадение — если общих триграмм хотя бы половина
+        threshold = max(2, len(grams) // 2)
+        scored = []
+        for p in candidates:
+            padded = f" {self._names[p]} "
+            score = sum(gram in padded for gram in grams)
+            if score >= threshold:
+                scored.append((-score, len(padded), p))
+        scored.sort()
+        return [p for _, _, p in scored[:limit]]
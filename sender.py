@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from aiogram import types
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageReplyMarkup, EditMessageText, SendMessage
+
+import metrics
+from config import (
+    SEND_CHAT_BURST,
+    SEND_CHAT_MAX_PENDING,
+    SEND_CHAT_RATE,
+    SEND_DRAIN_TIMEOUT,
+    SEND_GLOBAL_RATE,
+    SEND_MAX_RETRIES,
+)
+
+# Методы, результат которых хэндлеры не используют: их можно отправить позже
+DEFERRED_METHODS = (SendMessage, EditMessageText, EditMessageReplyMarkup, AnswerCallbackQuery)
+EDIT_METHODS = (EditMessageText, EditMessageReplyMarkup)
+
+# Сколько token bucket'ов чатов держать, прежде чем забывать давно молчавшие чаты
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Ограничение частоты: rate запросов в секунду с запасом burst на всплески."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def take(self):
+        """Берёт токен, если он есть (0), иначе возвращает, сколько секунд ждать."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds):
+        """Остановка выдачи токенов (ответ 429 с retry_after)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+def placeholder(method):
+    """Ответ хэндлеру на отложенный метод: True или сообщение-заглушка (message_id=0)."""
+    if isinstance(method, SendMessage):
+        return types.Message(
+            message_id=0,
+            date=datetime.now(),
+            chat=types.Chat(id=method.chat_id if isinstance(method.chat_id, int) else 0, type='private'),
+            text=method.text
+        )
+    return True
+
+
+class SendQueue(BaseRequestMiddleware):
+    """Очередь исходящих запросов к Bot API (middleware сессии бота).
+
+    Все запросы проходят через общий token bucket бота, запросы в чат — ещё и через
+    bucket этого чата; на 429 запрос повторяется после retry_after. Отправка
+    сообщений, правки и ответы на нажатия кнопок ставятся в очередь своего чата и
+    не ждут сети: хэндлер сразу получает заглушку, а порядок внутри чата
+    сохраняется. Ещё не отправленная правка того же сообщения заменяется новой.
+    Если очередь чата длиннее max_pending, хэндлер ждёт отправки своего запроса.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 max_retries=SEND_MAX_RETRIES, max_pending=SEND_CHAT_MAX_PENDING):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self._buckets = {}  # chat_id -> TokenBucket
+        self._queues = {}  # chat_id -> deque [метод, make_request, bot, future]
+        self._lanes = {}  # chat_id -> задача, разбирающая очередь
+        self._accepting = True
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if not self._accepting or not isinstance(method, DEFERRED_METHODS):
+            return await self._send(make_request, bot, method, chat_id)
+
+        # Ответы на нажатия кнопок не упорядочиваются с сообщениями: у каждого своя очередь
+        key = chat_id if chat_id is not None else id(method)
+        queue = self._queues.setdefault(key, deque())
+        if isinstance(method, EDIT_METHODS) and self._coalesce(queue, method):
+            return True
+        future = asyncio.get_running_loop().create_future()
+        queue.append([method, make_request, bot, future])
+        self._idle.clear()
+        if key not in self._lanes:
+            self._lanes[key] = asyncio.create_task(self._run_lane(key, chat_id))
+        if len(queue) > self.max_pending:
+            return await asyncio.shield(future)
+        return placeholder(method)
+
+    def _coalesce(self, queue, method):
+        """Замена ещё не отправленной правки того же сообщения. True — новая правка влита в старую.
+
+        В очереди остаётся не больше одной правки каждого сообщения.
+        """
+        if method.message_id is None:
+            return False
+        for entry in queue:
+            pending = entry[0]
+            if isinstance(pending, EDIT_METHODS) and pending.message_id == method.message_id:
+                break
+        else:
+            return False
+        if metrics.ENABLED:
+            metrics.SEND_COALESCED.inc(type(pending).__name__)
+        if isinstance(method, EditMessageReplyMarkup) and isinstance(pending, EditMessageText):
+            # Текст из старой правки, клавиатура — из новой
+            entry[0] = pending.model_copy(update={'reply_markup': method.reply_markup})
+            return True
+        # Новая правка текста заменяет и текст, и клавиатуру старой
+        queue.remove(entry)
+        entry[3].set_result(True)
+        return False
+
+    async def _run_lane(self, key, chat_id):
+        queue = self._queues[key]
+        try:
+            while queue:
+                method, make_request, bot, future = queue.popleft()
+                try:
+                    result = await self._send(make_request, bot, method, chat_id)
+                    if not future.done():
+                        future.set_result(result)
+                except Exception as e:
+                    logging.error("Ошибка отправки %s в чат %s: %s", type(method).__name__, chat_id, e)
+                    if not future.done():
+                        future.set_exception(e)
+                        # Ошибку уже записали в лог; хэндлер ждёт её только при переполненной очереди
+                        future.exception()
+        finally:
+            del self._lanes[key]
+            del self._queues[key]
+            if not self._lanes:
+                self._idle.set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_CHAT_BUCKETS:
+                self._prune_buckets()
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune_buckets(self):
+        """Удаление bucket'ов, которые успели наполниться: новый bucket чата будет таким же."""
+        now = time.monotonic()
+        for chat_id, bucket in list(self._buckets.items()):
+            full = bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst
+            if full and now >= bucket.paused_until and chat_id not in self._lanes:
+                del self._buckets[chat_id]
+
+    async def _send(self, make_request, bot, method, chat_id):
+        """Отправка с ожиданием токенов и повтором после 429."""
+        # Ответ на нажатие кнопки не считается сообщением в чат
+        bucket = None if chat_id is None or isinstance(method, AnswerCallbackQuery) else self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            await self.global_bucket.acquire()
+            if bucket is not None:
+                await bucket.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if metrics.ENABLED:
+                    metrics.SEND_RETRIES.inc(type(method).__name__)
+                if attempt > self.max_retries:
+                    raise
+                logging.warning("Telegram 429 для %s (чат %s): повтор через %s с", type(method).__name__, chat_id, e.retry_after)
+                (bucket or self.global_bucket).pause(e.retry_after)
+
+    async def drain(self, timeout=SEND_DRAIN_TIMEOUT):
+        """Прекращает откладывание и ждёт отправки уже поставленных запросов."""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pending = sum(len(queue) for queue in self._queues.values())
+            logging.warning("Не дождались отправки %s исходящих запросов, отменяем", pending)
+            for task in list(self._lanes.values()):
+                task.cancel()
+            await asyncio.gather(*self._lanes.values(), return_exceptions=True)
@@ -0,0 +1,488 @@
+import re
+from functools import lru_cache
+
+import psycopg2
+import psycopg2.extensions
+
+import metrics
+
+# Виды запросов: от вида зависит, фиксируется ли транзакция и что возвращается
+READ = 'read'  # SELECT: без фиксации, результат по fetch
+WRITE = 'write'  # INSERT/UPDATE/DELETE без RETURNING: фиксация, число строк
+RETURNING = 'returning'  # изменение с RETURNING (или WITH ... INSERT): фиксация, результат по fetch
+
+# Плейсхолдеры psycopg2: %(имя)s, %s и экранированный %%
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+class Statement:
+    """Запрос CRM, объявленный один раз: имя, вид, текст и форма результата.
+
+    sql пишется в обычном стиле psycopg2 (%s или %(имя)s). Для серверной
+    подготовки он один раз переводится в $1..$n; types — явные типы
+    параметров там, где Postgres не может вывести их из запроса
+    ({имя: тип} для именованных, кортеж для позиционных).
+    fetch: 'one' — строка, 'all' — список строк, 'value' — первое поле первой строки.
+    replica=True — чтение можно выполнять на реплике (replicas.ReplicaSet).
+    """
+
+    def __init__(self, name, kind, sql, fetch=None, types=None, replica=False):
+        if replica and kind != READ:
+            raise ValueError(f"Запрос {name} изменяет данные и не может выполняться на реплике")
+        self.name = name
+        self.kind = kind
+        self.replica = replica
+        self.sql = sql
+        self.fetch = fetch
+        self.commit = kind != READ
+        self.prepare_sql, self.arg_names = self._compile(sql, types)
+        self.execute_sql = f"EXECUTE {name}" + (
+            " (" + ", ".join(["%s"] * len(self.arg_names)) + ")" if self.arg_names else ""
+        )
+
+    def _compile(self, sql, types):
+        arg_names = []
+        positions = {}
+
+        def replace(match):
+            if match.group(0) == '%%':
+                return '%'
+            name = match.group(1)
+            if name is None:
+                arg_names.append(len(arg_names))
+                return f"${len(arg_names)}"
+            if name not in positions:
+                arg_names.append(name)
+                positions[name] = len(arg_names)
+            return f"${positions[name]}"
+
+        body = _PLACEHOLDER.sub(replace, sql)
+        header = f"PREPARE {self.name}"
+        if types and arg_names:
+            if isinstance(types, dict):
+                declared = [types.get(name, 'unknown') for name in arg_names]
+            else:
+                declared = list(types)
+            header += " (" + ", ".join(declared) + ")"
+        return f"{header} AS {body}", arg_names
+
+    def args(self, params):
+        """Параметры в порядке $1..$n."""
+        if params is None:
+            return ()
+        if isinstance(params, dict):
+            return tuple(params[name] for name in self.arg_names)
+        return tuple(params)
+
+    def result(self, cur):
+        """Результат выполненного запроса по виду и fetch."""
+        if self.kind == WRITE:
+            return cur.rowcount
+        if self.fetch == 'one':
+            return cur.fetchone()
+        if self.fetch == 'all':
+            return cur.fetchall()
+        if self.fetch == 'value':
+            row = cur.fetchone()
+            return row[0] if row else None
+        return cur.rowcount if self.commit else None
+
+
+STATEMENTS = {}
+
+
+def statement(name, kind, sql, fetch=None, types=None, replica=False):
+    """Регистрация запроса в реестре; повторное объявление имени — ошибка."""
+    if name in STATEMENTS:
+        raise ValueError(f"Запрос {name} уже объявлен")
+    STATEMENTS[name] = Statement(name, kind, sql, fetch, types, replica)
+    return STATEMENTS[name]
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор, считающий обращения к серверу (метрика crm_db_round_trips_total).
+
+    execute_values и пакетные вставки считаются по числу отправленных запросов.
+    """
+
+    def execute(self, query, vars=None):
+        if metrics.ENABLED:
+            metrics.DB_ROUND_TRIPS.inc('execute')
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        if metrics.ENABLED:
+            metrics.DB_ROUND_TRIPS.inc('execute', len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        if metrics.ENABLED:
+            metrics.DB_ROUND_TRIPS.inc('copy')
+        return super().copy_expert(sql, file, size)
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Соединение, помнящее, какие запросы реестра уже подготовлены на сервере.
+
+    Подготовленный запрос живёт столько же, сколько серверная сессия, поэтому
+    набор имён хранится на самом соединении: новое соединение пула начинает с пустого.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = CountingCursor
+
+
+@lru_cache(maxsize=256)
+def classify(query):
+    """Вид произвольного запроса execute_query по первому слову (разбирается один раз на текст)."""
+    head = query.lstrip()[:6].upper()
+    if head in ('INSERT', 'UPDATE', 'DELETE'):
+        return RETURNING if head == 'INSERT' and re.search(r"\bRETURNING\b", query, re.IGNORECASE) else WRITE
+    return READ
+
+
+# ------------------------------------------------------------------
+# --- Запросы CRM ---
+
+# Оприходование одним запросом: INSERT ... ON CONFLICT берёт блокировку строки
+# остатка, поэтому одновременные приходы одного товара не теряют друг друга
+# и не создают дубликатов. Средневзвешенная цена считается от актуальной строки.
+# Если остаток был нулевым или отрицательным (или приход его не перекрыл),
+# средней становится цена прихода — как в valuation.ItemValuation, проекцией
+# журнала движений которого является ОстаткиСклада.
+UPSERT_INVENTORY = """
+INSERT INTO ОстаткиСклада AS o (номенклатура_id, количество_на_складе, середня_ціна_закупівлі)
+VALUES {values}
+ON CONFLICT (номенклатура_id) DO UPDATE
+SET количество_на_складе = o.количество_на_складе + EXCLUDED.количество_на_складе,
+    середня_ціна_закупівлі = CASE
+        WHEN o.количество_на_складе > 0 AND o.количество_на_складе + EXCLUDED.количество_на_складе > 0
+        THEN ((o.середня_ціна_закупівлі * o.количество_на_складе)
+              + (EXCLUDED.середня_ціна_закупівлі * EXCLUDED.количество_на_складе))
+             / (o.количество_на_складе + EXCLUDED.количество_на_складе)
+        ELSE EXCLUDED.середня_ціна_закупівлі
+    END
+RETURNING o.количество_на_складе
+"""
+
+# Типы параметров записи строки прихода: часть из них стоит только в списке SELECT
+SAVE_LINE_TYPES = {
+    'receipt_id': 'bigint',
+    'supplier_id': 'bigint',
+    'user_id': 'bigint',
+    'item_id': 'bigint',
+    'quantity': 'numeric',
+    'price': 'numeric',
+    'line_total': 'numeric',
+}
+
+# Баланс поставщика = свёрнутая часть (БалансыПоставщиков) + хвост журнала после неё.
+# Хвост короткий: его регулярно сворачивает Database.ledger_compact
+SUPPLIER_BALANCE = """
+COALESCE((SELECT начислено - оплачено FROM БалансыПоставщиков WHERE поставщик_id = %(supplier_id)s), 0)
++ COALESCE((SELECT sum(j.сумма) FROM ЖурналРасчётов j
+            WHERE j.поставщик_id = %(supplier_id)s
+              AND j.id > COALESCE((SELECT до_записи FROM БалансыПоставщиков
+                                   WHERE поставщик_id = %(supplier_id)s), 0)), 0)
+"""
+
+_SAVE_LINE_STOCK_CTE = "stock AS (" + UPSERT_INVENTORY.format(
+    values='(%(item_id)s, %(quantity)s, %(price)s)'
+) + ")"
+
+# Каждое изменение остатка записывается и в журнал движений склада
+# (ОстаткиСклада — его проекция, см. Database.ensure_stock_schema)
+RECEIPT_MOVEMENT = """
+INSERT INTO ДвиженияСклада (номенклатура_id, вид, количество, цена, приход_id, пользователь_id)
+{values}
+"""
+
+# Роли и справочники — основной объём чтений, они выполняются на репликах (если настроены)
+statement('get_user_role', READ, "SELECT роль, имя FROM Пользователи WHERE telegram_id = %s", fetch='one',
+          replica=True)
+
+statement('add_new_user', WRITE, """
+INSERT INTO Пользователи (telegram_id, роль, имя, код_менеджера)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (telegram_id) DO NOTHING
+""")
+
+statement('update_user_role', WRITE, "UPDATE Пользователи SET роль = %s WHERE telegram_id = %s")
+
+statement('get_suppliers', READ, "SELECT id, название FROM Поставщики ORDER BY название", fetch='all',
+          replica=True)
+
+statement('get_items_by_supplier', READ, """
+SELECT id, название_товара, текущая_цена_закупки
+FROM Номенклатура
+WHERE поставщик_id = %s
+ORDER BY название_товара
+""", fetch='all', replica=True)
+
+statement('get_all_items', READ, """
+SELECT id, название_товара, текущая_цена_закупки, поставщик_id
+FROM Номенклатура
+ORDER BY поставщик_id, название_товара
+""", fetch='all', replica=True)
+
+statement('create_new_receipt', RETURNING, """
+INSERT INTO Приходы (поставщик_id, завсклада_id)
+VALUES (%s, %s)
+RETURNING id
+""", fetch='value')
+
+statement('add_receipt_line', WRITE, """
+INSERT INTO СтрокиПрихода (приход_id, номенклатура_id, количество, цена_закупки)
+VALUES (%s, %s, %s, %s)
+""")
+
+statement('update_inventory', RETURNING, "WITH movement AS (" + RECEIPT_MOVEMENT.format(
+    values="VALUES (%(item_id)s, 'приход', %(quantity)s, %(price)s, NULL, NULL)"
+) + ")\n" + UPSERT_INVENTORY.format(values='(%(item_id)s, %(quantity)s, %(price)s)'), fetch='value')
+
+statement('register_initial_debt', WRITE, """
+INSERT INTO ЗадолженностиПоставщикам (приход_id, сумма_задолженности, сумма_оплачено, статус)
+VALUES (%s, 0, 0, 'не оплачено')
+""")
+
+statement('update_debt_amount', WRITE, """
+UPDATE ЗадолженностиПоставщикам
+SET сумма_задолженности = сумма_задолженности + %s
+WHERE приход_id = %s
+""")
+
+# Первая строка прихода: создаёт заголовок и запись задолженности
+statement('save_receipt_line_new', RETURNING, f"""
+WITH new_receipt AS (
+    INSERT INTO Приходы (поставщик_id, завсклада_id)
+    VALUES (%(supplier_id)s, %(user_id)s)
+    RETURNING id
+),
+new_line AS (
+    INSERT INTO СтрокиПрихода (приход_id, номенклатура_id, количество, цена_закупки)
+    SELECT id, %(item_id)s, %(quantity)s, %(price)s FROM new_receipt
+),
+debt AS (
+    INSERT INTO ЖурналРасчётов (поставщик_id, приход_id, вид, сумма, пользователь_id)
+    SELECT %(supplier_id)s, id, 'приход', %(line_total)s, %(user_id)s FROM new_receipt
+),
+movement AS ({RECEIPT_MOVEMENT.format(
+    values="SELECT %(item_id)s, 'приход', %(quantity)s, %(price)s, id, %(user_id)s FROM new_receipt"
+)}),
+{_SAVE_LINE_STOCK_CTE}
+SELECT (SELECT id FROM new_receipt),
+       (SELECT количество_на_складе FROM stock),
+       {SUPPLIER_BALANCE} + %(line_total)s
+""", fetch='one', types=SAVE_LINE_TYPES)
+
+# Следующие строки: приход уже есть, долг дописывается в журнал
+statement('save_receipt_line', RETURNING, f"""
+WITH new_line AS (
+    INSERT INTO СтрокиПрихода (приход_id, номенклатура_id, количество, цена_закупки)
+    VALUES (%(receipt_id)s, %(item_id)s, %(quantity)s, %(price)s)
+),
+debt AS (
+    INSERT INTO ЖурналРасчётов (поставщик_id, приход_id, вид, сумма, пользователь_id)
+    VALUES (%(supplier_id)s, %(receipt_id)s, 'приход', %(line_total)s, %(user_id)s)
+),
+movement AS ({RECEIPT_MOVEMENT.format(
+    values="VALUES (%(item_id)s, 'приход', %(quantity)s, %(price)s, %(receipt_id)s, %(user_id)s)"
+)}),
+{_SAVE_LINE_STOCK_CTE}
+SELECT %(receipt_id)s,
+       (SELECT количество_на_складе FROM stock),
+       {SUPPLIER_BALANCE} + %(line_total)s
+""", fetch='one', types=SAVE_LINE_TYPES)
+
+statement('fsm_load', READ, "SELECT состояние, данные FROM СессииFSM WHERE ключ = %s", fetch='one')
+
+statement('fsm_delete_expired', WRITE, "DELETE FROM СессииFSM WHERE обновлено < now() - make_interval(secs => %s)")
+
+# Ключ уже был — 0 строк: нажатие с этим токеном уже обработано
+statement('claim_idempotency_key', WRITE, """
+INSERT INTO КлючиИдемпотентности (ключ) VALUES (%s)
+ON CONFLICT (ключ) DO NOTHING
+""")
+
+statement('idempotency_delete_expired', WRITE, """
+DELETE FROM КлючиИдемпотентности WHERE создано < now() - make_interval(secs => %s)
+""")
+
+# ------------------------------------------------------------------
+# --- Журнал расчётов с поставщиками ---
+
+# Границы корзин старения долга, дней
+AGING_BUCKETS = (30, 60, 90)
+
+statement('supplier_balance', READ, "SELECT " + SUPPLIER_BALANCE, fetch='value', types={'supplier_id': 'bigint'})
+
+statement('supplier_balances', READ, """
+SELECT p.id, p.название,
+       COALESCE(b.начислено - b.оплачено, 0) + COALESCE(t.сумма, 0) AS баланс
+FROM Поставщики p
+LEFT JOIN БалансыПоставщиков b ON b.поставщик_id = p.id
+LEFT JOIN LATERAL (
+    SELECT sum(j.сумма) AS сумма FROM ЖурналРасчётов j
+    WHERE j.поставщик_id = p.id AND j.id > COALESCE(b.до_записи, 0)
+) t ON true
+WHERE COALESCE(b.начислено - b.оплачено, 0) + COALESCE(t.сумма, 0) <> 0
+ORDER BY баланс DESC
+""", fetch='all')
+
+# Оплаты гасят самые старые начисления (FIFO), поэтому непогашенными
+# остаются последние начисления на сумму текущего баланса
+statement('supplier_aging', READ, f"""
+WITH balance AS (
+    SELECT {SUPPLIER_BALANCE} AS сумма
+),
+debits AS (
+    SELECT сумма, создано, sum(сумма) OVER (ORDER BY id DESC) AS накоплено
+    FROM ЖурналРасчётов
+    WHERE поставщик_id = %(supplier_id)s AND сумма > 0
+)
+SELECT CASE
+           WHEN d.создано > now() - interval '{AGING_BUCKETS[0]} days' THEN 0
+           WHEN d.создано > now() - interval '{AGING_BUCKETS[1]} days' THEN 1
+           WHEN d.создано > now() - interval '{AGING_BUCKETS[2]} days' THEN 2
+           ELSE 3
+       END AS корзина,
+       sum(LEAST(d.сумма, b.сумма - (d.накоплено - d.сумма)))
+FROM debits d, balance b
+WHERE d.накоплено - d.сумма < b.сумма
+GROUP BY 1
+ORDER BY 1
+""", fetch='all', types={'supplier_id': 'bigint'})
+
+statement('record_payment', RETURNING, f"""
+WITH entry AS (
+    INSERT INTO ЖурналРасчётов (поставщик_id, вид, сумма, пользователь_id, комментарий)
+    VALUES (%(supplier_id)s, 'оплата', -%(amount)s, %(user_id)s, %(comment)s)
+    RETURNING id
+)
+SELECT (SELECT id FROM entry), {SUPPLIER_BALANCE} - %(amount)s
+""", fetch='one', types={'supplier_id': 'bigint', 'amount': 'numeric', 'user_id': 'bigint', 'comment': 'text'})
+
+# ------------------------------------------------------------------
+# --- Заказы и резервирование ---
+
+statement('available_to_promise', READ, """
+SELECT номенклатура_id, количество_на_складе - зарезервировано
+FROM ОстаткиСклада
+WHERE номенклатура_id = ANY(%s)
+""", fetch='all', types=('bigint[]',))
+
+statement('pending_orders', READ, """
+SELECT z.id, COALESCE(u.имя, z.менеджер_id::text), z.создано,
+       (SELECT json_agg(json_build_array(s.номенклатура_id, s.количество) ORDER BY s.номенклатура_id)
+        FROM СтрокиЗаказа s WHERE s.заказ_id = z.id)
+FROM Заказы z
+LEFT JOIN Пользователи u ON u.telegram_id = z.менеджер_id
+WHERE z.статус = 'ожидает'
+ORDER BY z.создано
+LIMIT %s
+""", fetch='all')
+
+statement('expired_orders', READ, """
+SELECT id FROM Заказы
+WHERE статус = 'ожидает' AND создано < now() - make_interval(secs => %s)
+ORDER BY id
+""", fetch='all')
+
+# ------------------------------------------------------------------
+# --- Отчёты ---
+
+statement('report_stock_value', READ, """
+SELECT p.название, count(*), sum(o.количество_на_складе),
+       sum(o.количество_на_складе * o.середня_ціна_закупівлі) AS сумма
+FROM ОстаткиСклада o
+JOIN Номенклатура n ON n.id = o.номенклатура_id
+JOIN Поставщики p ON p.id = n.поставщик_id
+WHERE o.количество_на_складе <> 0
+GROUP BY p.название
+ORDER BY сумма DESC
+""", fetch='all')
+
+# Из агрегата ОтчетПриходы: год — это не больше 366 строк на поставщика
+statement('report_receipts', READ, """
+SELECT p.название, sum(r.строк), sum(r.количество), sum(r.сумма) AS сумма
+FROM ОтчетПриходы r
+JOIN Поставщики p ON p.id = r.поставщик_id
+WHERE r.день >= %(date_from)s AND r.день < %(date_to)s
+GROUP BY p.название
+ORDER BY сумма DESC
+""", fetch='all', types={'date_from': 'date', 'date_to': 'date'})
+
+# Давность долга всех поставщиков (та же логика FIFO, что в supplier_aging)
+REPORT_DEBT_AGING = f"""
+WITH balances AS (
+    SELECT p.id, p.название,
+           COALESCE(b.начислено - b.оплачено, 0) + COALESCE(t.сумма, 0) AS баланс
+    FROM Поставщики p
+    LEFT JOIN БалансыПоставщиков b ON b.поставщик_id = p.id
+    LEFT JOIN LATERAL (
+        SELECT sum(j.сумма) AS сумма FROM ЖурналРасчётов j
+        WHERE j.поставщик_id = p.id AND j.id > COALESCE(b.до_записи, 0)
+    ) t ON true
+),
+debits AS (
+    SELECT j.поставщик_id, j.сумма, j.создано,
+           sum(j.сумма) OVER (PARTITION BY j.поставщик_id ORDER BY j.id DESC) AS накоплено
+    FROM ЖурналРасчётов j
+    JOIN balances b ON b.id = j.поставщик_id AND b.баланс > 0
+    WHERE j.сумма > 0
+),
+open_debits AS (
+    SELECT d.поставщик_id, d.создано, LEAST(d.сумма, b.баланс - (d.накоплено - d.сумма)) AS сумма
+    FROM debits d
+    JOIN balances b ON b.id = d.поставщик_id
+    WHERE d.накоплено - d.сумма < b.баланс
+)
+SELECT b.название AS "Постачальник", b.баланс AS "Борг",
+       COALESCE(sum(o.сумма) FILTER (WHERE o.создано > now() - interval '{AGING_BUCKETS[0]} days'), 0)
+           AS "до {AGING_BUCKETS[0]} дн.",
+       COALESCE(sum(o.сумма) FILTER (WHERE o.создано <= now() - interval '{AGING_BUCKETS[0]} days'
+                                       AND o.создано > now() - interval '{AGING_BUCKETS[1]} days'), 0)
+           AS "{AGING_BUCKETS[0] + 1}-{AGING_BUCKETS[1]} дн.",
+       COALESCE(sum(o.сумма) FILTER (WHERE o.создано <= now() - interval '{AGING_BUCKETS[1]} days'
+                                       AND o.создано > now() - interval '{AGING_BUCKETS[2]} days'), 0)
+           AS "{AGING_BUCKETS[1] + 1}-{AGING_BUCKETS[2]} дн.",
+       COALESCE(sum(o.сумма) FILTER (WHERE o.создано <= now() - interval '{AGING_BUCKETS[2]} days'), 0)
+           AS "понад {AGING_BUCKETS[2]} дн."
+FROM balances b
+LEFT JOIN open_debits o ON o.поставщик_id = b.id
+WHERE b.баланс <> 0
+GROUP BY b.id, b.название, b.баланс
+ORDER BY b.баланс DESC
+"""
+
+statement('report_debt_aging', READ, REPORT_DEBT_AGING, fetch='all')
+
+# ------------------------------------------------------------------
+# --- Журнал движений склада и оценка остатков (valuation.py) ---
+
+# Последнее движение склада — версия данных для кеша аналитики (analytics.py)
+statement('stock_journal_head', READ, "SELECT COALESCE(max(id), 0) FROM ДвиженияСклада", fetch='value')
+
+# Состояние товара на момент: последний снимок не позже момента и хвост
+# движений после него (по индексу (номенклатура_id, id)) — [[количество, цена], ...]
+statement('stock_as_of', READ, """
+SELECT n.id, s.количество, s.средняя_цена, s.слои_fifo,
+       (SELECT array_agg(ARRAY[m.количество, m.цена] ORDER BY m.id)
+        FROM ДвиженияСклада m
+        WHERE m.номенклатура_id = n.id
+          AND m.id > COALESCE(s.до_движения, 0)
+          AND m.создано <= %(moment)s) AS хвост
+FROM Номенклатура n
+LEFT JOIN LATERAL (
+    SELECT до_движения, количество, средняя_цена, слои_fifo
+    FROM СнимкиОстатков
+    WHERE номенклатура_id = n.id AND на_момент <= %(moment)s
+    ORDER BY до_движения DESC
+    LIMIT 1
+) s ON true
+WHERE %(item_ids)s::integer[] IS NULL OR n.id = ANY(%(item_ids)s::integer[])
+ORDER BY n.id
+""", fetch='all', types={'moment': 'timestamptz', 'item_ids': 'integer[]'})
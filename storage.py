@@ -0,0 +1,125 @@
+import asyncio
+import copy
+import logging
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+from cache import MISSING, TTLCache
+
+
+class PostgresStorage(BaseStorage):
+    """Хранилище FSM в таблице СессииFSM той же БД.
+
+    - Состояния переживают перезапуск и доступны нескольким процессам бота.
+    - Чтение идёт через in-memory слой по ключу чата: к БД обращаемся только
+      при первом обращении к сессии в этом процессе.
+    - Запись отложенная: изменения копятся и сбрасываются пачкой раз в
+      flush_interval секунд (и при остановке), а не на каждый set_state/set_data.
+    - Сессии, которые не менялись дольше ttl секунд, удаляются.
+
+    Кеш сессий предполагает, что один чат обслуживается одним процессом
+    (маршрутизация по chat_id), иначе процессы могут видеть устаревшие данные.
+    """
+
+    def __init__(self, db, flush_interval=0.5, ttl=86400, cache_size=10000, expire_interval=600):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.expire_interval = expire_interval
+        # ключ -> [состояние, данные]
+        self._sessions = TTLCache(maxsize=cache_size, ttl=ttl)
+        self._dirty: Dict[str, list] = {}
+        self._tasks = []
+        self._flush_lock = asyncio.Lock()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [key.bot_id, key.chat_id, key.user_id, key.thread_id or '', key.destiny]
+        business_connection_id = getattr(key, 'business_connection_id', None)
+        if business_connection_id:
+            parts.append(business_connection_id)
+        return ':'.join(str(part) for part in parts)
+
+    async def start(self):
+        """Запуск фоновых задач: сброс изменений и удаление просроченных сессий."""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._flush_loop()),
+                asyncio.create_task(self._expire_loop()),
+            ]
+
+    async def _session(self, key: str) -> list:
+        """Сессия из кеша, при промахе — чтение из БД."""
+        session = self._sessions.get(key)
+        if session is MISSING:
+            row = await self.db.fsm_load(key)
+            session = [row[0], row[1] or {}] if row else [None, {}]
+            self._sessions.set(key, session)
+        return session
+
+    def _mark_dirty(self, key: str, session: list):
+        self._sessions.set(key, session)
+        self._dirty[key] = session
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        key = self._key(key)
+        session = await self._session(key)
+        session[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, session)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._session(self._key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = self._key(key)
+        session = await self._session(key)
+        session[1] = copy.deepcopy(data)
+        self._mark_dirty(key, session)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._session(self._key(key)))[1])
+
+    async def flush(self):
+        """Запись накопленных изменений одной пачкой."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            rows = [(key, state, data) for key, (state, data) in dirty.items()]
+            saved = False
+            try:
+                saved = await self.db.fsm_save_batch(rows)
+            finally:
+                if not saved:
+                    # Не удалось записать (в том числе из-за исключения) — вернём изменения
+                    # в очередь (новые версии приоритетнее)
+                    for key, session in dirty.items():
+                        self._dirty.setdefault(key, session)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Ошибка записи состояний FSM")
+
+    async def _expire_loop(self):
+        while True:
+            try:
+                removed = await self.db.fsm_delete_expired(self.ttl)
+                if removed:
+                    logging.info("Удалено просроченных сессий FSM: %s", removed)
+            except Exception:
+                logging.exception("Ошибка удаления просроченных сессий FSM")
+            await asyncio.sleep(self.expire_interval)
+
+    async def close(self) -> None:
+        """Остановка фоновых задач и финальный сброс изменений."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
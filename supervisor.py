@@ -0,0 +1,453 @@
+"""Многопроцессный режим бота (BOT_MODE=sharded).
+
+Супервизор принимает обновления Telegram (webhook при заданном WEBHOOK_URL,
+иначе long polling) и передаёт каждое одному из SHARD_WORKERS воркеров по
+hash(chat_id) % SHARD_WORKERS. Воркер — обычный bot.py в режиме webhook на
+127.0.0.1:SHARD_BASE_PORT+i со своим пулом соединений БД. Все обновления чата
+попадают в один воркер и передаются ему по порядку, поэтому шаги FSM
+пользователя выполняются так же последовательно, как в одном процессе.
+
+Сводное здоровье и метрики воркеров (с меткой worker) — на
+METRICS_HOST:METRICS_PORT: /health и /metrics.
+SIGHUP — поочерёдный перезапуск воркеров: обновления шарда на время перезапуска
+копятся в супервизоре, воркер дорабатывает принятые обновления и сбрасывает
+FSM в Postgres, новый воркер продолжает начатые приходы с того же шага.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from collections import deque
+
+import aiohttp
+from aiohttp import web
+
+from config import (
+    BACKGROUND_JOBS,
+    FSM_STORAGE,
+    METRICS_ENABLED,
+    METRICS_HOST,
+    METRICS_PORT,
+    SEND_GLOBAL_RATE,
+    SHARD_BASE_PORT,
+    SHARD_MAX_QUEUE,
+    SHARD_START_TIMEOUT,
+    SHARD_STOP_TIMEOUT,
+    SHARD_WORKERS,
+    WEBHOOK_DRAIN_TIMEOUT,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+
+# Пауза перед повторной передачей обновления занятому или перезапускаемому воркеру, сек
+FORWARD_RETRY_DELAY = 0.5
+POLL_TIMEOUT = 30
+
+
+def shard_key(raw):
+    """Ключ шарда по сырому обновлению — как webhook.chat_key: id чата, иначе id пользователя."""
+    for field, event in raw.items():
+        if field == 'update_id' or not isinstance(event, dict):
+            continue
+        chat = event.get('chat')
+        if chat is None and isinstance(event.get('message'), dict):
+            # CallbackQuery: чат сообщения с кнопкой
+            chat = event['message'].get('chat')
+        if chat is not None:
+            return chat['id']
+        user = event.get('from')
+        return user['id'] if user is not None else 0
+    return 0
+
+
+def label_metrics(text, worker):
+    """Метрики воркера с меткой worker="i": {семейство: (заголовки, строки значений)}."""
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if not line:
+            continue
+        if line.startswith('#'):
+            parts = line.split(maxsplit=3)
+            if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                current = parts[2]
+                headers, _ = families.setdefault(current, ([], []))
+                headers.append(line)
+            continue
+        name, _, rest = line.partition(' ')
+        if '{' in name:
+            name = name.replace('{', f'{{worker="{worker}",', 1)
+        else:
+            name = f'{name}{{worker="{worker}"}}'
+        families.setdefault(current or name, ([], []))[1].append(f"{name} {rest}")
+    return families
+
+
+class Worker:
+    """Процесс-воркер: bot.py в режиме webhook на локальном порту."""
+
+    def __init__(self, index, workers):
+        self.index = index
+        self.port = SHARD_BASE_PORT + index
+        self.metrics_port = METRICS_PORT + 1 + index
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = None
+        self.restarts = 0
+        self.env = dict(
+            os.environ,
+            BOT_MODE='webhook',
+            WORKER_ID=str(index),
+            WEBHOOK_HOST='127.0.0.1',
+            WEBHOOK_PORT=str(self.port),
+            WEBHOOK_URL='',
+            METRICS_PORT=str(self.metrics_port),
+            # Лимит Telegram на бота делится между воркерами
+            SEND_GLOBAL_RATE=str(SEND_GLOBAL_RATE / workers),
+            BACKGROUND_JOBS='true' if BACKGROUND_JOBS and index == 0 else 'false',
+        )
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self, session):
+        """Запуск процесса и ожидание готовности (GET /health)."""
+        # Своя группа процессов: Ctrl+C в терминале останавливает только супервизор,
+        # а воркеров он останавливает сам после передачи накопленных обновлений
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, BOT_SCRIPT, env=self.env, start_new_session=True
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SHARD_START_TIMEOUT
+        while loop.time() < deadline:
+            if not self.running:
+                raise RuntimeError(f"Воркер {self.index} завершился при запуске (код {self.process.returncode})")
+            if await self.health(session) is not None:
+                logging.info("Воркер %s готов (pid %s, порт %s)", self.index, self.process.pid, self.port)
+                return
+            await asyncio.sleep(0.5)
+        await self.stop()
+        raise RuntimeError(f"Воркер {self.index} не запустился за {SHARD_START_TIMEOUT} с")
+
+    async def health(self, session):
+        """Ответ /health воркера или None, если он не готов."""
+        try:
+            async with session.get(f"{self.url}/health", timeout=aiohttp.ClientTimeout(total=2)) as response:
+                return await response.json() if response.status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    async def stop(self):
+        """SIGTERM и ожидание плавной остановки (воркер дорабатывает принятые обновления)."""
+        if not self.running:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), SHARD_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("Воркер %s не остановился за %s с, завершаем принудительно", self.index, SHARD_STOP_TIMEOUT)
+            self.process.kill()
+            await self.process.wait()
+
+
+class Supervisor:
+    """Распределение обновлений по воркерам с сохранением порядка внутри шарда.
+
+    У каждого шарда своя очередь, которую по одному обновлению передаёт одна
+    задача; обновление удаляется из очереди только после ответа воркера 200.
+    Пока воркер перезапускается (по SIGHUP или после падения), передача в его
+    шард приостановлена, а обновления копятся в очереди.
+    """
+
+    def __init__(self, workers=SHARD_WORKERS, max_queue=SHARD_MAX_QUEUE):
+        self.workers = [Worker(index, workers) for index in range(workers)]
+        self.max_queue = max_queue
+        self._queues = [deque() for _ in self.workers]
+        self._wakeups = [asyncio.Event() for _ in self.workers]
+        self._ready = [asyncio.Event() for _ in self.workers]  # передача в шард разрешена
+        self._forwarding = [asyncio.Lock() for _ in self.workers]  # обновление в пути к воркеру
+        self._restarting = set()
+        self._tasks = []
+        self._accepting = True
+        self.session = None
+
+    def shard_of(self, raw):
+        return hash(shard_key(raw)) % len(self.workers)
+
+    def submit(self, raw) -> bool:
+        """Ставит сырое обновление в очередь шарда. False — приём остановлен или очередь переполнена."""
+        index = self.shard_of(raw)
+        if not self._accepting or len(self._queues[index]) >= self.max_queue:
+            return False
+        self._queues[index].append(raw)
+        self._wakeups[index].set()
+        return True
+
+    async def start(self):
+        """Запуск воркеров по очереди: первый применяет миграции и создаёт схемы модулей до остальных."""
+        self.session = aiohttp.ClientSession()
+        for worker in self.workers:
+            await worker.start(self.session)
+            self._ready[worker.index].set()
+        for worker in self.workers:
+            self._tasks.append(asyncio.create_task(self._forward_loop(worker)))
+            self._tasks.append(asyncio.create_task(self._watch(worker)))
+
+    async def _forward_loop(self, worker):
+        queue = self._queues[worker.index]
+        wakeup = self._wakeups[worker.index]
+        headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+        while True:
+            while not queue:
+                wakeup.clear()
+                await wakeup.wait()
+            await self._ready[worker.index].wait()
+            async with self._forwarding[worker.index]:
+                try:
+                    async with self.session.post(worker.url + WEBHOOK_PATH, json=queue[0], headers=headers) as response:
+                        status = response.status
+                except aiohttp.ClientError:
+                    status = None
+            if status is None or status == 503:
+                # Воркер занят (503) или недоступен: порядок важнее, повторяем то же обновление
+                await asyncio.sleep(FORWARD_RETRY_DELAY)
+                continue
+            if status != 200:
+                # Воркер отверг обновление (400 — не разобрано): повтор не поможет и остановил бы шард
+                logging.error("Воркер %s отклонил обновление %s (HTTP %s), пропускаем",
+                              worker.index, queue[0].get('update_id'), status)
+            queue.popleft()
+
+    async def _watch(self, worker):
+        """Перезапуск упавшего воркера; обновления его шарда ждут в очереди."""
+        while True:
+            process = worker.process
+            await process.wait()
+            if process is not worker.process or worker.index in self._restarting or not self._accepting:
+                # Плановый перезапуск или остановка супервизора
+                await asyncio.sleep(1)
+                continue
+            logging.error("Воркер %s завершился (код %s), перезапускаем", worker.index, worker.process.returncode)
+            self._ready[worker.index].clear()
+            await self._restart_process(worker)
+
+    async def _restart_process(self, worker):
+        while True:
+            try:
+                await worker.start(self.session)
+                break
+            except RuntimeError as e:
+                logging.error("%s; повтор через 5 с", e)
+                await asyncio.sleep(5)
+        worker.restarts += 1
+        self._ready[worker.index].set()
+
+    async def rolling_restart(self):
+        """Поочерёдный перезапуск воркеров без потери обновлений."""
+        for worker in self.workers:
+            if worker.index in self._restarting:
+                continue
+            self._restarting.add(worker.index)
+            try:
+                self._ready[worker.index].clear()
+                # Дожидаемся обновления, которое уже передаётся воркеру
+                async with self._forwarding[worker.index]:
+                    pass
+                logging.info("Перезапуск воркера %s, в очереди шарда %s обновлений",
+                             worker.index, len(self._queues[worker.index]))
+                await worker.stop()
+                await self._restart_process(worker)
+            finally:
+                self._restarting.discard(worker.index)
+
+    async def stop(self):
+        """Прекращает приём, передаёт воркерам накопленное и останавливает их."""
+        self._accepting = False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WEBHOOK_DRAIN_TIMEOUT
+        while any(self._queues) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        left = sum(len(queue) for queue in self._queues)
+        if left:
+            logging.warning("Не переданы воркерам %s обновлений", left)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        await self.session.close()
+
+    async def health(self):
+        """Сводное здоровье: состояние каждого воркера и длина очереди его шарда."""
+        reports = await asyncio.gather(*(worker.health(self.session) for worker in self.workers))
+        workers = [
+            {
+                'worker': worker.index,
+                'pid': worker.process.pid if worker.process else None,
+                'up': report is not None,
+                'queued': len(self._queues[worker.index]),
+                'restarts': worker.restarts,
+                'pending': report['pending'] if report else None,
+                'db': report.get('db') if report else None,
+            }
+            for worker, report in zip(self.workers, reports)
+        ]
+        # Деградация — воркер не отвечает или у него недоступна БД
+        healthy = all(item['up'] and (item['db'] or {}).get('state', 'closed') == 'closed' for item in workers)
+        return {'status': 'ok' if healthy else 'degraded', 'workers': workers}
+
+    async def metrics(self):
+        """Метрики всех воркеров с меткой worker и метрики самого супервизора."""
+        async def fetch(worker):
+            try:
+                url = f"http://{METRICS_HOST}:{worker.metrics_port}/metrics"
+                async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=2)) as response:
+                    return await response.text() if response.status == 200 else ''
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return ''
+
+        families = {}
+        texts = await asyncio.gather(*(fetch(worker) for worker in self.workers)) if METRICS_ENABLED else []
+        for worker, text in zip(self.workers, texts):
+            for name, (headers, samples) in label_metrics(text, worker.index).items():
+                merged = families.setdefault(name, ([], []))
+                if not merged[0]:
+                    merged[0].extend(headers)
+                merged[1].extend(samples)
+
+        lines = []
+        for headers, samples in families.values():
+            lines.extend(headers)
+            lines.extend(samples)
+        lines.append("# TYPE crm_shard_queued gauge")
+        lines.extend(f'crm_shard_queued{{worker="{w.index}"}} {len(self._queues[w.index])}' for w in self.workers)
+        lines.append("# TYPE crm_shard_worker_up gauge")
+        lines.extend(f'crm_shard_worker_up{{worker="{w.index}"}} {int(w.running)}' for w in self.workers)
+        lines.append("# TYPE crm_shard_worker_restarts gauge")
+        lines.extend(f'crm_shard_worker_restarts{{worker="{w.index}"}} {w.restarts}' for w in self.workers)
+        return '\n'.join(lines) + '\n'
+
+
+def create_status_app(supervisor: Supervisor) -> web.Application:
+    """Сводные /health и /metrics воркеров."""
+
+    async def handle_health(request: web.Request):
+        report = await supervisor.health()
+        return web.Response(
+            text=json.dumps(report, ensure_ascii=False, indent=2),
+            content_type='application/json',
+            status=200 if report['status'] == 'ok' else 503
+        )
+
+    async def handle_metrics(request: web.Request):
+        return web.Response(text=await supervisor.metrics(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/metrics', handle_metrics)
+    return app
+
+
+def create_ingress_app(supervisor: Supervisor) -> web.Application:
+    """Приём обновлений Telegram на WEBHOOK_PATH без разбора: только определение шарда."""
+
+    async def handle_update(request: web.Request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        try:
+            raw = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="bad update")
+        if not supervisor.submit(raw):
+            # Telegram повторит доставку позже
+            return web.Response(status=503, text="busy")
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    return app
+
+
+async def poll_updates(bot, supervisor: Supervisor, allowed_updates, stop: asyncio.Event):
+    """Long polling в супервизоре: смещение сдвигается только за принятые в очередь обновления."""
+    await bot.delete_webhook()
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.error("Ошибка getUpdates: %s", e)
+            await asyncio.sleep(5)
+            continue
+        for update in updates:
+            if not supervisor.submit(update.model_dump(mode='json', by_alias=True, exclude_unset=True)):
+                # Очередь шарда переполнена: получим это обновление ещё раз
+                await asyncio.sleep(FORWARD_RETRY_DELAY)
+                break
+            offset = update.update_id + 1
+
+
+async def run_supervisor(bot, allowed_updates):
+    """Запуск супервизора и воркеров до SIGINT/SIGTERM; SIGHUP — поочерёдный перезапуск воркеров."""
+    if FSM_STORAGE != 'postgres':
+        raise RuntimeError("Режим 'sharded' требует FSM_STORAGE=postgres: состояние FSM должно переживать перезапуск воркера")
+
+    supervisor = Supervisor()
+    await supervisor.start()
+
+    status_runner = web.AppRunner(create_status_app(supervisor))
+    await status_runner.setup()
+    await web.TCPSite(status_runner, METRICS_HOST, METRICS_PORT).start()
+    logging.info("Супервизор: %s воркеров, состояние на http://%s:%s/health",
+                 len(supervisor.workers), METRICS_HOST, METRICS_PORT)
+
+    stop = asyncio.Event()
+    restarts = set()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    def request_restart():
+        task = asyncio.create_task(supervisor.rolling_restart())
+        restarts.add(task)
+        task.add_done_callback(restarts.discard)
+
+    if hasattr(signal, 'SIGHUP'):
+        loop.add_signal_handler(signal.SIGHUP, request_restart)
+
+    ingress_runner = poller = None
+    if WEBHOOK_URL:
+        ingress_runner = web.AppRunner(create_ingress_app(supervisor))
+        await ingress_runner.setup()
+        ingress_site = web.TCPSite(ingress_runner, WEBHOOK_HOST, WEBHOOK_PORT)
+        await ingress_site.start()
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, allowed_updates=allowed_updates)
+        logging.info("Webhook супервизора слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    else:
+        poller = asyncio.create_task(poll_updates(bot, supervisor, allowed_updates, stop))
+
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Остановка супервизора")
+        if poller is not None:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        if ingress_runner is not None:
+            await ingress_site.stop()
+        for task in list(restarts):
+            task.cancel()
+        await asyncio.gather(*restarts, return_exceptions=True)
+        await supervisor.stop()
+        if ingress_runner is not None:
+            await ingress_runner.cleanup()
+        await status_runner.cleanup()
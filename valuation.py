@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from collections import deque
+from decimal import Decimal
+
+# Методы оценки остатка
+AVERAGE = 'average'  # средневзвешенная цена закупки
+FIFO = 'fifo'  # партии списываются в порядке поступления
+METHODS = (AVERAGE, FIFO)
+
+ZERO = Decimal(0)
+
+
+class ItemValuation:
+    """Остаток и себестоимость одного товара, пересчитываемые по движениям.
+
+    Движение — (количество, цена): приход с ценой меняет средневзвешенную
+    цену и добавляет партию FIFO; движение без цены (корректировка, отгрузка)
+    оценивается по текущей средней цене, расход списывает самые старые партии.
+    Если расход больше остатка, недостача покрывается следующими приходами.
+    Состояние сохраняется в снимок (to_snapshot) и восстанавливается из него,
+    поэтому пересчёт продолжается со снимка, а не с начала журнала.
+    """
+
+    def __init__(self, quantity=ZERO, average=ZERO, layers=()):
+        self.quantity = Decimal(quantity)
+        self.average = Decimal(average)
+        self.layers = deque([Decimal(q), Decimal(p)] for q, p in layers)
+
+    @classmethod
+    def from_snapshot(cls, quantity, average, layers):
+        if quantity is None:
+            return cls()
+        return cls(quantity, average, layers or ())
+
+    def to_snapshot(self):
+        """(количество, средняя цена, партии FIFO) для записи в СнимкиОстатков."""
+        return self.quantity, self.average, [[str(q), str(p)] for q, p in self.layers]
+
+    def apply(self, quantity, price=None):
+        quantity = Decimal(quantity)
+        if quantity > 0:
+            self._receive(quantity, self.average if price is None else Decimal(price), price is not None)
+        elif quantity < 0:
+            self._issue(-quantity)
+
+    def _receive(self, quantity, price, priced):
+        if priced:
+            total = self.quantity + quantity
+            if self.quantity > 0 and total > 0:
+                self.average = (self.average * self.quantity + price * quantity) / total
+            else:
+                self.average = price
+        # Сначала покрывается недостача (остаток ушёл в минус раньше прихода)
+        shortage = -self.quantity if self.quantity < 0 else ZERO
+        self.quantity += quantity
+        if quantity > shortage:
+            self.layers.append([quantity - shortage, price])
+
+    def _issue(self, quantity):
+        self.quantity -= quantity
+        while quantity > 0 and self.layers:
+            layer = self.layers[0]
+            if layer[0] > quantity:
+                layer[0] -= quantity
+                break
+            quantity -= layer[0]
+            self.layers.popleft()
+
+    def value(self, method=AVERAGE):
+        """Стоимость остатка по методу оценки (отрицательный остаток — по средней цене)."""
+        if method == FIFO and self.quantity >= 0:
+            return sum((q * p for q, p in self.layers), ZERO)
+        return self.quantity * self.average
+
+
+def replay(valuation, movements):
+    """Применяет хвост движений [(количество, цена), ...] к состоянию товара."""
+    for quantity, price in movements or ():
+        valuation.apply(quantity, price)
+    return valuation
+
+
+class StockSnapshotter:
+    """Фоновое создание снимков остатков по журналу движений склада.
+
+    Снимок фиксирует состояние товара (количество, средняя цена, партии FIFO)
+    на последнее учтённое движение. Остаток на любую дату считается от
+    ближайшего снимка до неё плюс короткий хвост движений после него.
+    """
+
+    def __init__(self, db, interval=3600):
+        self.db = db
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        """Запуск фонового создания снимков."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            try:
+                created = await self.db.snapshot_stock()
+                if created:
+                    logging.info("Созданы снимки остатков, товаров: %s", created)
+            except Exception:
+                logging.exception("Ошибка создания снимков остатков")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        """Остановка фоновой задачи."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
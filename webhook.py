@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import signal
+from collections import deque
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from config import (
+    WEBHOOK_DRAIN_TIMEOUT,
+    WEBHOOK_HOST,
+    WEBHOOK_MAX_CONCURRENCY,
+    WEBHOOK_MAX_QUEUE,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+
+
+def chat_key(update: Update):
+    """Ключ очереди для обновления: id чата (для событий без чата — id пользователя)."""
+    event = update.event
+    chat = getattr(event, 'chat', None)
+    if chat is None and getattr(event, 'message', None) is not None:
+        # CallbackQuery: чат сообщения с кнопкой
+        chat = getattr(event.message, 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    return user.id if user is not None else 0
+
+
+class ChatOrderedProcessor:
+    """Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    У каждого чата своя очередь, которую разбирает одна задача, поэтому шаги FSM
+    одного пользователя выполняются строго последовательно. Разные чаты
+    обрабатываются параллельно, но не более max_concurrency одновременно.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, max_concurrency=WEBHOOK_MAX_CONCURRENCY, max_queue=WEBHOOK_MAX_QUEUE):
+        self.dp = dp
+        self.bot = bot
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues = {}  # ключ чата -> deque обновлений
+        self._lanes = {}  # ключ чата -> задача, разбирающая очередь
+        self._pending = 0
+        self._accepting = True
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def pending(self):
+        """Число принятых, но ещё не обработанных обновлений."""
+        return self._pending
+
+    @property
+    def accepting(self):
+        """Принимаются ли новые обновления (False — идёт остановка)."""
+        return self._accepting
+
+    def submit(self, update: Update) -> bool:
+        """Ставит обновление в очередь его чата. False — приём остановлен или очередь переполнена."""
+        if not self._accepting or self._pending >= self.max_queue:
+            return False
+        key = chat_key(update)
+        self._queues.setdefault(key, deque()).append(update)
+        self._pending += 1
+        self._idle.clear()
+        if key not in self._lanes:
+            self._lanes[key] = asyncio.create_task(self._run_lane(key))
+        return True
+
+    async def _run_lane(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                update = queue.popleft()
+                try:
+                    async with self._semaphore:
+                        await self.dp.feed_update(self.bot, update)
+                except Exception:
+                    logging.exception("Ошибка обработки обновления %s", update.update_id)
+                finally:
+                    self._pending -= 1
+        finally:
+            del self._lanes[key]
+            del self._queues[key]
+            if not self._lanes:
+                self._idle.set()
+
+    async def drain(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Прекращает приём и ждёт обработки уже принятых обновлений."""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Не дождались обработки %s обновлений, отменяем", self._pending)
+            for task in list(self._lanes.values()):
+                task.cancel()
+            await asyncio.gather(*self._lanes.values(), return_exceptions=True)
+
+
+def create_app(dp: Dispatcher, bot: Bot, processor: ChatOrderedProcessor) -> web.Application:
+    """aiohttp-приложение, принимающее обновления Telegram на WEBHOOK_PATH."""
+
+    async def handle_update(request: web.Request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': bot})
+        except Exception:
+            return web.Response(status=400, text="bad update")
+        if not processor.submit(update):
+            # Telegram повторит доставку позже
+            return web.Response(status=503, text="busy")
+        return web.Response(text="ok")
+
+    async def handle_health(request: web.Request):
+        # Готовность к приёму (супервизор ждёт её после запуска воркера)
+        status = 200 if processor.accepting else 503
+        # Состояние БД — для наблюдения: с недоступной БД воркер принимает обновления и отвечает об ошибке
+        db = dp.get('db')
+        return web.json_response({
+            'pending': processor.pending,
+            'accepting': processor.accepting,
+            'db': db.sync.health() if db is not None else None,
+        }, status=status)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get('/health', handle_health)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Запуск бота в режиме webhook до SIGINT/SIGTERM с плавной остановкой."""
+    processor = ChatOrderedProcessor(dp, bot)
+    app = create_app(dp, bot, processor)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None,
+                              allowed_updates=dp.resolve_used_update_types())
+    logging.info("Webhook слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await dp.emit_startup(bot=bot)
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Остановка webhook: ждём обработки %s обновлений", processor.pending)
+        # Сначала перестаём принимать запросы, затем дорабатываем очередь
+        await site.stop()
+        await processor.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)